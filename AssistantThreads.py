@@ -0,0 +1,73 @@
+import threading
+from collections import deque
+
+
+class AssistantThreadPool:
+    """Keeps a few empty assistant threads ready so calls don't wait on threads.create().
+
+    Threads are never shared between calls: a checked-out thread belongs to
+    that call, and released threads are deleted in the background while the
+    pool is topped back up.
+    """
+
+    def __init__(self, client_factory, size=4):
+        self.client_factory = client_factory
+        self.size = size
+        self.idle = deque()
+        self.lock = threading.Lock()
+        self.refilling = False
+        self.hits = 0
+        self.misses = 0
+
+    def start(self):
+        """Fill the pool in the background."""
+        self._schedule_refill()
+
+    def checkout(self):
+        """Return a fresh thread, from the pool when one is ready."""
+        with self.lock:
+            thread = self.idle.popleft() if self.idle else None
+            if thread is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        self._schedule_refill()
+        if thread is None:
+            thread = self.client_factory().beta.threads.create()
+        return thread
+
+    def release(self, thread):
+        """Delete a finished call's thread without blocking the caller."""
+        threading.Thread(target=self._delete, args=(thread,), daemon=True).start()
+
+    def _delete(self, thread):
+        try:
+            self.client_factory().beta.threads.delete(thread.id)
+        except Exception as e:
+            print(f"Error deleting assistant thread: {e}")
+
+    def _schedule_refill(self):
+        with self.lock:
+            if self.refilling or len(self.idle) >= self.size:
+                return
+            self.refilling = True
+        threading.Thread(target=self._refill, daemon=True).start()
+
+    def _refill(self):
+        try:
+            while True:
+                with self.lock:
+                    if len(self.idle) >= self.size:
+                        return
+                thread = self.client_factory().beta.threads.create()
+                with self.lock:
+                    self.idle.append(thread)
+        except Exception as e:
+            print(f"Error pre-creating assistant threads: {e}")
+        finally:
+            with self.lock:
+                self.refilling = False
+
+    def stats(self):
+        with self.lock:
+            return {'idle': len(self.idle), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,451 @@
+import asyncio
+import time
+import numpy as np
+
+from AudioBuffer import SpeechRingBuffer, encode_wav
+from AudioSource import ArraySource
+from IncidentState import IncidentState
+from ThreadContext import ThreadContext
+from Transcription import transcription_pool
+from TextToSpeech import SentenceSplitter, SoundDeviceSink, default_sink, split_sentences
+from VoiceActivity import create_vad, AdaptiveEndpointer
+
+
+async def audio_blocks(source, blocksize, keep_running=lambda: True):
+    """Yield int16 blocks from an AudioSource or an async iterator without blocking the loop."""
+    if hasattr(source, '__aiter__'):
+        async for block in source:
+            yield block
+        return
+
+    loop = asyncio.get_running_loop()
+    if isinstance(source, ArraySource):
+        # Recorded audio is paced with asyncio.sleep, so replays need no thread
+        block_time = blocksize / source.sample_rate
+        started = loop.time()
+        for i, block in enumerate(source.blocks(blocksize)):
+            if not keep_running():
+                return
+            delay = started + i * block_time / source.speed - loop.time() if source.speed else 0
+            await asyncio.sleep(max(delay, 0))
+            yield block
+        return
+
+    # A live device or pipe blocks in its own loop, so it runs on a worker thread
+    blocks = asyncio.Queue()
+
+    def callback(indata, frames, time_info, status):
+        loop.call_soon_threadsafe(blocks.put_nowait, indata.copy())
+
+    producer = loop.run_in_executor(None, source.run, callback, blocksize, keep_running)
+    producer.add_done_callback(lambda _: blocks.put_nowait(None))
+    while True:
+        block = await blocks.get()
+        if block is None:
+            return
+        yield block
+
+
+class AsyncEmergencyDispatcher:
+    """One call as a set of asyncio tasks on the async OpenAI client.
+
+    capture -> segment -> transcribe -> respond -> speak -> play, joined by
+    asyncio queues. A call holds no OS thread of its own, so one event loop
+    can carry hundreds of calls. Each stage passes None downstream when its
+    input ends, so a replayed call drains completely before run() returns.
+    """
+
+    def __init__(self, session_id, client, assistant_id, source=None, sink=None, events=None,
+                 greeting=None, cache=None, streets=None, geocoder=None, transcriber=None):
+        self.session_id = session_id
+        self.client = client
+        self.assistant_id = assistant_id
+        self.source = source
+        self.sink = sink or default_sink()
+        self.events = events
+        self.greeting = greeting
+        self.cache = cache
+        self.geocoder = geocoder
+        self.transcriber = transcriber  # A blocking backend such as local Whisper; None uses the client
+
+        # Same audio and detection settings as EmergencyDispatcher
+        self.sample_rate = 16000
+        self.channels = 1
+        self.chunk_duration = 0.05
+        self.chunk_samples = int(self.sample_rate * self.chunk_duration)
+        self.speech_threshold = 700
+        self.vad_type = "energy"
+        self.vad = create_vad(self.vad_type, threshold=self.speech_threshold, sample_rate=self.sample_rate)
+        self.silence_duration = 1.5
+        self.adaptive_silence = True
+        self.endpointer = AdaptiveEndpointer(min_silence=0.5, max_silence=self.silence_duration)
+        self.min_audio_length = 0.05
+        self.max_utterance_duration = 30.0
+        self.preroll_duration = 0.3
+        self.speech_frames = SpeechRingBuffer(
+            capacity=int(self.sample_rate * self.max_utterance_duration),
+            preroll=int(self.sample_rate * self.preroll_duration),
+            channels=self.channels
+        )
+
+        self.tts_model = "tts-1"
+        self.tts_voice = "shimmer"
+        self.tts_chunk_size = 4800
+        self.run_timeout = 30
+        self.max_pending_utterances = 8
+        self.synthesis_concurrency = 4  # Sentences of one reply synthesized at once
+
+        self.call_in_progress = True
+        self.current_address = None
+        self.incident = IncidentState(call_id=session_id, streets=streets)
+        self.context = ThreadContext()
+        self.thread = None
+        self.thread_task = None
+        self.tasks = []
+        self.dropped_utterances = 0
+
+        # Barge-in: caller speech during a reply cancels the turn and its audio
+        self.barge_in_enabled = False  # Needs a headset or echo cancellation, see EmergencyDispatcher
+        self.barge_in_frames = 6
+        self.cancel_timeout = 2.0
+        self.generation = 0  # Sentences and audio from an older generation are dropped
+        self.turn = None
+        self.active_run_id = None
+        self.run_id_unknown = False  # A turn was cut off before its run id was seen
+        self.interruptions = 0
+
+    def publish(self, event, data):
+        if self.events is not None:
+            self.events.publish_call(self.session_id, event, data)
+
+    async def run(self):
+        """Run the call until the audio ends or cleanup() is called."""
+        utterances = asyncio.Queue(maxsize=self.max_pending_utterances)
+        transcripts = asyncio.Queue()
+        sentences = asyncio.Queue()
+        playback = asyncio.Queue()
+
+        # The assistant thread is created while the greeting plays
+        self.thread_task = asyncio.create_task(self.client.beta.threads.create())
+        if self.greeting:
+            for sentence in split_sentences(self.greeting):
+                sentences.put_nowait((self.generation, sentence))
+
+        self.tasks = [
+            asyncio.create_task(self.segment(utterances)),
+            asyncio.create_task(self.transcribe(utterances, transcripts)),
+            asyncio.create_task(self.respond(transcripts, sentences)),
+            asyncio.create_task(self.speak(sentences, playback)),
+            asyncio.create_task(self.play(playback))
+        ]
+        try:
+            await asyncio.gather(*self.tasks)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await self.cleanup()
+
+    async def segment(self, utterances):
+        """Capture audio and cut it into utterances with the voice activity detector."""
+        is_recording = False
+        silence_frames = 0
+        speech_streak = 0
+        window = self.silence_duration
+        since_turn = None
+        try:
+            async for block in audio_blocks(self.source, self.chunk_samples, lambda: self.call_in_progress):
+                if self.vad.is_speech(block):
+                    speech_streak += 1
+                    if speech_streak >= self.barge_in_frames and self.responding:
+                        self.interrupt()
+                    if not is_recording:
+                        is_recording = True
+                        self.speech_frames.start()
+                        if since_turn is not None:
+                            self.endpointer.observe_resumed(window, since_turn * self.chunk_duration)
+                            since_turn = None
+                    elif silence_frames:
+                        self.endpointer.observe_pause(silence_frames * self.chunk_duration)
+                    fits = self.speech_frames.append(block)
+                    silence_frames = 0
+                elif is_recording:
+                    speech_streak = 0
+                    silence_frames += 1
+                    fits = self.speech_frames.append(block)
+                else:
+                    speech_streak = 0
+                    if since_turn is not None:
+                        since_turn += 1
+                    self.speech_frames.push_preroll(block)
+                    continue
+
+                if silence_frames * self.chunk_duration >= window or not fits:
+                    self.enqueue_utterance(utterances)
+                    is_recording = False
+                    silence_frames = 0
+                    since_turn = 0
+                    if self.adaptive_silence:
+                        window = self.endpointer.window()
+            if is_recording:
+                self.enqueue_utterance(utterances)
+        except Exception as e:
+            print(f"Error in audio stream: {e}")
+        finally:
+            await utterances.put(None)
+
+    def enqueue_utterance(self, utterances):
+        if len(self.speech_frames):
+            try:
+                utterances.put_nowait(self.speech_frames.view().copy())
+            except asyncio.QueueFull:
+                self.dropped_utterances += 1
+                print("Processing queue full - utterance dropped")
+        self.speech_frames.clear()
+
+    async def transcribe(self, utterances, transcripts):
+        while True:
+            audio = await utterances.get()
+            if audio is None:
+                break
+            if len(audio) / self.sample_rate < self.min_audio_length:
+                continue
+            try:
+                if self.transcriber is not None:
+                    loop = asyncio.get_running_loop()
+                    text = await loop.run_in_executor(transcription_pool, self.transcriber.transcribe, audio)
+                else:
+                    transcript = await self.client.audio.transcriptions.create(
+                        model="whisper-1",
+                        file=("speech.wav", encode_wav(audio, self.sample_rate, self.channels), "audio/wav"),
+                        response_format="text"
+                    )
+                    text = transcript.strip() if isinstance(transcript, str) else transcript.text.strip()
+                if text:
+                    print(f"Caller: {text}")
+                    await transcripts.put(text)
+            except Exception as e:
+                print(f"Error processing speech: {e}")
+        await transcripts.put(None)
+
+    @property
+    def responding(self):
+        return self.turn is not None and not self.turn.done()
+
+    async def respond(self, transcripts, sentences):
+        while True:
+            text = await transcripts.get()
+            if text is None:
+                break
+            # Each turn is its own task so barge-in can cancel just the turn
+            turn = self.turn = asyncio.create_task(self.handle_input(text, sentences))
+            try:
+                await asyncio.wait({turn})
+            except asyncio.CancelledError:
+                turn.cancel()
+                raise
+            if turn.cancelled():
+                await self.cancel_run()
+            elif turn.exception() is not None:
+                print(f"Error handling input: {turn.exception()}")
+        await sentences.put(None)
+
+    def interrupt(self):
+        """The caller barged in: drop queued audio and cancel the turn in flight."""
+        if not self.barge_in_enabled or not self.responding:
+            return
+        self.interruptions += 1
+        self.generation += 1
+        self.turn.cancel()
+        abort = getattr(self.sink, 'abort', None)
+        if abort is not None:
+            abort()
+
+    async def cancel_run(self):
+        """Stop the interrupted run so the thread accepts the caller's next message."""
+        run_id, self.active_run_id = self.active_run_id, None
+        unknown, self.run_id_unknown = self.run_id_unknown, False
+        try:
+            if run_id is None and unknown:
+                # Cut off while the run was being started: cancel the thread's newest run if it is live
+                runs = await self.client.beta.threads.runs.list(thread_id=self.thread.id, limit=1)
+                live = [run for run in runs.data if run.status in ('queued', 'in_progress', 'requires_action')]
+                run_id = live[0].id if live else None
+            if run_id is None:
+                return
+            run = await self.client.beta.threads.runs.cancel(run_id=run_id, thread_id=self.thread.id)
+            deadline = time.time() + self.cancel_timeout
+            while run.status in ('queued', 'in_progress', 'requires_action', 'cancelling') \
+                    and time.time() < deadline:
+                await asyncio.sleep(0.1)
+                run = await self.client.beta.threads.runs.retrieve(thread_id=self.thread.id, run_id=run_id)
+        except Exception as e:
+            print(f"Error cancelling run: {e}")
+
+    async def handle_input(self, text, sentences):
+        """Send one caller turn to the assistant and stream the reply into sentences."""
+        self.publish('transcript_update', {
+            'role': 'caller', 'message': text, 'timestamp': time.strftime('%H:%M:%S')
+        })
+        self.update_incident(text, 'caller')
+
+        if self.thread is None:
+            self.thread = await self.thread_task
+        message = await self.client.beta.threads.messages.create(thread_id=self.thread.id, role="user", content=text)
+        self.context.add('user', text, message.id)
+
+        response_id = f"{self.thread.id}-{time.time()}"
+        generation = self.generation
+        splitter = SentenceSplitter()
+        parts = []
+        stream = None
+        try:
+            async with self.client.beta.threads.runs.stream(
+                thread_id=self.thread.id,
+                assistant_id=self.assistant_id,
+                timeout=self.run_timeout,
+                **self.context.run_options(self.incident.facts())
+            ) as stream:
+                async for delta in stream.text_deltas:
+                    if self.active_run_id is None and getattr(stream, 'current_run', None) is not None:
+                        self.active_run_id = stream.current_run.id
+                    parts.append(delta)
+                    self.publish('transcript_update', {
+                        'role': 'dispatcher', 'message': delta, 'message_id': response_id,
+                        'partial': True, 'timestamp': time.strftime('%H:%M:%S')
+                    })
+                    for sentence in splitter.feed(delta):
+                        await sentences.put((generation, sentence))
+                reply_id = getattr(getattr(stream, 'current_message_snapshot', None), 'id', None)
+        except asyncio.CancelledError:
+            # The run is known from its created event even when no token has arrived yet
+            current_run = getattr(stream, 'current_run', None)
+            if self.active_run_id is None and current_run is not None:
+                self.active_run_id = current_run.id
+            self.run_id_unknown = self.active_run_id is None
+            self.context.add('assistant', "".join(parts).strip())
+            self.publish('transcript_update', {
+                'role': 'dispatcher', 'message': "".join(parts).strip(), 'message_id': response_id,
+                'interrupted': True, 'timestamp': time.strftime('%H:%M:%S')
+            })
+            raise
+        self.active_run_id = None
+        remainder = splitter.flush()
+        if remainder:
+            await sentences.put((generation, remainder))
+
+        response = "".join(parts).strip()
+        self.context.add('assistant', response, reply_id)
+        if response:
+            self.publish('transcript_update', {
+                'role': 'dispatcher', 'message': response, 'message_id': response_id,
+                'timestamp': time.strftime('%H:%M:%S')
+            })
+            self.update_incident(response, 'dispatcher')
+        return response
+
+    def update_incident(self, text, role):
+        changes = self.incident.apply(text, role)
+        if 'location' in changes:
+            self.current_address = self.incident.value('location')
+            if self.geocoder is not None:
+                self.geocoder.prefetch(self.current_address)
+        if changes:
+            self.publish('incident_diff', self.incident.diff_event(changes))
+        return changes
+
+    async def speak(self, sentences, playback):
+        """Start synthesizing each sentence as it arrives; play() keeps them in order."""
+        limit = asyncio.Semaphore(self.synthesis_concurrency)
+        while True:
+            item = await sentences.get()
+            if item is None:
+                break
+            generation, sentence = item
+            if generation != self.generation:
+                continue  # Part of a reply the caller talked over
+            chunks = asyncio.Queue()
+            await limit.acquire()
+            task = asyncio.create_task(self.synthesize(sentence, chunks))
+            task.add_done_callback(lambda _: limit.release())
+            await playback.put((generation, chunks, task))
+        await playback.put(None)
+
+    async def synthesize(self, text, chunks):
+        key = None
+        try:
+            if self.cache is not None:
+                key = self.cache.key(text, self.tts_model, self.tts_voice)
+                data = self.cache.recall(key)
+                if data is None:
+                    # Only the memory lookup runs on the loop; the disk read goes to a thread
+                    data = await asyncio.to_thread(self.cache.load, key)
+                if data is not None:
+                    await chunks.put(data)
+                    return
+            parts = []
+            async with self.client.audio.speech.with_streaming_response.create(
+                model=self.tts_model, voice=self.tts_voice, input=text, response_format="pcm"
+            ) as response:
+                async for chunk in response.iter_bytes(self.tts_chunk_size):
+                    parts.append(chunk)
+                    await chunks.put(chunk)
+            if key is not None and parts:
+                self.cache.put(key, b"".join(parts))
+        except Exception as e:
+            print(f"Text-to-speech error: {e}")
+        finally:
+            await chunks.put(None)
+
+    async def play(self, playback):
+        # A device sink blocks while it plays, so it is written from a worker thread
+        blocking = isinstance(self.sink, SoundDeviceSink)
+        while True:
+            item = await playback.get()
+            if item is None:
+                break
+            generation, chunks, task = item
+            leftover = b""
+            while True:
+                if generation != self.generation:
+                    task.cancel()
+                    break
+                chunk = await chunks.get()
+                if chunk is None:
+                    break
+                if generation != self.generation:
+                    continue  # Cancelled at the top of the loop
+                data = leftover + chunk
+                usable = len(data) - len(data) % 2
+                leftover = data[usable:]
+                if usable:
+                    samples = np.frombuffer(data[:usable], dtype='<i2')
+                    if blocking:
+                        await asyncio.to_thread(self.sink.write, samples)
+                    else:
+                        self.sink.write(samples)
+
+    def stop(self):
+        """Stop capturing; utterances already recorded are still answered."""
+        self.call_in_progress = False
+
+    def cancel(self):
+        """End the call now, abandoning any work in flight."""
+        self.call_in_progress = False
+        for task in self.tasks:
+            task.cancel()
+
+    async def cleanup(self):
+        self.call_in_progress = False
+        self.sink.close()
+        if self.thread_task is not None and self.thread is None:
+            self.thread_task.cancel()
+            try:
+                self.thread = await self.thread_task
+            except BaseException:
+                pass
+        if self.thread is not None:
+            thread, self.thread = self.thread, None
+            try:
+                await self.client.beta.threads.delete(thread.id)
+            except Exception as e:
+                print(f"Error deleting assistant thread: {e}")
@@ -0,0 +1,93 @@
+import io
+import wave
+import numpy as np
+
+
+class SpeechRingBuffer:
+    """Preallocated int16 storage for one utterance plus a pre-roll ring.
+
+    While nobody is speaking, chunks go into a small ring that always holds
+    the most recent audio. When speech starts, the ring is unrolled into the
+    front of the utterance buffer so the first syllable is not lost. Memory
+    per call is fixed at construction time.
+    """
+
+    def __init__(self, capacity, preroll=0, channels=1):
+        self.capacity = capacity
+        self.channels = channels
+        self.buffer = np.zeros((capacity, channels), dtype=np.int16)
+        self.length = 0
+
+        self.preroll = np.zeros((preroll, channels), dtype=np.int16)
+        self.preroll_pos = 0
+        self.preroll_fill = 0
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def nbytes(self):
+        """Bytes held by this buffer, independent of how much audio it contains."""
+        return self.buffer.nbytes + self.preroll.nbytes
+
+    @property
+    def full(self):
+        return self.length >= self.capacity
+
+    def _as_frames(self, chunk):
+        return np.asarray(chunk, dtype=np.int16).reshape(-1, self.channels)
+
+    def push_preroll(self, chunk):
+        """Remember a chunk of background audio, overwriting the oldest."""
+        size = len(self.preroll)
+        if size == 0:
+            return
+        chunk = self._as_frames(chunk)[-size:]
+        n = len(chunk)
+
+        first = min(n, size - self.preroll_pos)
+        self.preroll[self.preroll_pos:self.preroll_pos + first] = chunk[:first]
+        self.preroll[:n - first] = chunk[first:]
+        self.preroll_pos = (self.preroll_pos + n) % size
+        self.preroll_fill = min(self.preroll_fill + n, size)
+
+    def start(self):
+        """Begin a new utterance, seeded with the pre-roll audio in order."""
+        self.length = 0
+        fill = min(self.preroll_fill, self.capacity)
+        if fill:
+            oldest = (self.preroll_pos - fill) % len(self.preroll)
+            first = min(fill, len(self.preroll) - oldest)
+            self.buffer[:first] = self.preroll[oldest:oldest + first]
+            self.buffer[first:fill] = self.preroll[:fill - first]
+            self.length = fill
+        self.preroll_pos = 0
+        self.preroll_fill = 0
+
+    def append(self, chunk):
+        """Append a chunk; returns False once the buffer is full and audio was cut."""
+        chunk = self._as_frames(chunk)
+        n = min(len(chunk), self.capacity - self.length)
+        self.buffer[self.length:self.length + n] = chunk[:n]
+        self.length += n
+        return n == len(chunk)
+
+    def view(self):
+        """Zero-copy view of the current utterance; valid until the next clear()."""
+        return self.buffer[:self.length]
+
+    def clear(self):
+        self.length = 0
+
+
+def encode_wav(audio_data, sample_rate=16000, channels=1):
+    """Encode int16 samples as WAV bytes without a temporary file."""
+    samples = np.ascontiguousarray(audio_data, dtype=np.int16)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wf:
+        wf.setnchannels(channels)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        # Hand wave the array's own memory instead of a tobytes() copy
+        wf.writeframes(memoryview(samples).cast('B'))
+    return buffer.getvalue()
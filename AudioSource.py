@@ -0,0 +1,130 @@
+import time
+import wave
+import numpy as np
+
+try:
+    import sounddevice as sd
+except (ImportError, OSError):
+    # PortAudio is missing on headless servers; calls can still be replayed from files
+    sd = None
+
+
+class AudioSource:
+    """Feeds int16 blocks to a sounddevice-style callback(indata, frames, time_info, status).
+
+    run() blocks until the source is exhausted or keep_running() returns
+    False, so the dispatcher drives a live microphone and a recorded call
+    through exactly the same callback, VAD and segmentation code.
+    """
+
+    def __init__(self, sample_rate=16000, channels=1):
+        self.sample_rate = sample_rate
+        self.channels = channels
+
+    def run(self, callback, blocksize, keep_running):
+        raise NotImplementedError
+
+
+class MicrophoneSource(AudioSource):
+    """Live capture from the default input device."""
+
+    def run(self, callback, blocksize, keep_running):
+        if sd is None:
+            raise RuntimeError("sounddevice/PortAudio is not available; use a file or array source")
+        with sd.InputStream(
+            channels=self.channels,
+            samplerate=self.sample_rate,
+            blocksize=blocksize,
+            callback=callback,
+            dtype=np.int16
+        ):
+            print("Listening for speech...")
+            while keep_running():
+                time.sleep(0.1)
+
+
+class ArraySource(AudioSource):
+    """Replays a numpy array of samples.
+
+    speed is a multiple of real time (1.0 paces blocks like a microphone
+    would); speed=None delivers blocks as fast as the callback takes them.
+    pad_silence appends that many seconds of silence so the final utterance
+    is ended by the normal silence detection.
+    """
+
+    def __init__(self, audio, sample_rate=16000, channels=1, speed=1.0, pad_silence=2.0):
+        super().__init__(sample_rate, channels)
+        audio = np.asarray(audio, dtype=np.int16).reshape(-1, channels)
+        if pad_silence:
+            padding = np.zeros((int(pad_silence * sample_rate), channels), dtype=np.int16)
+            audio = np.concatenate([audio, padding])
+        self.audio = audio
+        self.speed = speed
+
+    @property
+    def duration(self):
+        return len(self.audio) / self.sample_rate
+
+    def blocks(self, blocksize):
+        # Views into the array; the callback copies what it keeps
+        for start in range(0, len(self.audio) - blocksize + 1, blocksize):
+            yield self.audio[start:start + blocksize]
+
+    def run(self, callback, blocksize, keep_running):
+        block_time = blocksize / self.sample_rate
+        started = time.perf_counter()
+        for i, block in enumerate(self.blocks(blocksize)):
+            if not keep_running():
+                break
+            if self.speed:
+                delay = started + i * block_time / self.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            callback(block, blocksize, None, None)
+
+
+class WavFileSource(ArraySource):
+    """Replays a 16-bit PCM WAV file, e.g. a recorded call."""
+
+    def __init__(self, path, sample_rate=16000, channels=1, **kwargs):
+        with wave.open(path, 'rb') as wf:
+            if wf.getsampwidth() != 2:
+                raise ValueError(f"{path}: expected 16-bit PCM audio")
+            if wf.getframerate() != sample_rate or wf.getnchannels() != channels:
+                raise ValueError(
+                    f"{path}: expected {sample_rate} Hz with {channels} channel(s), "
+                    f"got {wf.getframerate()} Hz with {wf.getnchannels()}"
+                )
+            audio = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+        super().__init__(audio, sample_rate, channels, **kwargs)
+
+
+class PcmStreamSource(AudioSource):
+    """Reads raw little-endian int16 PCM from a binary stream (pipe, socket file, stdin)."""
+
+    def __init__(self, stream, sample_rate=16000, channels=1, speed=None):
+        super().__init__(sample_rate, channels)
+        self.stream = stream
+        self.speed = speed
+
+    def run(self, callback, blocksize, keep_running):
+        block_bytes = blocksize * self.channels * 2
+        block_time = blocksize / self.sample_rate
+        started = time.perf_counter()
+        i = 0
+        pending = b""
+        while keep_running():
+            data = self.stream.read(block_bytes - len(pending))
+            if not data:
+                break
+            pending += data
+            if len(pending) < block_bytes:
+                continue
+            block = np.frombuffer(pending, dtype='<i2').reshape(-1, self.channels)
+            pending = b""
+            if self.speed:
+                delay = started + i * block_time / self.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            callback(block, blocksize, None, None)
+            i += 1
@@ -0,0 +1,317 @@
+import argparse
+import contextlib
+import json
+import resource
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import openai
+
+import Main
+from AudioSource import ArraySource, WavFileSource
+from FakeOpenAIServer import FakeOpenAIServer
+from Geocoding import Geocoder, GeocodeCache, GazetteerBackend
+from TextToSpeech import NullSink
+
+# Stages of one caller turn, each measured between two points on the timeline:
+#   endpoint       last speech frame -> utterance handed to the pipeline (the silence window)
+#   queue          handed over -> a worker starts on it
+#   transcription  speech recognition, by whichever backend is configured
+#   first_token    transcript ready -> first token of the reply
+#   first_audio    first token -> first synthesized audio at the sink
+#   end_to_end     last speech frame -> first audio
+STAGES = {
+    'endpoint': ('speech_end', 'enqueued'),
+    'queue': ('enqueued', 'started'),
+    'transcription': ('started', 'transcribed'),
+    'first_token': ('transcribed', 'first_token'),
+    'first_audio': ('first_token', 'first_audio'),
+    'end_to_end': ('speech_end', 'first_audio'),
+}
+
+
+class Turn:
+    def __init__(self, speech_end, enqueued):
+        self.speech_end = speech_end
+        self.enqueued = enqueued
+        self.started = None
+        self.transcribed = None
+        self.first_token = None
+        self.first_audio = None
+        self.interrupted = False
+
+    def durations(self):
+        durations = {}
+        for stage, (start, end) in STAGES.items():
+            start, end = getattr(self, start), getattr(self, end)
+            if start is not None and end is not None:
+                durations[stage] = end - start
+        return durations
+
+
+class ProbeSink(NullSink):
+    """Discards audio like NullSink, noting when each reply's first audio arrives."""
+
+    def __init__(self, probe):
+        super().__init__()
+        self.probe = probe
+
+    def write(self, samples):
+        self.probe.audio_written()
+        super().write(samples)
+
+
+class CallProbe:
+    """Timestamps one call's turns by wrapping the dispatcher's stage boundaries.
+
+    It also stands in for the event fanout, so reply tokens are seen as
+    they are published. Utterances of one call are handled in order, so the
+    turn being processed is always the oldest one handed over.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.sink = ProbeSink(self)
+        self.turns = []
+        self.pending = deque()
+        self.current = None
+        self.last_speech = None
+        self.lock = threading.Lock()
+
+    def attach(self, dispatcher):
+        is_speech = dispatcher.vad.is_speech
+        enqueue_utterance = dispatcher.enqueue_utterance
+        process_recorded_speech = dispatcher.process_recorded_speech
+        transcribe = dispatcher.transcribe
+        interrupt = dispatcher.interrupt
+
+        def timed_is_speech(block):
+            speech = is_speech(block)
+            if speech:
+                self.last_speech = self.clock()
+            return speech
+
+        def timed_enqueue():
+            with self.lock:
+                self.pending.append(Turn(self.last_speech, self.clock()))
+            enqueue_utterance()
+
+        def timed_process(audio_data=None):
+            with self.lock:
+                self.current = self.pending.popleft() if self.pending else None
+                if self.current is not None:
+                    self.current.started = self.clock()
+            process_recorded_speech(audio_data)
+
+        def timed_transcribe(audio_data):
+            transcript = transcribe(audio_data)
+            with self.lock:
+                if self.current is not None and transcript:
+                    self.current.transcribed = self.clock()
+                    self.turns.append(self.current)
+            return transcript
+
+        def noted_interrupt():
+            with self.lock:
+                if self.current is not None:
+                    self.current.interrupted = True
+            interrupt()
+
+        dispatcher.vad.is_speech = timed_is_speech
+        dispatcher.enqueue_utterance = timed_enqueue
+        dispatcher.process_recorded_speech = timed_process
+        dispatcher.transcribe = timed_transcribe
+        dispatcher.interrupt = noted_interrupt
+
+    def publish_call(self, call_id, event, data):
+        if event != 'transcript_update' or data.get('role') != 'dispatcher':
+            return
+        with self.lock:
+            turn = self.current
+            if turn is None or turn.transcribed is None:
+                return
+            if turn.first_token is None:
+                turn.first_token = self.clock()
+
+    def audio_written(self):
+        with self.lock:
+            turn = self.current
+            if turn is not None and turn.transcribed is not None and turn.first_audio is None:
+                turn.first_audio = self.clock()
+
+
+def synthetic_call(turns=3, speech=2.0, pause=6.0, sample_rate=16000, seed=0):
+    """Voice-like bursts (a harmonic buzz with a syllable envelope) between quiet gaps.
+
+    The gaps leave room for the reply; a caller who speaks again before it
+    finishes barges in and that turn gets no first-audio time.
+    """
+    rng = np.random.default_rng(seed)
+    parts = [rng.normal(0, 60, sample_rate).astype(np.int16)]
+    for _ in range(turns):
+        t = np.arange(int(speech * sample_rate)) / sample_rate
+        pitch = rng.uniform(110, 220) + 20 * np.sin(2 * np.pi * 0.7 * t)
+        phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+        voiced = sum(np.sin(k * phase) / k for k in range(1, 8))
+        envelope = 0.55 + 0.45 * np.sin(2 * np.pi * 4 * t)
+        parts.append((2500 * envelope * voiced + rng.normal(0, 60, len(t))).astype(np.int16))
+        parts.append(rng.normal(0, 60, int(pause * sample_rate)).astype(np.int16))
+    return np.concatenate(parts)
+
+
+def summarize(values):
+    if not values:
+        return None
+    ms = np.asarray(values) * 1000
+    return {
+        'count': len(values),
+        'mean_ms': round(float(ms.mean()), 2),
+        'p50_ms': round(float(np.percentile(ms, 50)), 2),
+        'p95_ms': round(float(np.percentile(ms, 95)), 2),
+        'p99_ms': round(float(np.percentile(ms, 99)), 2)
+    }
+
+
+def resource_usage():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss_mb = usage.ru_maxrss / (1024 * 1024) if sys.platform == 'darwin' else usage.ru_maxrss / 1024
+    return usage.ru_utime + usage.ru_stime, rss_mb
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_call(index, client, audio, speed, use_cache, timeout):
+    probe = CallProbe()
+    dispatcher = Main.EmergencyDispatcher(
+        session_id=f"bench-{index}", client=client, audio_sink=probe.sink, events=probe
+    )
+    if not use_cache:
+        dispatcher.speaker.cache = None
+    probe.attach(dispatcher)
+    try:
+        dispatcher.record_and_process(ArraySource(audio, speed=speed))
+        dispatcher.pipeline.wait_for(dispatcher.call_key, timeout=timeout)
+    finally:
+        dispatcher.cleanup()
+    return probe.turns
+
+
+def run_benchmark(calls=10, concurrency=4, audio=None, speed=1.0, latency_scale=1.0, error_rate=0.0,
+                  seed=None, use_cache=False, timeout=60):
+    """Replay `calls` calls, `concurrency` at a time, against a local fake API; returns the report."""
+    audio = synthetic_call() if audio is None else audio
+    server = FakeOpenAIServer(latency_scale=latency_scale, error_rate=error_rate, seed=seed).start()
+    client = openai.OpenAI(base_url=server.url, api_key="benchmark", max_retries=0)
+    # Offline geocoding: incident updates must not reach the real Nominatim
+    Main._geocoder = Geocoder(GazetteerBackend({}), GeocodeCache())
+
+    turns = []
+    failed = 0
+    cpu_before, _ = resource_usage()
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(run_call, i, client, audio, speed, use_cache, timeout)
+                       for i in range(calls)]
+            for future in futures:
+                try:
+                    turns.extend(future.result())
+                except Exception as e:
+                    failed += 1
+                    print(f"Benchmark call failed: {e}")
+        wall = time.perf_counter() - started
+    finally:
+        server.stop()
+    cpu_after, max_rss_mb = resource_usage()
+
+    durations = [turn.durations() for turn in turns]
+    return {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {
+            'calls': calls, 'concurrency': concurrency, 'speed': speed, 'latency_scale': latency_scale,
+            'error_rate': error_rate, 'seed': seed, 'use_cache': use_cache,
+            'call_seconds': round(len(audio) / 16000, 2)
+        },
+        'wall_seconds': round(wall, 3),
+        'calls_per_second': round((calls - failed) / wall, 3),
+        'turns': len(turns),
+        'turns_without_audio': sum(1 for turn in turns if turn.first_audio is None),
+        'interrupted_turns': sum(1 for turn in turns if turn.interrupted),
+        'failed_calls': failed,
+        'latency': {stage: summarize([d[stage] for d in durations if stage in d]) for stage in STAGES},
+        'resources': {
+            'cpu_seconds': round(cpu_after - cpu_before, 3),
+            'cpu_percent': round(100 * (cpu_after - cpu_before) / wall, 1),
+            'max_rss_mb': round(max_rss_mb, 1)
+        },
+        'fake_server': server.stats()
+    }
+
+
+def compare(baseline, report, tolerance=0.1):
+    """Regressions of report against baseline: stage p95s or throughput worse by more than tolerance."""
+    regressions = []
+    for stage, current in report['latency'].items():
+        before = baseline.get('latency', {}).get(stage)
+        if before and current and current['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{stage} p95 {before['p95_ms']} ms -> {current['p95_ms']} ms")
+    before = baseline.get('calls_per_second')
+    if before and report['calls_per_second'] < before * (1 - tolerance):
+        regressions.append(f"calls/s {before} -> {report['calls_per_second']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end latency benchmark for the call pipeline")
+    parser.add_argument("--calls", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--audio", help="16 kHz mono 16-bit WAV of a recorded call (default: synthetic)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Replay speed as a multiple of real time; 0 replays as fast as possible")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Scale of the fake API's latencies")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--use-cache", action="store_true", help="Let replies hit the speech cache")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="Earlier JSON report; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    audio = WavFileSource(args.audio).audio[:, 0] if args.audio else None
+    # The dispatcher's progress lines go to stderr so stdout stays valid JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_benchmark(args.calls, args.concurrency, audio, args.speed or None, args.latency_scale,
+                               args.error_rate, args.seed, args.use_cache)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        end_to_end = report['latency']['end_to_end'] or {}
+        print(f"{report['turns']} turns, {report['calls_per_second']} calls/s, "
+              f"end to end p50 {end_to_end.get('p50_ms')} ms p95 {end_to_end.get('p95_ms')} ms")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+
+SUPERVISOR_ROOM = "supervisors"
+
+
+def call_room(call_id):
+    return f"call-{call_id}"
+
+
+def transcript_key(data):
+    # Streamed tokens and the final text of one reply share its message_id
+    message_id = data.get('message_id')
+    return ('transcript', message_id) if message_id else None
+
+
+def merge_transcript(old, new):
+    if new.get('partial') and old.get('partial'):
+        return dict(new, message=old['message'] + new['message'])
+    # The final message replaces whatever tokens had not been sent yet
+    return new
+
+
+def incident_key(data):
+    return ('incident', data.get('call_id'))
+
+
+def merge_incident_diff(old, new):
+    changes = {field: dict(change) for field, change in old['changes'].items()}
+    for field, change in new['changes'].items():
+        merged = changes.setdefault(field, {})
+        # A new scalar value replaces the old one; confidence updates and
+        # list entries (keyed by item) are folded in
+        if 'value' in change:
+            merged.clear()
+        merged.update(change)
+    return dict(new, changes=changes)
+
+
+# event -> (coalescing key, merge); events without an entry are never merged
+COALESCING = {
+    'transcript_update': (transcript_key, merge_transcript),
+    'incident_diff': (incident_key, merge_incident_diff)
+}
+
+
+class ClientQueue:
+    def __init__(self):
+        self.rooms = set()
+        self.entries = OrderedDict()  # (room, event, key) or (room, n) -> [event, data]
+        self.unacked = deque()  # send times of frames the client has not acknowledged
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class EventFanout:
+    """Batches outbound Socket.IO events per client on a background thread.
+
+    publish() never blocks: events go into a bounded queue for each client
+    in the room and a flusher thread sends each client one 'event_batch'
+    frame per interval. The client acknowledges every frame, and a client
+    with max_unacked frames outstanding gets nothing more until it catches
+    up. Updates that supersede each other (streamed tokens of one reply,
+    incident diffs of one call) keep merging while they wait, and when a
+    client falls too far behind its oldest streamed tokens are dropped.
+    Frames unacknowledged after ack_timeout are written off.
+    """
+
+    def __init__(self, emit, flush_interval=0.05, max_queued=256, max_unacked=2, ack_timeout=10.0,
+                 clock=time.monotonic):
+        self.emit = emit
+        self.flush_interval = flush_interval
+        self.max_queued = max_queued
+        self.max_unacked = max_unacked
+        self.ack_timeout = ack_timeout
+        self.clock = clock
+        self.rooms = {}  # room -> set of client ids
+        self.clients = {}  # client id -> ClientQueue
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.flusher = None
+        self.running = True
+        self.sequence = itertools.count()
+        self.published = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.frames = 0
+        self.held = 0
+
+    def join(self, client, room):
+        with self.lock:
+            self.rooms.setdefault(room, set()).add(client)
+            self.clients.setdefault(client, ClientQueue()).rooms.add(room)
+
+    def leave(self, client, room):
+        with self.lock:
+            self.rooms.get(room, set()).discard(client)
+            queue = self.clients.get(client)
+            if queue is not None:
+                queue.rooms.discard(room)
+                for entry_key in [k for k in queue.entries if k[0] == room]:
+                    del queue.entries[entry_key]
+
+    def disconnect(self, client):
+        with self.lock:
+            queue = self.clients.pop(client, None)
+            for room in queue.rooms if queue else ():
+                self.rooms.get(room, set()).discard(client)
+
+    def ack(self, client):
+        """The client has received its oldest outstanding frame."""
+        with self.lock:
+            queue = self.clients.get(client)
+            if queue is not None and queue.unacked:
+                queue.unacked.popleft()
+
+    def publish(self, room, event, data):
+        key_fn, merge = COALESCING.get(event, (None, None))
+        key = key_fn(data) if key_fn else None
+        with self.lock:
+            self.published += 1
+            for client in self.rooms.get(room, ()):
+                queue = self.clients[client]
+                if key is not None and (room, event, key) in queue.entries:
+                    entry = queue.entries[(room, event, key)]
+                    entry[1] = merge(entry[1], data)
+                    self.coalesced += 1
+                    continue
+                if len(queue) >= self.max_queued:
+                    self._shed(queue)
+                entry_key = (room, event, key) if key is not None else (room, next(self.sequence))
+                queue.entries[entry_key] = [event, data]
+        self._ensure_flusher()
+
+    def publish_call(self, call_id, event, data):
+        """Send an event to one call's room and to the supervisors watching all calls."""
+        data = dict(data, call_id=call_id)
+        self.publish(call_room(call_id), event, data)
+        self.publish(SUPERVISOR_ROOM, event, data)
+
+    def _shed(self, queue):
+        # Prefer streamed tokens: the final message carries the full text anyway
+        for entry_key, (event, data) in queue.entries.items():
+            if data.get('partial'):
+                del queue.entries[entry_key]
+                break
+        else:
+            queue.entries.popitem(last=False)
+        self.dropped += 1
+
+    def _ensure_flusher(self):
+        if self.flusher is not None:
+            return
+        with self.lock:
+            if self.flusher is None and self.running:
+                self.flusher = threading.Thread(target=self._run, daemon=True)
+                self.flusher.start()
+
+    def _run(self):
+        while self.running:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self, wait_for_acks=True):
+        """Send each client that has caught up everything queued for it, in one frame."""
+        batches = []
+        with self.lock:
+            now = self.clock()
+            for client, queue in self.clients.items():
+                while queue.unacked and now - queue.unacked[0] > self.ack_timeout:
+                    queue.unacked.popleft()
+                if not queue.entries:
+                    continue
+                if wait_for_acks and len(queue.unacked) >= self.max_unacked:
+                    # Still behind: leave the updates queued, where they keep merging
+                    self.held += 1
+                    continue
+                batches.append((client, list(queue.entries.values())))
+                queue.entries = OrderedDict()
+                queue.unacked.append(now)
+        for client, entries in batches:
+            frame = {'events': [{'event': event, 'data': data} for event, data in entries], 'sent': time.time()}
+            try:
+                self.emit('event_batch', frame, to=client, callback=lambda *args, client=client: self.ack(client))
+                with self.lock:
+                    self.frames += 1
+            except Exception as e:
+                print(f"Error sending events to {client}: {e}")
+                self.ack(client)
+
+    def shutdown(self):
+        self.running = False
+        self.wakeup.set()
+        if self.flusher is not None:
+            self.flusher.join()
+        self.flush(wait_for_acks=False)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'published': self.published,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+                'frames': self.frames,
+                'held': self.held,
+                'queued': sum(len(queue) for queue in self.clients.values()),
+                'clients_behind': sum(len(queue.unacked) >= self.max_unacked for queue in self.clients.values())
+            }
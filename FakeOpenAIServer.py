@@ -0,0 +1,456 @@
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Seconds of synthesized speech per character of text, about 150 words a minute
+SPEECH_SECONDS_PER_CHAR = 0.06
+SPEECH_SAMPLE_RATE = 24000
+SPEECH_CHUNK_BYTES = 4800
+
+# Typical latencies of the real API: (median seconds, lognormal spread)
+DEFAULT_LATENCY = {
+    'threads': (0.15, 0.3),
+    'messages': (0.15, 0.3),
+    'runs': (0.15, 0.3),
+    'run_duration': (1.5, 0.4),  # Queued to completed, when polling
+    'first_token': (0.6, 0.4),
+    'token': (0.03, 0.3),
+    'transcription': (0.5, 0.4),
+    'speech': (0.3, 0.4),  # Time to the first audio byte
+}
+
+DEFAULT_TRANSCRIPTS = [
+    "There's a fire in the kitchen at 123 Main Street",
+    "My husband collapsed and he isn't breathing",
+    "Someone just broke into the house next door",
+]
+
+DEFAULT_REPLIES = [
+    "I'm sending help to you now. Is everyone out of the building?",
+    "Help is on the way. Is he breathing at all?",
+    "Officers are on their way. Are you somewhere safe?",
+]
+
+
+class LatencyModel:
+    """Lognormal delay around a median; spread 0 gives a fixed delay."""
+
+    def __init__(self, median=0.0, spread=0.0, rng=None):
+        self.median = median
+        self.spread = spread
+        self.rng = rng or random.Random()
+
+    @classmethod
+    def parse(cls, value, rng=None):
+        """Accept a LatencyModel, a number of seconds or a (median, spread) pair."""
+        if isinstance(value, LatencyModel):
+            return value
+        if isinstance(value, (int, float)):
+            return cls(value, 0.0, rng)
+        median, spread = value
+        return cls(median, spread, rng)
+
+    def sample(self, scale=1.0):
+        if self.median <= 0 or scale <= 0:
+            return 0.0
+        return scale * self.median * math.exp(self.spread * self.rng.gauss(0, 1))
+
+
+class FakeOpenAIServer:
+    """Local stand-in for the parts of the OpenAI API the dispatcher uses.
+
+    Serves assistant threads, messages and runs (polled or streamed),
+    Whisper transcriptions and streamed PCM speech with canned content,
+    after a delay drawn from each endpoint's latency model. A share of
+    requests can be failed on purpose. Point a client at it with
+    OpenAI(base_url=server.url, api_key="test").
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=None, latency_scale=1.0, error_rate=0.0,
+                 error_status=500, transcripts=None, replies=None, seed=None):
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.latency = {
+            endpoint: LatencyModel.parse(value, self.rng)
+            for endpoint, value in dict(DEFAULT_LATENCY, **(latency or {})).items()
+        }
+        self.latency_scale = latency_scale
+        self.error_rate = error_rate  # A share of all requests, or {endpoint: share}
+        self.error_status = error_status
+        self.transcripts = itertools.cycle(transcripts or DEFAULT_TRANSCRIPTS)
+        self.replies = itertools.cycle(replies or DEFAULT_REPLIES)
+        self.ids = itertools.count(1)
+        self.threads = {}
+        self.runs = {}
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.errors = {}
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.serve_thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.serve_thread = threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True)
+        self.serve_thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.serve_thread is not None:
+            self.serve_thread.join()
+
+    def stats(self):
+        with self.lock:
+            return {'requests': dict(self.requests), 'errors': dict(self.errors),
+                    'threads': len(self.threads), 'runs': len(self.runs)}
+
+    def delay(self, endpoint):
+        with self.rng_lock:
+            seconds = self.latency[endpoint].sample(self.latency_scale)
+        if seconds:
+            time.sleep(seconds)
+
+    def should_fail(self, endpoint):
+        rate = self.error_rate.get(endpoint, 0.0) if isinstance(self.error_rate, dict) else self.error_rate
+        with self.rng_lock:
+            return rate > 0 and self.rng.random() < rate
+
+    def new_id(self, prefix):
+        return f"{prefix}_fake{next(self.ids)}"
+
+    # Resources, shaped like the API's JSON objects
+
+    def message(self, thread_id, role, text, run_id=None, status="completed"):
+        return {
+            'id': self.new_id('msg'), 'object': 'thread.message', 'created_at': int(time.time()),
+            'thread_id': thread_id, 'role': role, 'status': status, 'run_id': run_id,
+            'assistant_id': None, 'attachments': [], 'metadata': {},
+            'content': [{'type': 'text', 'text': {'value': text, 'annotations': []}}] if text else []
+        }
+
+    def run_object(self, run):
+        return {
+            'id': run['id'], 'object': 'thread.run', 'created_at': int(run['created']),
+            'thread_id': run['thread_id'], 'assistant_id': run['assistant_id'],
+            'status': run['status'], 'model': 'fake', 'instructions': '', 'tools': [], 'metadata': {}
+        }
+
+    def create_thread(self):
+        thread_id = self.new_id('thread')
+        with self.lock:
+            self.threads[thread_id] = []
+        return {'id': thread_id, 'object': 'thread', 'created_at': int(time.time()), 'metadata': {}}
+
+    def add_message(self, thread_id, role, text, run_id=None):
+        message = self.message(thread_id, role, text, run_id)
+        with self.lock:
+            self.threads.setdefault(thread_id, []).append(message)
+        return message
+
+    def create_run(self, thread_id, assistant_id):
+        with self.rng_lock:
+            duration = self.latency['run_duration'].sample(self.latency_scale)
+        run = {'id': self.new_id('run'), 'thread_id': thread_id, 'assistant_id': assistant_id,
+               'status': 'queued', 'created': time.time(), 'duration': duration, 'reply': next(self.replies)}
+        with self.lock:
+            self.runs[run['id']] = run
+        return run
+
+    def refresh_run(self, run):
+        """Advance a polled run by the time elapsed since it was created."""
+        with self.lock:
+            if run['status'] not in ('queued', 'in_progress'):
+                return run
+            if time.time() - run['created'] < run['duration']:
+                run['status'] = 'in_progress'
+                return run
+            run['status'] = 'completed'
+        self.add_message(run['thread_id'], 'assistant', run['reply'], run['id'])
+        return run
+
+    def transcript(self):
+        with self.lock:
+            return next(self.transcripts)
+
+    def _handler(self):
+        server = self
+
+        class Handler(FakeOpenAIHandler):
+            fake = server
+        return Handler
+
+
+ROUTES = [
+    ('POST', r'/v1/threads', 'create_thread'),
+    ('DELETE', r'/v1/threads/(?P<thread_id>[^/]+)', 'delete_thread'),
+    ('POST', r'/v1/threads/(?P<thread_id>[^/]+)/messages', 'create_message'),
+    ('GET', r'/v1/threads/(?P<thread_id>[^/]+)/messages', 'list_messages'),
+    ('POST', r'/v1/threads/(?P<thread_id>[^/]+)/runs', 'create_run'),
+    ('GET', r'/v1/threads/(?P<thread_id>[^/]+)/runs/(?P<run_id>[^/]+)', 'retrieve_run'),
+    ('POST', r'/v1/threads/(?P<thread_id>[^/]+)/runs/(?P<run_id>[^/]+)/cancel', 'cancel_run'),
+    ('POST', r'/v1/audio/transcriptions', 'transcription'),
+    ('POST', r'/v1/audio/speech', 'speech'),
+]
+
+# Which latency model and error rate each route is subject to
+ROUTE_ENDPOINTS = {
+    'create_thread': 'threads', 'delete_thread': 'threads', 'create_message': 'messages',
+    'list_messages': 'messages', 'create_run': 'runs', 'retrieve_run': 'runs', 'cancel_run': 'runs',
+    'transcription': 'transcription', 'speech': 'speech'
+}
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake = None
+
+    def log_message(self, format, *args):
+        pass  # One line per request would drown a load test
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Clients drop idle keep-alive connections when they close
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def do_DELETE(self):
+        self.route('DELETE')
+
+    def route(self, method):
+        url = urlparse(self.path)
+        self.query = parse_qs(url.query)
+        body = self.read_body()
+        for route_method, pattern, name in ROUTES:
+            match = re.fullmatch(pattern, url.path)
+            if route_method == method and match:
+                break
+        else:
+            self.send_error_json(404, f"Unknown endpoint {method} {url.path}", 'invalid_request_error')
+            return
+
+        endpoint = ROUTE_ENDPOINTS[name]
+        with self.fake.lock:
+            self.fake.requests[endpoint] = self.fake.requests.get(endpoint, 0) + 1
+        if self.fake.should_fail(endpoint):
+            with self.fake.lock:
+                self.fake.errors[endpoint] = self.fake.errors.get(endpoint, 0) + 1
+            self.send_error_json(self.fake.error_status, "Injected failure", 'server_error')
+            return
+        try:
+            getattr(self, name)(body, **match.groupdict())
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client went away, e.g. a barge-in closed the stream
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = b""
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return body
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b""
+
+    def json_body(self, body):
+        return json.loads(body) if body else {}
+
+    def send_json(self, data, status=200):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_error_json(self, status, message, error_type):
+        self.send_json({'error': {'message': message, 'type': error_type, 'code': None}}, status)
+
+    def start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def send_event(self, event, data):
+        payload = data if isinstance(data, str) else json.dumps(data)
+        self.write_chunk(f"event: {event}\ndata: {payload}\n\n".encode())
+
+    # Endpoints
+
+    def create_thread(self, body):
+        self.fake.delay('threads')
+        self.send_json(self.fake.create_thread())
+
+    def delete_thread(self, body, thread_id):
+        self.fake.delay('threads')
+        with self.fake.lock:
+            deleted = self.fake.threads.pop(thread_id, None) is not None
+        self.send_json({'id': thread_id, 'object': 'thread.deleted', 'deleted': deleted})
+
+    def create_message(self, body, thread_id):
+        self.fake.delay('messages')
+        request = self.json_body(body)
+        content = request.get('content', '')
+        if isinstance(content, list):
+            content = ' '.join(part.get('text', '') for part in content)
+        self.send_json(self.fake.add_message(thread_id, request.get('role', 'user'), content))
+
+    def list_messages(self, body, thread_id):
+        self.fake.delay('messages')
+        with self.fake.lock:
+            messages = list(self.fake.threads.get(thread_id, []))
+        if self.query.get('order', ['desc'])[0] == 'desc':
+            messages.reverse()
+        # The cursor is a message id; only what comes after it in this order is listed
+        after = self.query.get('after', [None])[0]
+        ids = [message['id'] for message in messages]
+        if after in ids:
+            messages = messages[ids.index(after) + 1:]
+        limit = int(self.query.get('limit', ['20'])[0])
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        self.send_json({
+            'object': 'list', 'data': messages, 'has_more': has_more,
+            'first_id': messages[0]['id'] if messages else None,
+            'last_id': messages[-1]['id'] if messages else None
+        })
+
+    def create_run(self, body, thread_id):
+        request = self.json_body(body)
+        run = self.fake.create_run(thread_id, request.get('assistant_id'))
+        if request.get('stream'):
+            self.stream_run(run)
+        else:
+            self.fake.delay('runs')
+            self.send_json(self.fake.run_object(run))
+
+    def stream_run(self, run):
+        fake = self.fake
+        self.start_chunked('text/event-stream')
+        self.send_event('thread.run.created', fake.run_object(run))
+        with fake.lock:
+            run['status'] = 'in_progress'
+        self.send_event('thread.run.in_progress', fake.run_object(run))
+        fake.delay('first_token')
+
+        message = fake.message(run['thread_id'], 'assistant', '', run['id'], status='in_progress')
+        self.send_event('thread.message.created', message)
+        for index, token in enumerate(re.findall(r'\s*\S+', run['reply'])):
+            if run['status'] == 'cancelled':
+                break
+            if index:
+                fake.delay('token')
+            self.send_event('thread.message.delta', {
+                'id': message['id'], 'object': 'thread.message.delta',
+                'delta': {'content': [{'index': 0, 'type': 'text', 'text': {'value': token}}]}
+            })
+
+        with fake.lock:
+            cancelled = run['status'] == 'cancelled'
+            if not cancelled:
+                run['status'] = 'completed'
+        if not cancelled:
+            # The thread keeps the message under the id it was streamed with
+            completed = dict(fake.message(run['thread_id'], 'assistant', run['reply'], run['id']), id=message['id'])
+            with fake.lock:
+                fake.threads.setdefault(run['thread_id'], []).append(completed)
+            self.send_event('thread.message.completed', completed)
+        self.send_event(f"thread.run.{run['status']}", fake.run_object(run))
+        self.send_event('done', '[DONE]')
+        self.end_chunked()
+
+    def retrieve_run(self, body, thread_id, run_id):
+        self.fake.delay('runs')
+        run = self.fake.runs.get(run_id)
+        if run is None:
+            self.send_error_json(404, f"No run found with id '{run_id}'.", 'invalid_request_error')
+            return
+        self.send_json(self.fake.run_object(self.fake.refresh_run(run)))
+
+    def cancel_run(self, body, thread_id, run_id):
+        self.fake.delay('runs')
+        run = self.fake.runs.get(run_id)
+        if run is None:
+            self.send_error_json(404, f"No run found with id '{run_id}'.", 'invalid_request_error')
+            return
+        with self.fake.lock:
+            if run['status'] in ('queued', 'in_progress'):
+                run['status'] = 'cancelled'
+        self.send_json(self.fake.run_object(run))
+
+    def transcription(self, body, **_):
+        self.fake.delay('transcription')
+        text = self.fake.transcript()
+        # The multipart form is not parsed; only the response format matters
+        if re.search(rb'name="response_format"\r\n\r\ntext\r\n', body):
+            payload = text.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        else:
+            self.send_json({'text': text})
+
+    def speech(self, body):
+        request = self.json_body(body)
+        self.fake.delay('speech')
+        # Quiet 16-bit mono PCM as long as the text would take to say,
+        # whatever response_format was asked for
+        samples = int(len(request.get('input', '')) * SPEECH_SECONDS_PER_CHAR * SPEECH_SAMPLE_RATE)
+        audio = bytes(2 * samples)
+        self.start_chunked('audio/pcm')
+        for start in range(0, len(audio), SPEECH_CHUNK_BYTES):
+            self.write_chunk(audio[start:start + SPEECH_CHUNK_BYTES])
+        self.end_chunked()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI API")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-scale", type=float, default=1.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--config", help="JSON file of FakeOpenAIServer keyword arguments")
+    args = parser.parse_args()
+
+    options = {'latency_scale': args.latency_scale, 'error_rate': args.error_rate}
+    if args.config:
+        with open(args.config, encoding='utf-8') as f:
+            options.update(json.load(f))
+    fake = FakeOpenAIServer(port=args.port, **options)
+    print(f"Fake OpenAI API at {fake.url}")
+    try:
+        fake.httpd.serve_forever()
+    except KeyboardInterrupt:
+        fake.httpd.server_close()
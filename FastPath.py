@@ -0,0 +1,85 @@
+import re
+
+# High-severity intents, most urgent first: (intent, phrases, instruction).
+# Phrases are regular expressions matched on word boundaries. Each
+# instruction is synthesized at startup, so it plays from the speech cache
+# the moment the intent is heard, while the assistant is still thinking.
+PROTOCOLS = [
+    ('NOT_BREATHING',
+     [r"(?:not|isn't|is not|stopped|no longer) breathing", r"no pulse", r"no heartbeat"],
+     "Help is on the way. If they are not breathing, lay them flat on their back "
+     "and push hard and fast in the center of the chest, about twice a second."),
+    ('CHOKING',
+     [r"choking", r"(?:something|food) (?:is )?stuck in (?:his|her|their|my) throat"],
+     "Help is on the way. If they cannot cough or speak, stand behind them "
+     "and give quick, hard thrusts in and up, just above the belly button."),
+    ('SHOOTING',
+     [r"gunshots?", r"shots? (?:fired|being fired)", r"(?:been|got|was|were) shot", r"(?:a|the) shooting",
+      r"shooting at", r"active shooter"],
+     "Police are on the way. Get away if you safely can. If you can't, hide, "
+     "lock the door and silence your phone."),
+    ('STRUCTURE_FIRE',
+     [r"(?:house|home|building|apartment|kitchen|garage|room|place) (?:is )?on fire",
+      r"fire in (?:the|my|our|a) (?:house|home|building|apartment|kitchen|garage|bedroom|basement)",
+      r"(?:house|building|apartment|kitchen) fire"],
+     "Fire crews are on the way. Get everyone out of the building now, stay low "
+     "under the smoke, and don't go back inside."),
+    ('GAS_LEAK',
+     [r"gas leak", r"smell(?:s|ing)? (?:of |like )?gas"],
+     "Help is on the way. Leave the building now, and don't switch any lights "
+     "or appliances on or off on your way out."),
+    ('SEVERE_BLEEDING',
+     [r"bleeding (?:a lot|badly|heavily|everywhere)", r"(?:lot|lots|pool) of blood", r"won't stop bleeding"],
+     "Help is on the way. Press hard on the wound with a clean cloth or your "
+     "hand, and keep pressing."),
+]
+
+NEGATIONS = r"\b(?:no|not|never|don't|doesn't|didn't|isn't|wasn't|aren't|without)\b"
+
+# A few words before a phrase that turn it around ("there's no gas leak"). The
+# scope ends at punctuation and at a new clause: "No, my house is on fire"
+GAP = r"[^\w,.;:!?]+"
+NEGATION = re.compile(
+    NEGATIONS + r"(?:" + GAP + r"(?!(?:and|but|so|because|now)\b)\w+){0,2}(?:" + GAP + r")?$",
+    re.IGNORECASE
+)
+SELF_NEGATED = re.compile(NEGATIONS, re.IGNORECASE)
+
+
+def protocol_instructions(protocols=PROTOCOLS):
+    """Every instruction the fast path can speak, for pre-warming the speech cache."""
+    return [instruction for _, _, instruction in protocols]
+
+
+class FastPath:
+    """Recognizes clear, high-severity emergencies in the caller's words.
+
+    Only explicit phrases count, and a phrase just after a negation in the
+    same clause is ignored, unless the phrase is itself a negation ("not
+    breathing"); anything less certain is left to the assistant. Each intent's
+    instruction is given at most once per call.
+    """
+
+    def __init__(self, protocols=PROTOCOLS):
+        self.rules = [
+            (intent, re.compile(r"\b(?:" + "|".join(phrases) + r")\b", re.IGNORECASE), instruction)
+            for intent, phrases, instruction in protocols
+        ]
+        self.given = set()
+
+    def match(self, text):
+        """The most urgent intent stated in text, or None."""
+        text = text.replace("’", "'")
+        for intent, pattern, _ in self.rules:
+            for found in pattern.finditer(text):
+                if SELF_NEGATED.search(found.group()) or not NEGATION.search(text[:found.start()]):
+                    return intent
+        return None
+
+    def instruction_for(self, text):
+        """(intent, instruction) the first time an intent is heard on this call, else None."""
+        intent = self.match(text)
+        if intent is None or intent in self.given:
+            return None
+        self.given.add(intent)
+        return intent, next(instruction for name, _, instruction in self.rules if name == intent)
@@ -0,0 +1,211 @@
+import re
+from collections import defaultdict
+
+# USPS-style abbreviations, so "Main Street" and "main st." compare equal
+SUFFIXES = {
+    'street': 'st', 'str': 'st', 'avenue': 'ave', 'av': 'ave', 'road': 'rd', 'boulevard': 'blvd',
+    'lane': 'ln', 'drive': 'dr', 'circle': 'cir', 'court': 'ct', 'parkway': 'pkwy',
+    'terrace': 'ter', 'terr': 'ter', 'place': 'pl', 'highway': 'hwy', 'square': 'sq', 'way': 'way'
+}
+DIRECTIONS = {
+    'north': 'n', 'south': 's', 'east': 'e', 'west': 'w',
+    'northeast': 'ne', 'northwest': 'nw', 'southeast': 'se', 'southwest': 'sw'
+}
+
+UNITS = {
+    'zero': 0, 'oh': 0, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6,
+    'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12, 'thirteen': 13,
+    'fourteen': 14, 'fifteen': 15, 'sixteen': 16, 'seventeen': 17, 'eighteen': 18, 'nineteen': 19
+}
+TENS = {
+    'twenty': 20, 'thirty': 30, 'forty': 40, 'fifty': 50, 'sixty': 60, 'seventy': 70,
+    'eighty': 80, 'ninety': 90
+}
+ORDINALS = {
+    'first': 1, 'second': 2, 'third': 3, 'fourth': 4, 'fifth': 5, 'sixth': 6, 'seventh': 7,
+    'eighth': 8, 'ninth': 9, 'tenth': 10, 'eleventh': 11, 'twelfth': 12, 'thirteenth': 13,
+    'fourteenth': 14, 'fifteenth': 15, 'sixteenth': 16, 'seventeenth': 17, 'eighteenth': 18,
+    'nineteenth': 19, 'twentieth': 20, 'thirtieth': 30, 'fortieth': 40, 'fiftieth': 50,
+    'sixtieth': 60, 'seventieth': 70, 'eightieth': 80, 'ninetieth': 90, 'hundredth': 100
+}
+
+NUMBER_WORDS = set(UNITS) | set(TENS) | set(ORDINALS) | {'hundred', 'thousand'}
+TOKEN = re.compile(r"[A-Za-z]+(?:-[A-Za-z]+)*|\d+(?:st|nd|rd|th)?|[^\sA-Za-z\d]+|\s+")
+
+
+def ordinal(n):
+    if 10 <= n % 100 <= 20:
+        return f"{n}th"
+    return f"{n}" + {1: 'st', 2: 'nd', 3: 'rd'}.get(n % 10, 'th')
+
+
+def _words_to_number(words):
+    """Turn spoken number words into digits; returns (text, is_ordinal).
+
+    House numbers are usually read in groups ("one twenty three" is 123,
+    "twelve thirty four" is 1234), so groups without a multiplier are
+    concatenated rather than added.
+    """
+    groups = []
+    current = None
+    total = 0
+    is_ordinal = False
+    for word in words:
+        if word in ('hundred', 'hundredth'):
+            current = (current or 1) * 100
+            is_ordinal = word == 'hundredth'
+        elif word == 'thousand':
+            total += (current or 1) * 1000
+            current = None
+        elif word in TENS or (word in ORDINALS and ORDINALS[word] >= 20):
+            value = TENS.get(word) or ORDINALS[word]
+            if current is not None and current % 100 == 0 and current >= 100:
+                current += value
+            else:
+                if current is not None:
+                    groups.append(current)
+                current = value
+            is_ordinal = word in ORDINALS
+        else:
+            value = UNITS.get(word, ORDINALS.get(word))
+            if current is not None and (
+                    (current >= 20 and current % 10 == 0 and current % 100 != 0 and value < 10)
+                    or (current >= 100 and current % 100 == 0)):
+                current += value
+            else:
+                if current is not None:
+                    groups.append(current)
+                current = value
+            is_ordinal = word in ORDINALS
+    if current is not None:
+        groups.append(current)
+    if total:
+        groups = [total + (groups[0] if groups else 0)] + groups[1:]
+    digits = ''.join(str(g) for g in groups)
+    return digits, is_ordinal
+
+
+def _is_number_word(token):
+    return all(part in NUMBER_WORDS for part in token.lower().split('-'))
+
+
+def normalize_numbers(text):
+    """Replace spoken numbers and ordinals with digits, leaving other text as is."""
+    tokens = TOKEN.findall(text)
+    out = []
+    i = 0
+    while i < len(tokens):
+        # "oh" only counts inside a number ("one oh five"), never to start one
+        if not _is_number_word(tokens[i]) or tokens[i].lower() == 'oh':
+            out.append(tokens[i])
+            i += 1
+            continue
+        words = []
+        end = j = i
+        while j < len(tokens):
+            token = tokens[j]
+            if _is_number_word(token):
+                parts = token.lower().split('-')
+                # An ordinal starts a new number ("twelve fifth avenue") unless it
+                # completes the one before it ("twenty first", "one hundredth")
+                if words and parts[0] in ORDINALS and parts[0] != 'hundredth' and not (
+                        words[-1] in TENS and ORDINALS[parts[0]] < 10):
+                    break
+                words.extend(parts)
+                end = j + 1
+                if parts[-1] in ORDINALS:
+                    break
+            elif token.strip() and token.lower() != 'and':
+                break
+            j += 1
+        digits, is_ordinal = _words_to_number(words)
+        out.append(ordinal(int(digits)) if is_ordinal else digits)
+        i = end
+    return ''.join(out)
+
+
+def normalize_street(text):
+    """Canonical key for a street: '5th avenue' and 'Fifth Ave.' both give '5th ave'."""
+    text = normalize_numbers(text.lower())
+    words = re.findall(r"[a-z0-9]+", text.replace("'", ""))
+    words = [DIRECTIONS.get(w, w) for w in words]
+    if words and words[-1] in SUFFIXES:
+        words[-1] = SUFFIXES[words[-1]]
+    return ' '.join(words)
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class StreetIndex:
+    """In-memory trigram index over canonical street names.
+
+    match() finds the known street closest to a (possibly misheard) spoken
+    one, by trigram overlap, without any network access.
+    """
+
+    def __init__(self, streets=()):
+        self.names = []
+        self.keys = {}
+        self.grams = []
+        self.postings = defaultdict(list)
+        for street in streets:
+            self.add(street)
+
+    @classmethod
+    def load(cls, path):
+        """One street name per line; blank lines and # comments are skipped."""
+        with open(path, encoding='utf-8') as f:
+            return cls(line.strip() for line in f if line.strip() and not line.startswith('#'))
+
+    def add(self, street):
+        key = normalize_street(street)
+        if not key or key in self.keys:
+            return
+        position = len(self.names)
+        self.names.append(street)
+        self.keys[key] = position
+        grams = trigrams(key)
+        self.grams.append(len(grams))
+        for gram in grams:
+            self.postings[gram].append(position)
+
+    def __len__(self):
+        return len(self.names)
+
+    def match(self, street, min_score=0.5):
+        """Return (canonical name, score) of the best match, or (None, 0.0)."""
+        key = normalize_street(street)
+        if not key:
+            return None, 0.0
+        grams = trigrams(key)
+        shared = defaultdict(int)
+        for gram in grams:
+            for position in self.postings.get(gram, ()):
+                shared[position] += 1
+        best, best_score = None, 0.0
+        for position, count in shared.items():
+            # Dice coefficient of the two trigram sets
+            score = 2 * count / (len(grams) + self.grams[position])
+            if score > best_score:
+                best, best_score = position, score
+        if best is None or best_score < min_score:
+            return None, 0.0
+        return self.names[best], best_score
+
+
+HOUSE_NUMBER = re.compile(r'^\s*(\d+[A-Za-z]?)\s+(.+)$')
+
+
+def resolve_address(address, index, min_score=0.5):
+    """Rewrite '<number> <street>[, rest]' with the closest known street name."""
+    street_part, comma, rest = address.partition(',')
+    match = HOUSE_NUMBER.match(normalize_numbers(street_part))
+    if not match or index is None:
+        return address
+    name, _ = index.match(match.group(2), min_score)
+    if name is None:
+        return address
+    return f"{match.group(1)} {name}{comma}{rest}"
@@ -0,0 +1,271 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from Gazetteer import normalize_street
+
+# Region appended to bare street addresses, as the map page used to do
+DEFAULT_REGION = "New York, NY"
+
+# Background lookups of addresses heard on calls, across all calls
+GEOCODE_WORKERS = 4
+geocode_pool = ThreadPoolExecutor(max_workers=GEOCODE_WORKERS, thread_name_prefix="geocode")
+
+
+def normalize_address(address):
+    """Cache key for an address: case, punctuation, spacing and suffix spelling don't matter."""
+    street, _, rest = address.partition(',')
+    parts = [normalize_street(street)]
+    parts += [' '.join(re.findall(r'\w+', part.lower())) for part in rest.split(',')]
+    return ', '.join(part for part in parts if part)
+
+
+class TokenBucket:
+    """Allow `rate` requests per second with bursts of up to `capacity`."""
+
+    def __init__(self, rate=1.0, capacity=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Take one token, waiting for it if needed. False if timeout runs out first."""
+        deadline = None if timeout is None else self.clock() + timeout
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            self.sleep(wait)
+
+
+class Unlimited:
+    """A limiter that never waits, for backends with no usage policy such as the gazetteer."""
+
+    def acquire(self, timeout=None):
+        return True
+
+
+class NominatimBackend:
+    """OpenStreetMap's public geocoder (at most one request per second)."""
+
+    def __init__(self, base_url="https://nominatim.openstreetmap.org/search",
+                 user_agent="Emergency Dispatch System", timeout=5):
+        self.base_url = base_url
+        self.user_agent = user_agent
+        self.timeout = timeout
+
+    def lookup(self, query):
+        params = urllib.parse.urlencode({'q': query, 'format': 'json', 'limit': 1})
+        request = urllib.request.Request(
+            f"{self.base_url}?{params}", headers={'User-Agent': self.user_agent}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            places = json.load(response)
+        if not places:
+            return None
+        place = places[0]
+        return {'lat': float(place['lat']), 'lon': float(place['lon']),
+                'display_name': place.get('display_name', query)}
+
+
+class GazetteerBackend:
+    """Offline lookups from a JSON file of {"address": [lat, lon]}."""
+
+    def __init__(self, entries=None, path=None):
+        if path:
+            with open(path, encoding='utf-8') as f:
+                entries = json.load(f)
+        self.entries = {
+            normalize_address(address): (address, float(lat), float(lon))
+            for address, (lat, lon) in (entries or {}).items()
+        }
+
+    def lookup(self, query):
+        entry = self.entries.get(normalize_address(query))
+        if entry is None:
+            return None
+        address, lat, lon = entry
+        return {'lat': lat, 'lon': lon, 'display_name': address}
+
+
+class GeocodeCache:
+    """Persistent address -> coordinates cache in SQLite.
+
+    Misses are remembered too, for negative_ttl seconds, so an address the
+    backend can't place isn't looked up again on every message.
+    """
+
+    def __init__(self, path=":memory:", negative_ttl=3600):
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS geocode (key TEXT PRIMARY KEY, result TEXT, created REAL)"
+        )
+        self.db.commit()
+
+    def get(self, key):
+        """Return (found, result); result is None for a remembered miss."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT result, created FROM geocode WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return False, None
+        result, created = row
+        if result is None:
+            if time.time() - created > self.negative_ttl:
+                return False, None
+            return True, None
+        return True, json.loads(result)
+
+    def put(self, key, result):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO geocode (key, result, created) VALUES (?, ?, ?)",
+                (key, json.dumps(result) if result else None, time.time())
+            )
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class PendingLookup:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class Geocoder:
+    """Cached, rate-limited, de-duplicated geocoding over a pluggable backend.
+
+    Concurrent requests for the same address share one backend lookup.
+    Bare street addresses are tried with the default region, and anything
+    that fails is retried as just the street plus that region. prefetch()
+    runs lookups on a shared pool, with at most max_prefetch waiting.
+    """
+
+    def __init__(self, backend, cache=None, limiter=None, region=DEFAULT_REGION, timeout=10, executor=None,
+                 max_prefetch=32):
+        self.backend = backend
+        self.cache = cache or GeocodeCache()
+        self.limiter = limiter or TokenBucket(rate=1.0, capacity=1)
+        self.region = region
+        self.timeout = timeout
+        self.executor = executor or geocode_pool
+        self.max_prefetch = max_prefetch
+        self.prefetching = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.prefetch_skipped = 0
+
+    def queries(self, address):
+        street = address.split(',')[0].strip()
+        candidates = [address if ',' in address else f"{street}, {self.region}"]
+        fallback = f"{street}, {self.region}"
+        if fallback not in candidates:
+            candidates.append(fallback)
+        return candidates
+
+    def geocode(self, address):
+        """Return {'lat', 'lon', 'display_name'} for address, or None."""
+        if not address or not address.strip():
+            return None
+        key = normalize_address(address)
+        found, result = self.cache.get(key)
+        if found:
+            with self.lock:
+                self.cache_hits += 1
+            return result
+
+        with self.lock:
+            pending = self.pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = self.pending[key] = PendingLookup()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            pending.done.wait(self.timeout)
+            return pending.result
+
+        try:
+            pending.result = self._lookup(address, key)
+        finally:
+            with self.lock:
+                del self.pending[key]
+            pending.done.set()
+        return pending.result
+
+    def prefetch(self, address):
+        """Start geocoding address in the background; False if too many lookups are already waiting."""
+        with self.lock:
+            if self.prefetching >= self.max_prefetch:
+                # The map's own request will look it up
+                self.prefetch_skipped += 1
+                return False
+            self.prefetching += 1
+        self.executor.submit(self._prefetch, address)
+        return True
+
+    def _prefetch(self, address):
+        try:
+            self.geocode(address)
+        except Exception as e:
+            print(f"Error geocoding {address!r}: {e}")
+        finally:
+            with self.lock:
+                self.prefetching -= 1
+
+    def _lookup(self, address, key):
+        for query in self.queries(address.strip()):
+            if not self.limiter.acquire(timeout=self.timeout):
+                with self.lock:
+                    self.rate_limited += 1
+                return None  # Not cached: try again on a later message
+            with self.lock:
+                self.lookups += 1
+            try:
+                result = self.backend.lookup(query)
+            except Exception as e:
+                print(f"Error geocoding {query!r}: {e}")
+                return None
+            if result:
+                self.cache.put(key, result)
+                return result
+        self.cache.put(key, None)
+        return None
+
+    def stats(self):
+        with self.lock:
+            return {
+                'lookups': self.lookups,
+                'cache_hits': self.cache_hits,
+                'coalesced': self.coalesced,
+                'rate_limited': self.rate_limited,
+                'prefetch_skipped': self.prefetch_skipped,
+                'in_flight': len(self.pending)
+            }
@@ -0,0 +1,186 @@
+import re
+
+from Gazetteer import normalize_numbers, resolve_address
+
+# Keyword vocabulary, mirroring what the browser used to match on its own.
+# Order matters: types are checked MEDICAL, FIRE, POLICE and problems in the
+# order listed, exactly like detectEmergencyType did.
+EMERGENCY_TYPES = {
+    'MEDICAL': [
+        'heart attack', 'breathing', 'unconscious', 'bleeding', 'injury', 'injured', 'fell',
+        'fallen', 'seizure', 'stroke', 'choking', 'allergic', 'accident', 'overdose', 'pain',
+        'medical'
+    ],
+    'FIRE': ['fire', 'smoke', 'burning', 'flames', 'gas leak', 'explosion'],
+    'POLICE': [
+        'break-in', 'break in', 'breakin', 'robbery', 'theft', 'assault', 'weapon', 'gunshot',
+        'fight', 'domestic', 'violence', 'suspicious', 'burglary', 'stolen'
+    ]
+}
+
+PROBLEMS = {
+    'MEDICAL': {
+        'CHOKING': ['choking'],
+        'HEART_ATTACK': ['heart attack'],
+        'BREATHING': [
+            'difficulty breathing', "trouble breathing", "can't breathing", "can't breathe",
+            'not breathing', 'heavy breathing'
+        ],
+        'UNCONSCIOUS': ['unconscious', 'passed out'],
+        'BLEEDING': ['bleeding'],
+        'INJURY': ['injury', 'injured', 'fell', 'fallen']
+    },
+    'FIRE': {
+        'STRUCTURE_FIRE': ['building', 'house', 'apartment', 'structure', 'room on fire'],
+        'GAS_LEAK': ['gas leak'],
+        'EXPLOSION': ['explosion']
+    },
+    'POLICE': {
+        'BREAK_IN': ['break-in', 'break in', 'breakin', 'burglary'],
+        'ASSAULT': ['assault', 'fight', 'violence'],
+        'WEAPON': ['weapon', 'gunshot', 'gun', 'knife']
+    }
+}
+
+VICTIM_STATUS = [
+    'conscious', 'unconscious', 'breathing', 'not breathing', 'responsive', 'unresponsive',
+    'bleeding', 'stable', 'critical', 'awake', 'alert', 'confused', 'dizzy'
+]
+
+KEY_DETAILS = [
+    'multiple victims', 'weapon present', 'children involved', 'elderly person', 'heavy smoke',
+    'spreading quickly'
+]
+
+# Units sent for each type, plus extra units when an escalation keyword is heard
+DISPATCH_UNITS = {
+    'MEDICAL': (['🚑 Ambulance'], ['critical', 'severe', 'unconscious', 'not breathing'], ['🚁 Medical Helicopter']),
+    'FIRE': (['🚒 Fire Engine', '🚑 Ambulance (Standby)'], ['large', 'spreading', 'building', 'structure'], ['🚒 Additional Fire Units']),
+    'POLICE': (['🚓 Police Units'], ['weapon', 'gun', 'knife', 'violent', 'assault'], ['🚨 SWAT Team'])
+}
+
+STREET_SUFFIXES = (
+    r'street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|circle|cir|court|ct|'
+    r'way|parkway|pkwy|terrace|terr'
+)
+
+# A house number (a cardinal: "1st Avenue" has none) directly followed by a
+# street name, so numbers elsewhere in the sentence ("one of the houses on
+# Main Street") never make an address
+STREET_WORD = r"(?!(?:of|on|at|in|near|by|to|from|is|the|a|an|i|we|he|she|they|it)\b)[\w.'-]+"
+HOUSE_AND_STREET = r'\d+\s+(?:' + STREET_WORD + r'\s+){0,4}?(?:' + STREET_SUFFIXES + r')\b\.?'
+# "Apt 4", "apartment 4B", "unit C", "#12"
+UNIT = r'(?:(?:apt|apartment|unit|suite|ste|room|floor|fl)\.?\s*#?\s*|#\s*)(?:[\w-]*\d[\w-]*|[a-z]\b)'
+
+# One pattern for every way an address is introduced ("at", "on", "near",
+# "the location is"), instead of three patterns compiled on every utterance.
+ADDRESS_PATTERN = re.compile(
+    r'(?:\b(?:at|on|near)|\b(?:location|address|place)\s+(?:is|at))\s+'
+    r'(' + HOUSE_AND_STREET +
+    # Optional unit and ", City, ST" parts: capitalized words only, so the rest of the sentence is left out
+    r'(?:\s*,?\s*' + UNIT + r'|\s*,\s*(?-i:[A-Z][\w.-]*(?:\s+[A-Z][\w.-]*)*))*)',
+    re.IGNORECASE
+)
+
+
+def _build_matcher():
+    """Compile every keyword into one alternation and work out what each implies.
+
+    A phrase can contain other keywords ("not breathing" contains
+    "breathing"), and a single left-to-right scan only reports the longest
+    phrase at each position, so each phrase carries the tags of every
+    keyword found inside it.
+    """
+    groups = []
+    for emergency_type, words in EMERGENCY_TYPES.items():
+        groups.append((('type', emergency_type), words))
+    for emergency_type, problems in PROBLEMS.items():
+        for problem, words in problems.items():
+            groups.append((('problem', emergency_type, problem), words))
+    groups.append((('status',), VICTIM_STATUS))
+    groups.append((('detail',), KEY_DETAILS))
+    for emergency_type, (_, words, _) in DISPATCH_UNITS.items():
+        groups.append((('escalation', emergency_type), words))
+
+    def word_pattern(words):
+        return re.compile(r'\b(?:' + '|'.join(re.escape(w) for w in words) + r')\b', re.IGNORECASE)
+
+    group_patterns = [(tag, word_pattern(words)) for tag, words in groups]
+    phrases = sorted({w.lower() for _, words in groups for w in words}, key=len, reverse=True)
+    phrase_tags = {
+        phrase: [tag for tag, pattern in group_patterns if pattern.search(phrase)]
+        for phrase in phrases
+    }
+    return word_pattern(phrases), phrase_tags
+
+
+KEYWORD_PATTERN, PHRASE_TAGS = _build_matcher()
+
+
+def scan(text):
+    """Single pass over text; returns (phrase as spoken, start offset, tags) per hit."""
+    hits = []
+    for match in KEYWORD_PATTERN.finditer(text):
+        hits.append((match.group(0), match.start(), PHRASE_TAGS[match.group(0).lower()]))
+    return hits
+
+
+# A house number and street with no lead-in; only trusted when the street is known
+BARE_ADDRESS_PATTERN = re.compile(r'\b(' + HOUSE_AND_STREET + r')', re.IGNORECASE)
+
+
+def extract_address(text, streets=None):
+    """Find the address in text; with a StreetIndex, snap the street to a known name."""
+    text = normalize_numbers(text)  # "one twenty three" -> "123"
+    match = ADDRESS_PATTERN.search(text)
+    if match:
+        address = match.group(1).strip(' ,.-')
+        return resolve_address(address, streets) if streets is not None else address
+    if streets is not None:
+        for match in BARE_ADDRESS_PATTERN.finditer(text):
+            address = resolve_address(match.group(1), streets)
+            if address != match.group(1):
+                return address
+    return None
+
+
+def extract_incident(text, streets=None):
+    """Build the structured incident record for one utterance."""
+    types = set()
+    problems = set()
+    escalations = set()
+    victim_status = None
+    key_details = []
+
+    for spoken, start, tags in scan(text):
+        for tag in tags:
+            kind = tag[0]
+            if kind == 'type':
+                types.add(tag[1])
+            elif kind == 'problem':
+                problems.add(tag[1:])
+            elif kind == 'escalation':
+                escalations.add(tag[1])
+            elif kind == 'status' and victim_status is None:
+                victim_status = spoken
+            elif kind == 'detail' and spoken not in key_details:
+                key_details.append(spoken)
+
+    emergency_type = next((t for t in EMERGENCY_TYPES if t in types), None)
+    problem = None
+    units = []
+    if emergency_type:
+        problem = next(
+            (p for p in PROBLEMS[emergency_type] if (emergency_type, p) in problems), None
+        )
+        base_units, _, extra_units = DISPATCH_UNITS[emergency_type]
+        units = base_units + (extra_units if emergency_type in escalations else [])
+
+    return {
+        'type': emergency_type,
+        'problem': problem.replace('_', ' ') if problem else None,
+        'location': extract_address(text, streets),
+        'victim_status': victim_status,
+        'key_details': key_details,
+        'units': units
+    }
@@ -0,0 +1,146 @@
+import threading
+import time
+
+from IncidentExtraction import extract_incident
+
+# How much one mention supports a value. The caller describes the scene;
+# the dispatcher mostly repeats it back, which confirms but adds less.
+SOURCE_WEIGHT = {'caller': 0.6, 'dispatcher': 0.4}
+
+SCALAR_FIELDS = ('type', 'problem', 'location', 'victim_status')
+LIST_FIELDS = ('key_details', 'units')
+# Fields where the caller's latest word replaces what they said before
+CORRECTABLE_FIELDS = ('location', 'victim_status')
+
+
+class FieldValue:
+    """One candidate value of a field with its evidence."""
+
+    def __init__(self, value, now):
+        self.value = value
+        self.confidence = 0.0
+        self.first_seen = now
+        self.last_seen = now
+
+    def support(self, weight, now):
+        # Independent mentions combine: 1 - (1 - a)(1 - b)
+        self.confidence = 1 - (1 - self.confidence) * (1 - weight)
+        self.last_seen = now
+
+    def to_dict(self, with_value=True):
+        entry = {'confidence': round(self.confidence, 3), 'first_seen': round(self.first_seen, 3)}
+        if with_value:
+            entry['value'] = self.value
+        return entry
+
+
+class IncidentState:
+    """Incident record for one call, updated from each new utterance only.
+
+    Scalar fields keep every candidate that was heard and report the best
+    supported one; for the address and victim status the caller's latest
+    mention wins, so corrections and changes replace the old value. List
+    fields accumulate. apply() returns just the fields that changed, ready
+    to send as a diff.
+    """
+
+    def __init__(self, call_id=None, clock=time.time, streets=None):
+        self.call_id = call_id
+        self.clock = clock
+        self.streets = streets
+        self.candidates = {field: {} for field in SCALAR_FIELDS}
+        self.current = {field: None for field in SCALAR_FIELDS}
+        self.items = {field: {} for field in LIST_FIELDS}
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def apply(self, text, role='caller'):
+        """Fold one utterance in; return {field: change} for what changed."""
+        return self.apply_record(extract_incident(text, self.streets), role)
+
+    def apply_joined(self, texts, role='caller'):
+        """Fold in what only the joined pieces of one utterance state, e.g. an address split by a pause.
+
+        Each piece has been applied on its own already, so values a single
+        piece gave are left out rather than counted twice.
+        """
+        texts = [text for text in texts if text]
+        pieces = [extract_incident(text, self.streets) for text in texts]
+        record = extract_incident(" ".join(texts), self.streets)
+        for field in SCALAR_FIELDS:
+            if any(piece.get(field) == record.get(field) for piece in pieces):
+                record[field] = None
+        for field in LIST_FIELDS:
+            record[field] = [value for value in record.get(field) or []
+                             if not any(value in (piece.get(field) or []) for piece in pieces)]
+        return self.apply_record(record, role)
+
+    def apply_record(self, record, role='caller'):
+        weight = SOURCE_WEIGHT.get(role, SOURCE_WEIGHT['dispatcher'])
+        changes = {}
+        with self.lock:
+            now = self.clock()
+            for field in SCALAR_FIELDS:
+                value = record.get(field)
+                if value:
+                    change = self._support_scalar(field, value, weight, now, role)
+                    if change:
+                        changes[field] = change
+            for field in LIST_FIELDS:
+                added = {}
+                for value in record.get(field) or []:
+                    entry = self.items[field].get(value)
+                    if entry is None:
+                        entry = self.items[field][value] = FieldValue(value, now)
+                    before = entry.to_dict(with_value=False)
+                    entry.support(weight, now)
+                    if entry.to_dict(with_value=False) != before:
+                        added[value] = entry.to_dict(with_value=False)
+                if added:
+                    changes[field] = added
+            if changes:
+                self.version += 1
+        return changes
+
+    def _support_scalar(self, field, value, weight, now, role):
+        candidates = self.candidates[field]
+        candidate = candidates.get(value)
+        if candidate is None:
+            candidate = candidates[value] = FieldValue(value, now)
+        candidate.support(weight, now)
+
+        current = self.current[field]
+        corrected = role == 'caller' and field in CORRECTABLE_FIELDS
+        if current is not candidate and (
+                current is None or corrected or candidate.confidence >= current.confidence):
+            self.current[field] = candidate
+            return candidate.to_dict()
+        if current is candidate:
+            # Same value heard again: only its confidence moved
+            return {'confidence': round(candidate.confidence, 3)}
+        return None
+
+    def diff_event(self, changes):
+        """Compact payload for one set of changes."""
+        return {'call_id': self.call_id, 'version': self.version, 'changes': changes}
+
+    def snapshot(self):
+        """Full state, for a dashboard that starts watching mid-call."""
+        with self.lock:
+            state = {field: self.current[field].to_dict() if self.current[field] else None
+                     for field in SCALAR_FIELDS}
+            for field in LIST_FIELDS:
+                state[field] = {value: entry.to_dict(with_value=False)
+                                for value, entry in self.items[field].items()}
+            return {'call_id': self.call_id, 'version': self.version, 'fields': state}
+
+    def facts(self):
+        """Current value of every field, for a summary of the call."""
+        return {field: self.value(field) for field in SCALAR_FIELDS + LIST_FIELDS}
+
+    def value(self, field):
+        with self.lock:
+            if field in LIST_FIELDS:
+                return list(self.items[field])
+            current = self.current[field]
+            return current.value if current else None
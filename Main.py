@@ -1,14 +1,31 @@
-from flask import Flask, render_template_string, jsonify
-from flask_socketio import SocketIO
-import sounddevice as sd
-import numpy as np
+from flask import Flask, Response, render_template_string, jsonify, request
+from flask_socketio import SocketIO, join_room, leave_room
 import threading
-import queue
 import time
-from openai import OpenAI
-import wave
+from openai import OpenAI, AsyncOpenAI
 import os
 import tempfile
+import itertools
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from SessionManager import SessionManager, AsyncSessionManager
+from AsyncDispatcher import AsyncEmergencyDispatcher
+from AudioBuffer import SpeechRingBuffer, encode_wav
+from UtterancePipeline import UtterancePipeline
+from VoiceActivity import create_vad, AdaptiveEndpointer
+from Transcription import SpeculativeTranscriber, ChunkedStream, FallbackTranscriber, create_transcriber
+from AudioSource import MicrophoneSource
+from TextToSpeech import SentenceSplitter, StreamingSpeaker
+from SpeechCache import SpeechCache
+from AssistantThreads import AssistantThreadPool
+from IncidentState import IncidentState
+from Gazetteer import StreetIndex
+from EventFanout import EventFanout, call_room, SUPERVISOR_ROOM
+from Geocoding import Geocoder, GeocodeCache, NominatimBackend, GazetteerBackend, Unlimited
+from Metrics import MetricsRegistry, Tracer
+from ThreadContext import ThreadContext
+from FastPath import FastPath, protocol_instructions
+from Resilience import StagePolicy, Deadline, DeadlineExceeded
 
 #pip install flask
 #pip install flask flask-socketio
@@ -20,13 +37,205 @@ import tempfile
 app = Flask(__name__)
 socketio = SocketIO(app)
 
+def send_event(event, data, to=None, callback=None):
+    socketio.emit(event, data, to=to, callback=callback)
+
+# Transcript and incident updates go to every client in a call's room and the
+# supervisors' room in batched frames sent off the dispatcher threads; a
+# client that has not acknowledged its last frames gets merged updates later
+EVENT_FLUSH_INTERVAL = 0.05
+MAX_QUEUED_EVENTS = 256
+event_fanout = EventFanout(send_event, flush_interval=EVENT_FLUSH_INTERVAL, max_queued=MAX_QUEUED_EVENTS)
+
+# Maximum number of calls handled at once by this process
+MAX_CONCURRENT_CALLS = 32
+
+# Run calls as asyncio tasks on one event loop instead of a thread per call
+USE_ASYNC_DISPATCHER = False
+MAX_ASYNC_CALLS = 256
+
+# Stage timings and counters, served in Prometheus format on /metrics.
+# Set TRACE_DIR to also save each call's spans as JSON when it ends.
+metrics = MetricsRegistry()
+tracer = Tracer(metrics)
+TRACE_DIR = None
+utterances_total = metrics.counter('dispatch_utterances_total', 'Caller utterances by outcome', ('outcome',))
+api_calls_total = metrics.counter('dispatch_api_calls_total', 'OpenAI API requests', ('endpoint', 'outcome'))
+retries_total = metrics.counter(
+    'dispatch_retries_total', 'Streaming fallbacks, run status polls, retried and hedged requests', ('kind',))
+audio_overflows_total = metrics.counter(
+    'dispatch_audio_overflows_total', 'Capture overflows and utterances cut at the buffer cap', ('kind',))
+interruptions_total = metrics.counter('dispatch_interruptions_total', 'Replies cut off by barge-in')
+fast_path_total = metrics.counter(
+    'dispatch_fast_path_total', 'Protocol instructions spoken before the assistant replied', ('intent',))
+
+# Workers that transcribe and answer utterances, shared by all calls. A worker is
+# held for a whole turn, reply playback included, so every call gets one
+UTTERANCE_WORKERS = MAX_CONCURRENT_CALLS
+MAX_PENDING_UTTERANCES = 2 * MAX_CONCURRENT_CALLS
+utterance_pipeline = UtterancePipeline(
+    workers=UTTERANCE_WORKERS, max_pending=MAX_PENDING_UTTERANCES,
+    on_wait=lambda call_id, wait: tracer.record(call_id, 'queue_wait', wait)
+)
+metrics.gauge('dispatch_pipeline_queue_depth', 'Utterances waiting for a worker').set_function(
+    lambda: utterance_pipeline.metrics()['queue_depth'])
+metrics.gauge('dispatch_event_queue_depth', 'Socket.IO updates waiting to be sent').set_function(
+    lambda: event_fanout.stats()['queued'])
+
+# Upstream calls: a timeout per stage (seconds), retries with jittered backoff, and circuit
+# breakers shared by all calls. Transcription and speech send a duplicate "hedged" request once
+# the first outlasts that stage's p95. The assistant stages of a turn share TURN_BUDGET seconds.
+TURN_BUDGET = 30.0
+stage_policies = {
+    'transcription': StagePolicy('transcription', timeout=10, attempts=2, hedge=True, deadline_bound=False),
+    'speech': StagePolicy('speech', timeout=8, attempts=2, hedge=True, deadline_bound=False),
+    'message_create': StagePolicy('message_create', timeout=5),
+    'run_stream': StagePolicy('run_stream', timeout=20),
+    'run_create': StagePolicy('run_create', timeout=5),
+    'run_retrieve': StagePolicy('run_retrieve', timeout=5, attempts=3),
+    'messages_list': StagePolicy('messages_list', timeout=5, attempts=3),
+    'run_cancel': StagePolicy('run_cancel', timeout=5, attempts=2, deadline_bound=False),
+}
+metrics.gauge('dispatch_open_circuits', 'Upstream stages currently failing fast').set_function(
+    lambda: sum(policy.breaker.is_open() for policy in stage_policies.values()))
+
+OPENAI_API_KEY = "Open API Key Here"
+# Set to e.g. "http://127.0.0.1:8089/v1" to run against FakeOpenAIServer.py; None uses the real API
+OPENAI_BASE_URL = None
+ASSISTANT_ID = "asst_DGcJujd3wtjBRZ4KsdrD0q5X"
+
+# Idle assistant threads kept ready for new calls
+ASSISTANT_THREAD_POOL_SIZE = 4
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+def get_openai_client():
+    """Process-wide OpenAI client, so every call reuses one keep-alive connection pool."""
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            # Retries are left to the stage policies
+            _shared_client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, max_retries=0)
+        return _shared_client
+
+_shared_async_client = None
+
+def get_async_openai_client():
+    """Process-wide async client for the asyncio dispatcher's event loop."""
+    global _shared_async_client
+    with _shared_client_lock:
+        if _shared_async_client is None:
+            _shared_async_client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+        return _shared_async_client
+
+assistant_threads = AssistantThreadPool(get_openai_client, size=ASSISTANT_THREAD_POOL_SIZE)
+
+# Synthesized speech is shared by all calls; only the pre-warmed prompts are kept on disk between runs
+SPEECH_CACHE_DIR = "tts_cache"
+speech_cache = SpeechCache(SPEECH_CACHE_DIR)
+
+# Address lookups are cached on disk and rate limited to Nominatim's 1 request/second.
+# Point GAZETTEER_PATH at a JSON file of {"address": [lat, lon]} to geocode offline.
+GEOCODE_CACHE_PATH = "geocode_cache.sqlite3"
+GAZETTEER_PATH = None
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+def get_geocoder():
+    """Process-wide geocoder, shared so identical lookups from every call are coalesced."""
+    global _geocoder
+    with _geocoder_lock:
+        if _geocoder is None:
+            if GAZETTEER_PATH:
+                # Local lookups; the 1 request/second limit is Nominatim's usage policy
+                _geocoder = Geocoder(GazetteerBackend(path=GAZETTEER_PATH), GeocodeCache(GEOCODE_CACHE_PATH),
+                                     limiter=Unlimited())
+            else:
+                _geocoder = Geocoder(NominatimBackend(), GeocodeCache(GEOCODE_CACHE_PATH))
+        return _geocoder
+
+# Speech recognition: "openai" uploads each utterance to whisper-1; "local" runs faster-whisper
+# on this machine's CPUs and transcribes utterances in chunks while callers are still talking.
+# With TRANSCRIPTION_FALLBACK the other backend takes over while the chosen one is failing.
+TRANSCRIPTION_BACKEND = "openai"
+TRANSCRIPTION_FALLBACK = False
+LOCAL_WHISPER_MODEL = "base.en"
+LOCAL_WHISPER_THREADS = 4
+
+_local_transcriber = None
+_local_transcriber_failed = False
+_local_transcriber_lock = threading.Lock()
+
+def get_local_transcriber():
+    """Process-wide local Whisper model, loaded on first use; None if it cannot be loaded."""
+    global _local_transcriber, _local_transcriber_failed
+    with _local_transcriber_lock:
+        if _local_transcriber is None and not _local_transcriber_failed:
+            try:
+                _local_transcriber = create_transcriber(
+                    'local', model=LOCAL_WHISPER_MODEL, cpu_threads=LOCAL_WHISPER_THREADS)
+            except Exception as e:
+                _local_transcriber_failed = True
+                print(f"Local transcription unavailable: {e}")
+        return _local_transcriber
+
+# Optional street list (one name per line) used to snap misheard street names
+STREET_LIST_PATH = None
+street_index = StreetIndex.load(STREET_LIST_PATH) if STREET_LIST_PATH else None
+
+GREETING = "911, what's your emergency?"
+TECHNICAL_DIFFICULTIES = "I'm experiencing technical difficulties. Please hold."
+SAY_AGAIN = "Sorry, I didn't catch that. Please say it again."
+
+# Fixed and frequently repeated phrases synthesized at startup
+PREWARM_PHRASES = [
+    GREETING,
+    TECHNICAL_DIFFICULTIES,
+    SAY_AGAIN,
+    "What is the address of your emergency?",
+    "Stay on the line with me.",
+    "Help is on the way.",
+    "Is the person breathing?",
+    "Is anyone injured?",
+] + protocol_instructions()  # The fast path's instructions must never wait on the network
+
+class StreamBroken(RuntimeError):
+    """A reply stream failed after its run was created; run is that run, text what was already spoken."""
+
+    def __init__(self, run, text):
+        super().__init__(f"Reply stream broke off during run {getattr(run, 'id', None)}")
+        self.run = run
+        self.text = text
+
 # Your existing EmergencyDispatcher class here
 class EmergencyDispatcher:
-    def __init__(self):
-        # Initialize OpenAI client
-        self.client = OpenAI(api_key="Open API Key Here")
-        self.assistant_id = "asst_DGcJujd3wtjBRZ4KsdrD0q5X"
-        self.thread = self.client.beta.threads.create()
+    def __init__(self, session_id=None, pipeline=None, audio_source=None, audio_sink=None,
+                 client=None, threads=None, events=None):
+        self.session_id = session_id
+        self.pipeline = pipeline or utterance_pipeline
+        self.events = events or event_fanout
+        self.audio_source = audio_source  # Defaults to the microphone
+
+        # Initialize OpenAI client, unless a shared one is passed in
+        self.client = client or OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, max_retries=0)
+        # Timeouts, retries, breakers and hedging per stage; the turn's deadline is set per reply
+        self.policies = stage_policies
+        self.turn_budget = TURN_BUDGET
+        self.turn_deadline = None
+        self.assistant_id = ASSISTANT_ID
+        self.threads = threads
+        self.thread = threads.checkout() if threads else self.client.beta.threads.create()
+        # Local copy of the thread; long calls only show the model recent turns plus a summary
+        self.context = ThreadContext()
+
+        # Text-to-speech, played in-process as soon as the first audio arrives
+        self.tts_model = "tts-1"
+        self.tts_voice = "shimmer"
+        self.speaker = StreamingSpeaker(
+            self.client, audio_sink, self.tts_model, self.tts_voice, cache=speech_cache, call=self.call_api
+        )
         
         # Audio parameters
         self.sample_rate = 16000
@@ -36,182 +245,394 @@ class EmergencyDispatcher:
         
         # Speech detection parameters
         self.speech_threshold = 700  # Adjust based on your microphone
+        self.vad_type = "energy"  # amplitude, energy, zcr or flux
+        self.vad = create_vad(self.vad_type, threshold=self.speech_threshold, sample_rate=self.sample_rate)
         self.silence_duration = 1.5  # Seconds of silence to end recording
         self.min_audio_length = 0.05  # Minimum audio length to process
-        self.speech_frames = []
+        self.max_utterance_duration = 30.0  # Hard cap on audio buffered per utterance
+        self.preroll_duration = 0.3  # Audio kept from before speech was detected
+        self.speech_frames = SpeechRingBuffer(
+            capacity=int(self.sample_rate * self.max_utterance_duration),
+            preroll=int(self.sample_rate * self.preroll_duration),
+            channels=self.channels
+        )
         self.silence_frames = 0
         self.is_recording = False
+
+        # End-of-turn silence adapts to the caller's own pauses, up to silence_duration
+        self.adaptive_silence = True
+        self.endpointer = AdaptiveEndpointer(min_silence=0.5, max_silence=self.silence_duration)
+        self.silence_window = self.silence_duration
+        self.frames_since_turn = None  # Frames since the last utterance ended
+
+        # Speculative transcription: pieces are transcribed at the caller's short pauses
+        self.speculative_transcription = False
+        self.piece_pause = 0.3  # Pause that closes a piece
+        self.speculator = SpeculativeTranscriber(
+            self.transcribe, self.sample_rate, on_piece=self.publish_pieces, prefix=f"caller-{self.call_key}"
+        )
+
+        # Speech recognition backend; a streaming one gets the audio while the caller talks
+        self.transcriber = self.create_transcriber()
+        self.streaming_transcription = True
+        self.stream_chunk = 1.0  # Seconds of new audio between streaming passes
+        self.asr_stream = None
+        self.stream_ids = itertools.count(1)
         
         # State management
         self.call_in_progress = True
         self.temp_dir = tempfile.mkdtemp()
         self.current_address = None
+        self.incident = IncidentState(call_id=self.call_key, streets=street_index)
+        self.trace_written = False
+
+        # Audit recording of caller audio, written off the hot path
+        self.persist_audio = False
+        self.audio_archive_dir = "recordings"
+        self.archive_executor = None
+
+        # Response parameters
+        self.stream_responses = True  # Stream tokens instead of polling the run
+        self.run_timeout = 30  # Seconds to wait for an assistant response
+        self.poll_interval_min = 0.1  # First poll delay when streaming is unavailable
+        self.poll_interval_max = 1.0
+        self.poll_backoff = 1.5
+        self.response_id = None
+
+        # Fast path: a clear, high-severity emergency gets its protocol instruction straight
+        # from the speech cache while the assistant run starts
+        self.fast_path_enabled = True
+        self.fast_path = FastPath()
+        self.fast_instruction = None
+
+        # Barge-in: the caller talking over a response stops it
+        # Off by default: capture keeps running during playback, so on open speakers the
+        # reply would trip the VAD and cut itself off. Turn on with a headset or echo cancellation.
+        self.barge_in_enabled = False
+        self.barge_in_frames = 6  # 300 ms of caller speech before interrupting
+        self.cancel_timeout = 2.0  # Seconds to wait for a cancelled run to stop
+        self.barge_in = threading.Event()
+        self.responding = False
+        self.speech_streak = 0
+        self.interruptions = 0
+        self.active_run_id = None
+        self.cancelled_runs = set()
+        self.run_cancellation = None
+        self.cancel_lock = threading.Lock()
 
     def detect_speech(self, audio_data):
-        """Detect if audio contains speech using amplitude threshold."""
-        return np.abs(audio_data).mean() > self.speech_threshold
+        """Detect if audio contains speech using the configured voice activity detector."""
+        return self.vad.is_speech(audio_data)
 
-    def record_and_process(self):
+    def record_and_process(self, source=None):
         """Continuously record and process audio with speech detection."""
+        source = source or self.audio_source or MicrophoneSource(self.sample_rate, self.channels)
+
         def audio_callback(indata, frames, time_info, status):
             if status:
                 print(f"Audio status: {status}")
+                if getattr(status, 'input_overflow', False):
+                    audio_overflows_total.inc(kind='input')
             
             # Check for speech in current chunk
             if self.detect_speech(indata):
+                self.speech_streak += 1
+                if self.responding and self.speech_streak >= self.barge_in_frames:
+                    self.interrupt()
                 if not self.is_recording:
                     print("Speech detected - starting recording...")
                     self.is_recording = True
-                self.speech_frames.append(indata.copy())
+                    self.speech_frames.start()
+                    self.speculator.start()
+                    if self.streams_transcription():
+                        self.asr_stream = ChunkedStream(
+                            self.transcriber, self.sample_rate, self.stream_chunk, on_confirmed=self.publish_confirmed,
+                            utterance_id=f"caller-{self.call_key}-s{next(self.stream_ids)}"
+                        )
+                        self.asr_stream.feed(self.speech_frames.view())  # The pre-roll
+                    if self.frames_since_turn is not None:
+                        self.endpointer.observe_resumed(self.silence_window, self.frames_since_turn * self.chunk_duration)
+                        self.frames_since_turn = None
+                elif self.silence_frames:
+                    # The caller paused and carried on: that pause did not end the turn
+                    self.endpointer.observe_pause(self.silence_frames * self.chunk_duration)
+                fits = self.speech_frames.append(indata)
+                if self.asr_stream is not None:
+                    self.asr_stream.feed(indata)
+                self.speculator.note_speech()
                 self.silence_frames = 0
             elif self.is_recording:
+                self.speech_streak = 0
                 self.silence_frames += 1
-                self.speech_frames.append(indata.copy())  # Keep some silence for natural speech
-                
-                # Check if silence duration exceeded
-                silence_time = self.silence_frames * self.chunk_duration
-                if silence_time >= self.silence_duration:
-                    print("Silence detected - processing speech...")
-                    self.process_recorded_speech()
-                    self.is_recording = False
-                    self.speech_frames = []
-                    self.silence_frames = 0
+                fits = self.speech_frames.append(indata)  # Keep some silence for natural speech
+                if self.asr_stream is not None:
+                    self.asr_stream.feed(indata)
+                # A streaming recognizer already transcribes the whole utterance
+                if self.speculative_transcription and self.asr_stream is None \
+                        and self.silence_frames * self.chunk_duration >= self.piece_pause:
+                    self.speculator.commit(self.speech_frames.view())
+            else:
+                self.speech_streak = 0
+                if self.frames_since_turn is not None:
+                    self.frames_since_turn += 1
+                # Remember recent audio so the start of the next utterance is kept
+                self.speech_frames.push_preroll(indata)
+                return
+
+            # Check if silence duration exceeded or the buffer is full
+            silence_time = self.silence_frames * self.chunk_duration
+            if silence_time >= self.silence_window or not fits:
+                print("Silence detected - processing speech...")
+                if fits:
+                    tracer.record(self.call_key, 'vad_wait', silence_time)
+                else:
+                    audio_overflows_total.inc(kind='utterance_cap')
+                self.enqueue_utterance()
+                self.is_recording = False
+                self.speech_frames.clear()
+                self.silence_frames = 0
+                self.frames_since_turn = 0
+                if self.adaptive_silence:
+                    self.silence_window = self.endpointer.window()
 
         try:
-            with sd.InputStream(
-                channels=self.channels,
-                samplerate=self.sample_rate,
-                blocksize=self.chunk_samples,
-                callback=audio_callback,
-                dtype=np.int16
-            ):
-                print("Listening for speech...")
-                while self.call_in_progress:
-                    time.sleep(0.1)
+            source.run(audio_callback, self.chunk_samples, lambda: self.call_in_progress)
         except Exception as e:
             print(f"Error in audio stream: {e}")
 
-    def process_recorded_speech(self):
-        """Process the recorded speech frames."""
-        if not self.speech_frames:
+    def enqueue_utterance(self):
+        """Hand the finished utterance to the worker pool without blocking capture."""
+        if not len(self.speech_frames):
             return
+        if self.asr_stream is not None:
+            # Most of the utterance is already transcribed; the audio is kept in case the stream failed
+            stream, self.asr_stream = self.asr_stream, None
+            audio_data = self.speech_frames.view().copy()
+            submitted = self.pipeline.submit(self.call_key, self.process_streamed_speech, stream, audio_data)
+        elif self.speculative_transcription:
+            # Earlier pieces are already being transcribed; only the tail is left
+            utterance = self.speculator.finish(self.speech_frames.view(), keep_audio=self.persist_audio)
+            submitted = self.pipeline.submit(self.call_key, self.process_speculative_speech, utterance)
+        else:
+            # The buffer is reused for the next utterance, so the workers get their own copy
+            audio_data = self.speech_frames.view().copy()
+            submitted = self.pipeline.submit(self.call_key, self.process_recorded_speech, audio_data)
+        if not submitted:
+            utterances_total.inc(outcome='dropped')
+            print("Processing queue full - utterance dropped")
+
+    @property
+    def call_key(self):
+        return self.session_id or id(self)
+
+    def process_recorded_speech(self, audio_data=None):
+        """Process a recorded utterance, by default the one in speech_frames."""
+        if audio_data is None:
+            if not len(self.speech_frames):
+                return
+            # View of the buffered frames, no concatenation or copy
+            audio_data = self.speech_frames.view()
 
         try:
-            # Combine all frames
-            audio_data = np.concatenate(self.speech_frames)
             duration = len(audio_data) / self.sample_rate
 
             # Only process if audio is long enough
-            if duration >= self.min_audio_length:
-                # Save to temporary WAV file
-                temp_path = os.path.join(self.temp_dir, f"speech_{time.time()}.wav")
-                with wave.open(temp_path, 'wb') as wf:
-                    wf.setnchannels(self.channels)
-                    wf.setsampwidth(2)
-                    wf.setframerate(self.sample_rate)
-                    wf.writeframes(audio_data.tobytes())
-
-                # Transcribe
-                with open(temp_path, 'rb') as audio_file:
-                    transcript = self.client.audio.transcriptions.create(
-                        model="whisper-1",
-                        file=audio_file,
-                        response_format="text"
-                    )
-
-                os.remove(temp_path)
-
-                if transcript and transcript.strip():
+            if duration < self.min_audio_length:
+                utterances_total.inc(outcome='too_short')
+                return
+            with self.span('utterance', seconds=round(duration, 3)):
+                if self.persist_audio:
+                    self.archive_audio(self.encode_wav(audio_data))
+
+                try:
+                    transcript = self.transcribe(audio_data)
+                except Exception as e:
+                    self.transcription_failed(e)
+                    return
+                utterances_total.inc(outcome='processed' if transcript else 'empty')
+                if transcript:
                     print(f"Caller: {transcript}")
                     self.handle_input(transcript)
 
         except Exception as e:
+            utterances_total.inc(outcome='failed')
             print(f"Error processing recorded speech: {e}")
 
-    def text_to_speech(self, text):
-        """Convert text to speech using OpenAI's TTS."""
+    def process_speculative_speech(self, utterance):
+        """Finish an utterance whose leading pieces were transcribed while it was spoken."""
         try:
-            temp_path = os.path.join(self.temp_dir, f"response_{time.time()}.mp3")
-            
-            response = self.client.audio.speech.create(
-                model="tts-1",
-                voice="shimmer",
-                input=text
-            )
-            
-            response.stream_to_file(temp_path)
-            
-            if os.path.exists(temp_path):
-                if os.name == 'posix':
-                    os.system(f"afplay '{temp_path}'")
-                elif os.name == 'nt':
-                    os.system(f'start "" "{temp_path}"')
-                os.remove(temp_path)
-                
+            if utterance.audio is not None and self.persist_audio:
+                self.archive_audio(self.encode_wav(utterance.audio))
+            texts = utterance.piece_texts(timeout=self.run_timeout)
+            tail = ""
+            if utterance.tail_has_speech and len(utterance.tail) / self.sample_rate >= self.min_audio_length:
+                try:
+                    tail = self.transcribe(utterance.tail)
+                except Exception as e:
+                    self.transcription_failed(e)
+                    return
+            transcript = " ".join(text for text in texts + [tail] if text)
+            utterances_total.inc(outcome='processed' if transcript else 'empty')
+            if transcript:
+                print(f"Caller: {transcript}")
+                # Pieces were already folded into the incident as they arrived; what a pause
+                # split between pieces (or the tail) is only whole in the joined transcript
+                self.publish_pieces(utterance)
+                with self.span('incident_update', role='caller'):
+                    self.publish_incident(self.incident.apply_joined(texts + [tail]))
+                self.handle_input(transcript, message_id=utterance.utterance_id, new_text=tail)
         except Exception as e:
-            print(f"Text-to-speech error: {e}")
+            utterances_total.inc(outcome='failed')
+            print(f"Error processing recorded speech: {e}")
 
-    def handle_input(self, text):
-        """Handle transcribed input and get AI response."""
-        if not text:
-            return
+    def process_streamed_speech(self, stream, audio_data):
+        """Finish an utterance the local recognizer has been transcribing while it was spoken."""
+        try:
+            duration = len(audio_data) / self.sample_rate
+            if duration < self.min_audio_length:
+                utterances_total.inc(outcome='too_short')
+                return
+            with self.span('utterance', seconds=round(duration, 3)):
+                if self.persist_audio:
+                    self.archive_audio(self.encode_wav(audio_data))
+                try:
+                    with self.span('stream_finish', passes=stream.passes):
+                        transcript = stream.finish(timeout=self.run_timeout)
+                except Exception as e:
+                    print(f"Streaming transcription failed, transcribing the whole utterance: {e}")
+                    try:
+                        transcript = self.transcribe(audio_data)
+                    except Exception as e:
+                        self.transcription_failed(e)
+                        return
+                utterances_total.inc(outcome='processed' if transcript else 'empty')
+                if transcript:
+                    print(f"Caller: {transcript}")
+                    self.handle_input(transcript, message_id=stream.utterance_id)
+        except Exception as e:
+            utterances_total.inc(outcome='failed')
+            print(f"Error processing recorded speech: {e}")
+
+    def transcription_failed(self, error):
+        """Ask the caller to repeat themselves rather than leave them in silence."""
+        utterances_total.inc(outcome='failed')
+        print(f"Transcription failed: {error}")
+        if self.call_in_progress:
+            self.text_to_speech(SAY_AGAIN)
+
+    def publish_confirmed(self, stream, text):
+        """Show words as soon as two streaming passes agree on them."""
+        self.publish('transcript_update', {
+            'role': 'caller',
+            'message': text + " ",
+            'message_id': stream.utterance_id,
+            'partial': True,
+            'timestamp': time.strftime('%H:%M:%S')
+        })
+
+    def publish_pieces(self, utterance):
+        """Show finished pieces in order and start extraction on them before the turn ends."""
+        with utterance.lock:
+            while utterance.published < len(utterance.pieces) and utterance.pieces[utterance.published].done():
+                piece = utterance.pieces[utterance.published]
+                utterance.published += 1
+                text = piece.result().strip() if piece.exception() is None else ""
+                if not text:
+                    continue
+                self.publish('transcript_update', {
+                    'role': 'caller',
+                    'message': text + " ",
+                    'message_id': utterance.utterance_id,
+                    'partial': True,
+                    'timestamp': time.strftime('%H:%M:%S')
+                })
+                self.update_incident(text, 'caller')
+
+    def create_transcriber(self):
+        """The configured backend, with the other one behind it when fallback is on."""
+        remote = create_transcriber(
+            'openai', client=self.client, sample_rate=self.sample_rate, channels=self.channels, call=self.call_api)
+        local = get_local_transcriber() if TRANSCRIPTION_BACKEND == 'local' or TRANSCRIPTION_FALLBACK else None
+        if local is None:
+            return remote
+        if not TRANSCRIPTION_FALLBACK:
+            return local
+        backends = [local, remote] if TRANSCRIPTION_BACKEND == 'local' else [remote, local]
+        return FallbackTranscriber(backends)
+
+    def streams_transcription(self):
+        return self.streaming_transcription and getattr(self.transcriber, 'streaming', False)
+
+    def transcribe(self, audio_data):
+        with self.span('asr', backend=getattr(self.transcriber, 'name', 'custom')):
+            return self.transcriber.transcribe(audio_data)
 
+    def span(self, name, **attrs):
+        """Time one stage of this call."""
+        return tracer.span(self.call_key, name, **attrs)
+
+    @contextmanager
+    def api_call(self, endpoint):
+        """Time and count one OpenAI API request."""
         try:
-            message = self.client.beta.threads.messages.create(
-                thread_id=self.thread.id,
-                role="user",
-                content=text
-            )
+            with self.span(endpoint):
+                yield
+        except Exception:
+            api_calls_total.inc(endpoint=endpoint, outcome='error')
+            raise
+        api_calls_total.inc(endpoint=endpoint, outcome='ok')
 
-            run = self.client.beta.threads.runs.create(
-                thread_id=self.thread.id,
-                assistant_id=self.assistant_id
-            )
+    def call_api(self, endpoint, request, discard=None):
+        """Make one OpenAI request under its stage's policy; request(timeout) does the call."""
+        def attempt(timeout):
+            with self.api_call(endpoint):
+                return request(timeout)
+        return self.policies[endpoint].call(
+            attempt, self.turn_deadline, discard=discard,
+            on_retry=lambda error: retries_total.inc(kind=endpoint),
+            on_hedge=lambda: retries_total.inc(kind=f"{endpoint}_hedge")
+        )
 
-            start_time = time.time()
-            while time.time() - start_time < 30:
-                run_status = self.client.beta.threads.runs.retrieve(
-                    thread_id=self.thread.id,
-                    run_id=run.id
-                )
-                if run_status.status == 'completed':
-                    messages = self.client.beta.threads.messages.list(
-                        thread_id=self.thread.id
-                    )
-                    
-                    for msg in messages.data:
-                        if msg.role == "assistant":
-                            response = msg.content[0].text.value
-                            print(f"Dispatcher: {response}")
-                            self.text_to_speech(response)
-                            return
-                time.sleep(0.5)
+    def encode_wav(self, audio_data):
+        """Encode int16 samples as WAV bytes without a temporary file."""
+        return encode_wav(audio_data, self.sample_rate, self.channels)
+
+    def archive_audio(self, wav_bytes):
+        """Queue an utterance to be written to the audit directory in the background."""
+        if self.archive_executor is None:
+            self.archive_executor = ThreadPoolExecutor(max_workers=1)
+        self.archive_executor.submit(self.write_archive, wav_bytes, time.time())
 
+    def write_archive(self, wav_bytes, timestamp):
+        try:
+            os.makedirs(self.audio_archive_dir, exist_ok=True)
+            name = f"{self.session_id or 'call'}_{timestamp:.3f}.wav"
+            with open(os.path.join(self.audio_archive_dir, name), 'wb') as f:
+                f.write(wav_bytes)
         except Exception as e:
-            print(f"Error handling input: {e}")
-            self.text_to_speech("I'm experiencing technical difficulties. Please hold.")
+            print(f"Error archiving audio: {e}")
 
-        address_patterns = [
-            r'at\s+([\d]+[\w\s,.-]+(?:street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|circle|cir|court|ct|way|parkway|pkwy|Terr|Terrace)[\w\s,.-]+)',
-            r'on\s+([\d]+[\w\s,.-]+(?:street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|circle|cir|court|ct|way|parkway|pkwy|Terr|Terrace)[\w\s,.-]+)',
-            r'(?:location|address|place) is\s+([\d]+[\w\s,.-]+(?:street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|circle|cir|court|ct|way|parkway|pkwy|terr|terrace)[\w\s,.-]+)'
-        ]
-        
-        for pattern in address_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                self.current_address = match.group(1)
-                break
+    def text_to_speech(self, text):
+        """Convert text to speech using OpenAI's TTS, one sentence at a time."""
+        try:
+            with self.span('speak', chars=len(text)):
+                self.speaker.speak(text)
+        except Exception as e:
+            print(f"Text-to-speech error: {e}")
 
     def run(self):
         """Main method to run the dispatcher."""
         try:
             # Initial greeting
-            self.text_to_speech("911, what's your emergency?")
+            self.text_to_speech(GREETING)
             
             # Start recording and processing
             self.record_and_process()
 
+            # A recorded call can run out before its last utterances are answered
+            if self.call_in_progress:
+                self.pipeline.wait_for(self.call_key, timeout=self.run_timeout * 2)
+
         except KeyboardInterrupt:
             print("\nEmergency dispatcher shutting down...")
         finally:
@@ -220,6 +641,21 @@ class EmergencyDispatcher:
     def cleanup(self):
         """Clean up resources."""
         self.call_in_progress = False
+        self.pipeline.discard(self.call_key)
+        if TRACE_DIR and not self.trace_written:
+            self.trace_written = True
+            tracer.write(self.call_key, TRACE_DIR)
+        self.speaker.close()
+        if self.threads is not None:
+            # Return the thread once; the pool deletes it in the background
+            self.threads.release(self.thread)
+            self.threads = None
+        if self.archive_executor is not None:
+            # Let queued audit recordings finish writing
+            self.archive_executor.shutdown(wait=True)
+            self.archive_executor = None
+        if not os.path.isdir(self.temp_dir):
+            return
         try:
             for file in os.listdir(self.temp_dir):
                 os.remove(os.path.join(self.temp_dir, file))
@@ -227,60 +663,311 @@ class EmergencyDispatcher:
         except Exception as e:
             print(f"Error cleaning up: {e}")
     
-    def handle_input(self, text):
-        """Modified to emit updates to frontend"""
+    def handle_input(self, text, message_id=None, new_text=None):
+        """Handle transcribed input, get AI response and emit updates to frontend.
+
+        new_text is the part of text not yet run through incident extraction,
+        when earlier parts were extracted speculatively.
+        """
         if not text:
             return
 
+        self.barge_in.clear()
+        self.responding = True
+        self.turn_deadline = Deadline(self.turn_budget)
         try:
-            # Emit transcript update
-            socketio.emit('transcript_update', {
-                'role': 'caller',
-                'message': text,
+            with self.span('turn'):
+                self.respond(text, message_id, new_text)
+        except Exception as e:
+            print(f"Error handling input: {e}")
+            if self.call_in_progress and not self.barge_in.is_set():
+                self.text_to_speech(TECHNICAL_DIFFICULTIES)
+        finally:
+            self.responding = False
+            self.turn_deadline = None
+
+    def respond(self, text, message_id=None, new_text=None):
+        """Publish the caller's words, get the assistant's reply and speak it."""
+        # Emit transcript update
+        self.publish('transcript_update', {
+            'role': 'caller',
+            'message': text,
+            'message_id': message_id,
+            'timestamp': time.strftime('%H:%M:%S')
+        })
+        if new_text is None:
+            new_text = text
+        if new_text:
+            self.update_incident(new_text, 'caller')
+        self.fast_instruction = self.speak_fast_path(text) if self.fast_path_enabled else None
+
+        # A run cancelled by barge-in must stop before the thread takes new messages;
+        # the interrupted turn and this one are then answered together
+        if self.run_cancellation is not None:
+            self.run_cancellation.join(self.cancel_timeout)
+            self.run_cancellation = None
+
+        message = self.call_api('message_create', lambda timeout: self.client.beta.threads.messages.create(
+            thread_id=self.thread.id,
+            role="user",
+            content=text,
+            timeout=timeout
+        ))
+        self.context.add('user', text, message.id)
+
+        response = None
+        fall_back = True
+        if self.stream_responses:
+            try:
+                response = self.stream_response()
+            except DeadlineExceeded:
+                raise
+            except StreamBroken as e:
+                print(f"{e}: {e.__cause__}")
+                fall_back = False
+                response = self.finish_broken_stream(e)
+            except Exception as e:
+                # Fall back to polling if streaming is unavailable
+                retries_total.inc(kind='stream_fallback')
+                print(f"Streaming failed, falling back to polling: {e}")
+
+        if response is None and fall_back and not self.barge_in.is_set():
+            response = self.poll_response()
+            if response and not self.barge_in.is_set():
+                self.text_to_speech(response)
+
+        interrupted = self.barge_in.is_set()
+        if response:
+            print(f"Dispatcher: {response}" + (" [interrupted]" if interrupted else ""))
+
+            # Emit dispatcher response
+            self.publish('transcript_update', {
+                'role': 'dispatcher',
+                'message': response,
+                'message_id': self.response_id,
+                'interrupted': interrupted,
                 'timestamp': time.strftime('%H:%M:%S')
             })
+            if not interrupted:
+                self.update_incident(response, 'dispatcher')
 
-            message = self.client.beta.threads.messages.create(
-                thread_id=self.thread.id,
-                role="user",
-                content=text
-            )
+    def speak_fast_path(self, text):
+        """Start the protocol instruction for a recognized emergency; the reply plays after it."""
+        matched = self.fast_path.instruction_for(text)
+        if matched is None:
+            return None
+        intent, instruction = matched
+        with self.span('fast_path', intent=intent):
+            self.speaker.start(instruction)
+        fast_path_total.inc(intent=intent)
+        print(f"Dispatcher (protocol): {instruction}")
+        self.publish('transcript_update', {
+            'role': 'dispatcher',
+            'message': instruction,
+            'message_id': f"protocol-{self.call_key}-{intent}",
+            'timestamp': time.strftime('%H:%M:%S')
+        })
+        return instruction
+
+    def run_options(self):
+        """Extra run arguments: the long-call summary, and what the caller was already told."""
+        options = self.context.run_options(self.incident.facts())
+        if self.fast_instruction:
+            note = (f'The caller has just been told: "{self.fast_instruction}" '
+                    "Do not repeat it; carry on from there.")
+            options['additional_instructions'] = "\n\n".join(
+                part for part in (options.get('additional_instructions'), note) if part)
+        return options
+
+    def interrupt(self):
+        """The caller barged in: silence playback and cancel the run in flight."""
+        if not self.barge_in_enabled or self.barge_in.is_set():
+            return
+        self.barge_in.set()
+        self.interruptions += 1
+        interruptions_total.inc()
+        print("Caller interrupted - stopping response")
+        self.speaker.interrupt()
+        # Runs off the audio callback, which must never wait on the network
+        self.cancel_in_background()
+
+    def cancel_in_background(self, run_id=None):
+        """Cancel a run without waiting; the next turn waits for it before adding messages."""
+        self.run_cancellation = threading.Thread(target=self.cancel_run, args=(run_id,), daemon=True)
+        self.run_cancellation.start()
+
+    def cancel_run(self, run_id=None):
+        """Cancel an assistant run once and wait briefly for it to stop."""
+        run_id = run_id or self.active_run_id
+        with self.cancel_lock:
+            if run_id is None or run_id in self.cancelled_runs:
+                return
+            self.cancelled_runs.add(run_id)
+        try:
+            run = self.call_api('run_cancel', lambda timeout: self.client.beta.threads.runs.cancel(
+                run_id=run_id, thread_id=self.thread.id, timeout=timeout))
+            deadline = time.time() + self.cancel_timeout
+            while run.status in ('queued', 'in_progress', 'requires_action', 'cancelling') \
+                    and time.time() < deadline:
+                time.sleep(self.poll_interval_min)
+                run = self.call_api('run_retrieve', lambda timeout: self.client.beta.threads.runs.retrieve(
+                    thread_id=self.thread.id, run_id=run_id, timeout=timeout))
+        except Exception as e:
+            print(f"Error cancelling run: {e}")
+
+    def update_incident(self, text, role):
+        """Fold one message into the call's incident state and push only what changed."""
+        with self.span('incident_update', role=role):
+            changes = self.incident.apply(text, role)
+        return self.publish_incident(changes)
 
-            run = self.client.beta.threads.runs.create(
+    def publish_incident(self, changes):
+        if 'location' in changes:
+            self.current_address = self.incident.value('location')
+            # Look the address up now so the map's request finds it cached or in flight
+            get_geocoder().prefetch(self.current_address)
+        if changes:
+            self.publish('incident_diff', self.incident.diff_event(changes))
+        return changes
+
+    def publish(self, event, data):
+        """Queue an update for this call's room; never waits on slow clients."""
+        self.events.publish_call(self.call_key, event, data)
+
+    def stream_response(self):
+        """Stream the assistant reply, pushing tokens and speaking each finished sentence."""
+        self.response_id = f"{self.thread.id}-{time.time()}"
+        splitter = SentenceSplitter()
+        # Each finished sentence starts synthesizing while tokens keep flowing
+        speech = self.speaker.open()
+
+        parts = []
+        streams = []
+        started = time.perf_counter()
+        def run_stream(timeout):
+            with self.client.beta.threads.runs.stream(
                 thread_id=self.thread.id,
-                assistant_id=self.assistant_id
-            )
+                assistant_id=self.assistant_id,
+                timeout=timeout,
+                **self.run_options()
+            ) as stream:
+                streams.append(stream)
+                for delta in stream.text_deltas:
+                    if not parts:
+                        tracer.record(self.call_key, 'first_token', time.perf_counter() - started)
+                    if self.active_run_id is None and stream.current_run is not None:
+                        self.active_run_id = stream.current_run.id
+                    if self.barge_in.is_set():
+                        break
+                    if self.turn_deadline is not None and self.turn_deadline.expired():
+                        self.cancel_in_background(self.active_run_id)
+                        raise DeadlineExceeded("The reply was still streaming when the turn's time ran out")
+                    parts.append(delta)
+                    self.publish('transcript_update', {
+                        'role': 'dispatcher',
+                        'message': delta,
+                        'message_id': self.response_id,
+                        'partial': True,
+                        'timestamp': time.strftime('%H:%M:%S')
+                    })
+                    for sentence in splitter.feed(delta):
+                        speech.say(sentence)
 
-            start_time = time.time()
-            while time.time() - start_time < 30:
-                run_status = self.client.beta.threads.runs.retrieve(
-                    thread_id=self.thread.id,
-                    run_id=run.id
-                )
-                if run_status.status == 'completed':
-                    messages = self.client.beta.threads.messages.list(
-                        thread_id=self.thread.id
-                    )
-                    
-                    for msg in messages.data:
-                        if msg.role == "assistant":
-                            response = msg.content[0].text.value
-                            print(f"Dispatcher: {response}")
-                            
-                            # Emit dispatcher response
-                            socketio.emit('transcript_update', {
-                                'role': 'dispatcher',
-                                'message': response,
-                                'timestamp': time.strftime('%H:%M:%S')
-                            })
-                            
-                            self.text_to_speech(response)
-                            return
-                time.sleep(0.5)
+                if self.barge_in.is_set():
+                    # Barge-in may have come before the run id was known
+                    current_run = stream.current_run
+                    self.cancel_run(self.active_run_id or (current_run.id if current_run else None))
+                else:
+                    remainder = splitter.flush()
+                    if remainder:
+                        speech.say(remainder)
+                return getattr(stream.current_message_snapshot, 'id', None)
 
+        try:
+            reply_id = self.call_api('run_stream', run_stream)
+        except DeadlineExceeded:
+            raise
         except Exception as e:
-            print(f"Error handling input: {e}")
-            self.text_to_speech("I'm experiencing technical difficulties. Please hold.")
+            # Once the run exists, or the caller has heard part of it, a new run would answer twice
+            run = streams[-1].current_run if streams else None
+            if run is None and not parts:
+                raise
+            raise StreamBroken(run, "".join(parts).strip()) from e
+        finally:
+            self.active_run_id = None
+            speech.close()
+
+        response = "".join(parts).strip()
+        self.context.add('assistant', response, reply_id)
+        return response or None
+
+    def finish_broken_stream(self, broken):
+        """Answer from the run a broken stream started, rather than starting another one."""
+        if broken.text or broken.run is None:
+            # Part of the reply has been spoken; stop the run instead of saying it twice
+            retries_total.inc(kind='stream_cancelled')
+            if broken.run is not None:
+                self.cancel_in_background(broken.run.id)
+            return broken.text or None
+        retries_total.inc(kind='stream_resumed')
+        self.active_run_id = broken.run.id
+        try:
+            response = self.wait_for_run(broken.run)
+        finally:
+            self.active_run_id = None
+        if response and not self.barge_in.is_set():
+            self.text_to_speech(response)
+        return response
+
+    def poll_response(self):
+        """Create a run and poll it with a backoff interval until it completes."""
+        self.response_id = f"{self.thread.id}-{time.time()}"
+        run = self.call_api('run_create', lambda timeout: self.client.beta.threads.runs.create(
+            thread_id=self.thread.id,
+            assistant_id=self.assistant_id,
+            timeout=timeout,
+            **self.run_options()
+        ))
+        self.active_run_id = run.id
+        try:
+            return self.wait_for_run(run)
+        finally:
+            self.active_run_id = None
+
+    def wait_for_run(self, run):
+        interval = self.poll_interval_min
+        deadline = self.turn_deadline or Deadline(self.run_timeout)
+        while not deadline.expired():
+            if self.barge_in.is_set():
+                self.cancel_run(run.id)
+                return None
+            run_status = self.call_api('run_retrieve', lambda timeout: self.client.beta.threads.runs.retrieve(
+                thread_id=self.thread.id,
+                run_id=run.id,
+                timeout=timeout
+            ))
+            if run_status.status == 'completed':
+                # Only the messages added since the last one this call has seen
+                after = {'after': self.context.last_message_id} if self.context.last_message_id else {}
+                messages = self.call_api('messages_list', lambda timeout: self.client.beta.threads.messages.list(
+                    thread_id=self.thread.id,
+                    order="asc",
+                    timeout=timeout,
+                    **after
+                ))
+                return self.context.add_listed(messages.data)
+            if run_status.status in ('failed', 'cancelled', 'expired'):
+                print(f"Run ended with status: {run_status.status}")
+                return None
+
+            # Short runs are caught quickly; long ones are polled less often
+            retries_total.inc(kind='poll')
+            time.sleep(min(interval, deadline.remaining()))
+            interval = min(interval * self.poll_backoff, self.poll_interval_max)
+
+        # A stuck run is cancelled rather than left holding the thread
+        self.cancel_in_background(run.id)
+        raise DeadlineExceeded(f"Run {run.id} did not finish within the turn's time")
 
 # HTML template for the frontend
 HTML_TEMPLATE = """
@@ -429,83 +1116,14 @@ HTML_TEMPLATE = """
             }).addTo(map);
         }
 
-        // Address detection
-        function findAddress(text) {
-            // More comprehensive address patterns
-            const addressPatterns = [
-                // Standard street address with city/state
-                /(?:at|on|near)\s+(\d+[\w\s]+(?:street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|circle|cir|court|ct|way|parkway|pkwy|terrace|terr)[\w\s,.-]*(?:,\s*[\w\s]+,\s*[A-Z]{2})?)/i,
-                
-                // Location/address is format
-                /(?:location|address|place)\s+(?:is|at)\s+(\d+[\w\s]+(?:street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|circle|cir|court|ct|way|parkway|pkwy|terrace|terr)[\w\s,.-]*(?:,\s*[\w\s]+,\s*[A-Z]{2})?)/i,
-                
-                // Direct address mention
-                /(\d+[\w\s]+(?:street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|circle|cir|court|ct|way|parkway|pkwy|terrace|terr)[\w\s,.-]*(?:,\s*[\w\s]+,\s*[A-Z]{2})?)/i
-            ];
-
-            let fullAddress = null;
-            
-            // Try to find the address
-            for (let pattern of addressPatterns) {
-                const match = text.match(pattern);
-                if (match) {
-                    fullAddress = match[1].trim();
-                    break;
-                }
-            }
-
-            // If we found an address, try to extract city and state
-            if (fullAddress) {
-                // Try to find city and state if not already included
-                const cityStatePattern = /(?:in|at)\s+([\w\s]+),\s*([A-Z]{2})/i;
-                const cityStateMatch = text.match(cityStatePattern);
-                
-                if (cityStateMatch && !fullAddress.includes(cityStateMatch[1])) {
-                    // Append city and state if they're not already in the address
-                    fullAddress += `, ${cityStateMatch[1]}, ${cityStateMatch[2]}`;
-                } else if (!fullAddress.includes(',')) {
-                    // If no city/state found and not in address, append default (New York, NY)
-                    fullAddress += ', New York, NY';
-                }
-            }
-
-            return fullAddress;
-        }
-
         // Improved geocoding function
         async function updateMapWithAddress(address) {
             try {
-                // First try with the full address
-                let response = await axios.get(`https://nominatim.openstreetmap.org/search`, {
-                    params: {
-                        q: address,
-                        format: 'json',
-                        limit: 1,
-                        addressdetails: 1
-                    },
-                    headers: {
-                        'User-Agent': 'Emergency Dispatch System'
-                    }
-                });
-
-                if (!response.data.length) {
-                    // If no results, try with just the street address part
-                    const streetAddress = address.split(',')[0];
-                    response = await axios.get(`https://nominatim.openstreetmap.org/search`, {
-                        params: {
-                            q: streetAddress + ', New York, NY',  // Append New York by default
-                            format: 'json',
-                            limit: 1,
-                            addressdetails: 1
-                        },
-                        headers: {
-                            'User-Agent': 'Emergency Dispatch System'
-                        }
-                    });
-                }
+                // Cached, rate-limited lookup on the server
+                const response = await axios.get('/geocode', { params: { address: address } });
 
-                if (response.data && response.data.length > 0) {
-                    const { lat, lon } = response.data[0];
+                if (response.data) {
+                    const { lat, lon } = response.data;
                     
                     // Convert to numbers and check if they're valid
                     const latitude = parseFloat(lat);
@@ -589,85 +1207,8 @@ HTML_TEMPLATE = """
         `;
         document.head.appendChild(style);
 
-        // Emergency type detection with problem identification
-        function detectEmergencyType(text) {
-            const emergencyPatterns = {
-                'MEDICAL': {
-                    pattern: /(heart attack|breathing|unconscious|bleeding|injury|injured|fell|fallen|seizure|stroke|choking|allergic|accident|overdose|pain|medical)/i,
-                    problems: {
-                        'CHOKING': /choking/i,
-                        'HEART_ATTACK': /heart attack/i,
-                        'BREATHING': /(?:difficulty |trouble |can't |not |heavy )breathing/i,
-                        'UNCONSCIOUS': /unconscious|passed out/i,
-                        'BLEEDING': /bleeding/i,
-                        'INJURY': /injury|injured|fell|fallen/i
-                    }
-                },
-                'FIRE': {
-                    pattern: /(fire|smoke|burning|flames|gas leak|explosion)/i,
-                    problems: {
-                        'STRUCTURE_FIRE': /building|house|apartment|structure|room on fire/i,
-                        'GAS_LEAK': /gas leak/i,
-                        'EXPLOSION': /explosion/i
-                    }
-                },
-                'POLICE': {
-                    pattern: /(break(-| )?in|robbery|theft|assault|weapon|gunshot|fight|domestic|violence|suspicious|burglary|stolen)/i,
-                    problems: {
-                        'BREAK_IN': /break(-| )?in|burglary/i,
-                        'ASSAULT': /assault|fight|violence/i,
-                        'WEAPON': /weapon|gunshot|gun|knife/i
-                    }
-                }
-            };
-
-            for (let [type, data] of Object.entries(emergencyPatterns)) {
-                if (data.pattern.test(text)) {
-                    // Check for specific problems
-                    for (let [problem, pattern] of Object.entries(data.problems)) {
-                        if (pattern.test(text)) {
-                            emergencySummary.problem = problem.replace(/_/g, ' ');
-                            return type;
-                        }
-                    }
-                    return type;
-                }
-            }
-            return null;
-        }
-
-        // Update AI summary
-        function updateAISummary(data) {
-            const type = detectEmergencyType(data.message);
-            if (type) emergencySummary.type = type;
-            
-            const address = findAddress(data.message);
-            if (address) emergencySummary.location = address;
-
-            // Victim status detection
-            const victimStatusMatch = data.message.match(/(conscious|unconscious|breathing|not breathing|responsive|unresponsive|bleeding|stable|critical|awake|alert|confused|dizzy)/i);
-            if (victimStatusMatch) {
-                emergencySummary.victim_status = victimStatusMatch[0];
-            }
-
-            // Key details detection
-            const keyDetailPatterns = [
-                /multiple victims/i,
-                /weapon present/i,
-                /children involved/i,
-                /elderly person/i,
-                /heavy smoke/i,
-                /spreading quickly/i
-            ];
-
-            keyDetailPatterns.forEach(pattern => {
-                const match = data.message.match(pattern);
-                if (match) {
-                    emergencySummary.key_details.add(match[0]);
-                }
-            });
-
-            // Generate summary HTML
+        // Render the AI summary from the incident details extracted on the server
+        function renderAISummary() {
             let summaryHTML = '<div class="ai-summary">';
             if (emergencySummary.type) summaryHTML += `<strong>Type:</strong> ${emergencySummary.type}<br>`;
             if (emergencySummary.problem) summaryHTML += `<strong>Problem:</strong> ${emergencySummary.problem}<br>`;
@@ -686,72 +1227,99 @@ HTML_TEMPLATE = """
             document.getElementById('aiSummary').innerHTML = summaryHTML;
         }
 
-        // Update dispatch status
-        function updateDispatchStatus(text) {
-            const type = detectEmergencyType(text);
-            if (type && !emergencyType) {
-                emergencyType = type;
-            }
-
-            if (emergencyType) {
-                switch (emergencyType) {
-                    case 'MEDICAL':
-                        dispatchedUnits.add('🚑 Ambulance');
-                        if (text.match(/critical|severe|unconscious|not breathing/i)) {
-                            dispatchedUnits.add('🚁 Medical Helicopter');
-                        }
-                        break;
-                    case 'FIRE':
-                        dispatchedUnits.add('🚒 Fire Engine');
-                        dispatchedUnits.add('🚑 Ambulance (Standby)');
-                        if (text.match(/large|spreading|building|structure/i)) {
-                            dispatchedUnits.add('🚒 Additional Fire Units');
-                        }
-                        break;
-                    case 'POLICE':
-                        dispatchedUnits.add('🚓 Police Units');
-                        if (text.match(/weapon|gun|knife|violent|assault/i)) {
-                            dispatchedUnits.add('🚨 SWAT Team');
-                        }
-                        break;
-                }
+        // Render dispatch status
+        function renderDispatchStatus() {
+            if (!emergencyType) return;
 
-                const statusHTML = `
-                    <div class="status-emergency">
-                        <span style="font-size: 1.2em">🚨 ${emergencyType} EMERGENCY IN PROGRESS 🚨</span><br>
-                        <strong>Dispatched Units:</strong><br>
-                        ${Array.from(dispatchedUnits).map(unit => `• ${unit}`).join('<br>')}
-                        ${emergencySummary.location ? `<br><strong>Location:</strong> ${emergencySummary.location}` : ''}
-                    </div>
-                `;
-                document.getElementById('dispatchStatus').innerHTML = statusHTML;
-            }
+            const statusHTML = `
+                <div class="status-emergency">
+                    <span style="font-size: 1.2em">🚨 ${emergencyType} EMERGENCY IN PROGRESS 🚨</span><br>
+                    <strong>Dispatched Units:</strong><br>
+                    ${Array.from(dispatchedUnits).map(unit => `• ${unit}`).join('<br>')}
+                    ${emergencySummary.location ? `<br><strong>Location:</strong> ${emergencySummary.location}` : ''}
+                </div>
+            `;
+            document.getElementById('dispatchStatus').innerHTML = statusHTML;
         }
 
         // Socket event handlers
-        socket.on('transcript_update', function(data) {
-            // Update transcript
+        function onTranscriptUpdate(data) {
+            // Update transcript, reusing the element of a message that is being streamed
             const transcript = document.getElementById('transcript');
-            const message = document.createElement('div');
-            message.className = 'message';
-            message.innerHTML = `
-                <span class="timestamp">${data.timestamp}</span>
-                <br>
-                <span class="${data.role}">${data.role}: ${data.message}</span>
-            `;
-            transcript.appendChild(message);
+            let message = data.message_id ? document.getElementById(`msg-${data.message_id}`) : null;
+            if (!message) {
+                message = document.createElement('div');
+                message.className = 'message';
+                if (data.message_id) message.id = `msg-${data.message_id}`;
+                message.innerHTML = `
+                    <span class="timestamp">${data.timestamp}</span>
+                    <br>
+                    <span class="${data.role}">${data.role}: <span class="text"></span></span>
+                `;
+                transcript.appendChild(message);
+            }
+            const text = message.querySelector('.text');
+            if (data.partial) {
+                text.textContent += data.message;
+            } else {
+                // A reply the caller talked over is kept, marked as cut off
+                text.textContent = data.interrupted ? `${data.message} [interrupted]` : data.message;
+            }
             transcript.scrollTop = transcript.scrollHeight;
-            
-            // Check for address
-            const address = findAddress(data.message);
-            if (address) {
-                emergencySummary.location = address;
-                updateMapWithAddress(address);
+        }
+
+        // Only the incident fields that changed on the server arrive here
+        function onIncidentDiff(data) {
+            const changes = data.changes;
+            let changed = false;
+            ['type', 'problem', 'victim_status', 'location'].forEach(field => {
+                if (changes[field] && changes[field].value !== undefined) {
+                    emergencySummary[field] = changes[field].value;
+                    changed = true;
+                }
+            });
+            if (changes.type && changes.type.value !== undefined) emergencyType = changes.type.value;
+            Object.keys(changes.key_details || {}).forEach(detail => {
+                if (!emergencySummary.key_details.has(detail)) changed = true;
+                emergencySummary.key_details.add(detail);
+            });
+            Object.keys(changes.units || {}).forEach(unit => {
+                if (!dispatchedUnits.has(unit)) changed = true;
+                dispatchedUnits.add(unit);
+            });
+
+            if (changes.location && changes.location.value !== undefined) {
+                // The server adds the default region to bare street addresses
+                updateMapWithAddress(changes.location.value);
             }
-            
-            // Update other components
-            updateDispatchStatus(data.message);
-            updateAISummary(data);
+
+            // Confidence-only updates leave the rendered panels untouched
+            if (!changed) return;
+            renderDispatchStatus();
+            renderAISummary();
+        }
+
+        // Updates arrive in batched frames; hand each event to its handler
+        const eventHandlers = {
+            transcript_update: onTranscriptUpdate,
+            incident_diff: onIncidentDiff
+        };
+        socket.on('event_batch', function(frame, ack) {
+            frame.events.forEach(item => {
+                const handler = eventHandlers[item.event];
+                if (handler) handler(item.data);
+            });
+            // Lets the server send the next frame
+            if (ack) ack();
+        });
+
+        // Server is at capacity and could not take the call
+        socket.on('call_rejected', function(data) {
+            callActive = false;
+            const button = document.getElementById('emergencyButton');
+            button.textContent = 'Start Emergency Call';
+            button.classList.remove('active');
+            document.getElementById('dispatchStatus').innerHTML = `<div class="status-emergency">${data.reason}</div>`;
         });
 
         // Initialize everything when page loads
@@ -795,18 +1363,110 @@ HTML_TEMPLATE = """
 def home():
     return render_template_string(HTML_TEMPLATE)
 
+@app.route('/pipeline')
+def pipeline_stats():
+    return jsonify(utterance_pipeline.metrics())
+
+@app.route('/events')
+def event_stats():
+    return jsonify(event_fanout.stats())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/trace/<session_id>')
+def call_trace(session_id):
+    trace = tracer.export(session_id)
+    if trace is None:
+        return jsonify({'error': 'unknown call'}), 404
+    return jsonify(trace)
+
+@app.route('/incident/<session_id>')
+def incident_snapshot(session_id):
+    dispatcher = sessions.get(session_id)
+    if dispatcher is None:
+        return jsonify({'error': 'unknown call'}), 404
+    return jsonify(dispatcher.incident.snapshot())
+
+@app.route('/geocode')
+def geocode():
+    """Coordinates for ?address=, or for the current address of call ?session_id=."""
+    address = request.args.get('address')
+    if not address:
+        dispatcher = sessions.get(request.args.get('session_id'))
+        address = dispatcher.current_address if dispatcher else None
+    if not address:
+        return jsonify({'error': 'no address'}), 400
+    result = get_geocoder().geocode(address)
+    if result is None:
+        return jsonify({'error': 'address not found', 'address': address}), 404
+    return jsonify(dict(result, address=address))
+
+def create_dispatcher(session_id):
+    return EmergencyDispatcher(session_id, client=get_openai_client(), threads=assistant_threads)
+
+def create_async_dispatcher(session_id):
+    return AsyncEmergencyDispatcher(
+        session_id, get_async_openai_client(), ASSISTANT_ID,
+        source=MicrophoneSource(), events=event_fanout, greeting=GREETING,
+        cache=speech_cache, streets=street_index, geocoder=get_geocoder(),
+        transcriber=get_local_transcriber() if TRANSCRIPTION_BACKEND == 'local' else None
+    )
+
+if USE_ASYNC_DISPATCHER:
+    sessions = AsyncSessionManager(create_async_dispatcher, max_sessions=MAX_ASYNC_CALLS)
+else:
+    sessions = SessionManager(create_dispatcher, max_sessions=MAX_CONCURRENT_CALLS)
+metrics.gauge('dispatch_active_calls', 'Calls in progress').set_function(sessions.active_count)
+
 @socketio.on('start_call')
 def handle_start_call():
-    global dispatcher
-    dispatcher = EmergencyDispatcher()
-    thread = threading.Thread(target=dispatcher.run)
-    thread.daemon = True
-    thread.start()
+    join_room(call_room(request.sid))
+    event_fanout.join(request.sid, call_room(request.sid))
+    try:
+        dispatcher = sessions.start(request.sid)
+    except Exception as e:
+        print(f"Error starting call: {e}")
+        dispatcher = None
+    if dispatcher is None:
+        socketio.emit('call_rejected', {
+            'reason': 'All lines are busy. Please try again shortly.',
+            'active_calls': sessions.active_count()
+        }, to=request.sid)
 
 @socketio.on('end_call')
 def handle_end_call():
-    if hasattr(dispatcher, 'cleanup'):
-        dispatcher.cleanup()
+    sessions.end(request.sid)
+    leave_room(call_room(request.sid))
+    event_fanout.leave(request.sid, call_room(request.sid))
+
+@socketio.on('watch_call')
+def handle_watch_call(data):
+    """Let a dashboard follow one call's updates."""
+    join_room(call_room(data['session_id']))
+    event_fanout.join(request.sid, call_room(data['session_id']))
+
+@socketio.on('watch_all_calls')
+def handle_watch_all_calls():
+    join_room(SUPERVISOR_ROOM)
+    event_fanout.join(request.sid, SUPERVISOR_ROOM)
+
+@socketio.on('disconnect')
+def handle_disconnect(*args):
+    sessions.end(request.sid)
+    event_fanout.disconnect(request.sid)
+
+def prewarm_speech_cache():
+    """Synthesize the fixed prompts so greetings play without waiting on the network."""
+    try:
+        speaker = StreamingSpeaker(get_openai_client(), cache=speech_cache)
+        speaker.prewarm(PREWARM_PHRASES)
+        print(f"Speech cache ready: {speech_cache.stats()}")
+    except Exception as e:
+        print(f"Error pre-warming speech cache: {e}")
 
 if __name__ == "__main__":
+    assistant_threads.start()
+    threading.Thread(target=prewarm_speech_cache, daemon=True).start()
     socketio.run(app, debug=True)
@@ -0,0 +1,271 @@
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Seconds; covers a VAD frame up to a slow assistant run
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        return lines + list(self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self.lock:
+            return self.values.get(self.key(labels), 0)
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Gauge(Metric):
+    """A current value, set directly or read from a function at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.function = None
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def value(self, **labels):
+        if self.function is not None:
+            return self.function()
+        with self.lock:
+            return self.values.get(self.key(labels), 0)
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                yield f"{self.name} {_number(self.function())}"
+            except Exception as e:
+                print(f"Error reading gauge {self.name}: {e}")
+            return
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    def snapshot(self, **labels):
+        with self.lock:
+            counts, total = self.values.get(self.key(labels), ([0] * len(self.buckets), 0.0))
+            return {'count': sum(counts), 'sum': total}
+
+    def samples(self):
+        with self.lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self.values.items())
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = _labels(self.labelnames, key, [('le', _number(bound))])
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}"
+
+
+class MetricsRegistry:
+    """Named metrics rendered in the Prometheus text exposition format.
+
+    Asking for a metric that already exists returns it, so every
+    dispatcher can look up the shared counters by name.
+    """
+
+    def __init__(self):
+        self.metrics = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, *args, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"{name} is already a {metric.kind}")
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._get(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, labelnames, buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class Span:
+    def __init__(self, span_id, name, parent_id, attrs):
+        self.span_id = span_id
+        self.name = name
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.start = time.time()
+        self.duration = None
+
+    def to_dict(self):
+        return {'id': self.span_id, 'name': self.name, 'parent': self.parent_id,
+                'start': round(self.start, 6), 'duration': round(self.duration, 6), 'attrs': self.attrs}
+
+
+class Tracer:
+    """Per-call spans around each stage of a turn, also fed into a stage histogram.
+
+    Spans opened inside another span on the same thread become its
+    children. Each call keeps its last max_spans spans, for the last
+    max_traces calls.
+    """
+
+    def __init__(self, registry, max_traces=256, max_spans=2000):
+        self.stage_seconds = registry.histogram(
+            'dispatch_stage_seconds', 'Time spent in each stage of a call', ('stage',))
+        self.stage_errors = registry.counter(
+            'dispatch_stage_errors_total', 'Stages that ended with an exception', ('stage',))
+        self.max_traces = max_traces
+        self.max_spans = max_spans
+        self.traces = OrderedDict()
+        self.ids = itertools.count(1)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, trace_id, name, **attrs):
+        stack = self.local.__dict__.setdefault('stack', [])
+        span = Span(next(self.ids), name, stack[-1].span_id if stack else None, attrs)
+        started = time.perf_counter()
+        stack.append(span)
+        try:
+            yield span
+        except Exception as e:
+            span.attrs['error'] = repr(e)
+            self.stage_errors.inc(stage=name)
+            raise
+        finally:
+            stack.pop()
+            span.duration = time.perf_counter() - started
+            self.stage_seconds.observe(span.duration, stage=name)
+            self._keep(trace_id, span)
+
+    def record(self, trace_id, name, duration, **attrs):
+        """Add a stage that was timed elsewhere, e.g. the silence the VAD waited for."""
+        stack = getattr(self.local, 'stack', None)
+        span = Span(next(self.ids), name, stack[-1].span_id if stack else None, attrs)
+        span.start -= duration
+        span.duration = duration
+        self.stage_seconds.observe(duration, stage=name)
+        self._keep(trace_id, span)
+
+    def _keep(self, trace_id, span):
+        with self.lock:
+            spans = self.traces.get(trace_id)
+            if spans is None:
+                spans = self.traces[trace_id] = []
+                while len(self.traces) > self.max_traces:
+                    self.traces.popitem(last=False)
+            spans.append(span)
+            if len(spans) > self.max_spans:
+                del spans[:len(spans) - self.max_spans]
+
+    def export(self, trace_id):
+        """The call's spans in start order, or None for an unknown call."""
+        with self.lock:
+            spans = self.traces.get(trace_id)
+            if spans is None:
+                return None
+            spans = sorted(spans, key=lambda span: span.start)
+        return {'trace_id': str(trace_id), 'spans': [span.to_dict() for span in spans]}
+
+    def write(self, trace_id, directory):
+        """Save the call's trace as <directory>/trace_<id>.json."""
+        trace = self.export(trace_id)
+        if trace is None:
+            return None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"trace_{trace_id}.json")
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(trace, f, indent=2)
+            return path
+        except Exception as e:
+            print(f"Error writing trace: {e}")
+            return None
@@ -0,0 +1,235 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import openai
+
+# Attempts of hedged stages run on a shared pool: at least one slot per thread that
+# calls a hedged stage (utterance workers, synthesis and transcription pools), and
+# slots of their own for the duplicates
+ATTEMPT_WORKERS = 64
+HEDGE_WORKERS = 16
+
+
+class HedgePool:
+    """Threads for hedged attempts that never queue work.
+
+    A first attempt only goes to the pool while one of attempt_workers
+    slots is free, and a duplicate only while one of hedge_workers is; the
+    caller gets None otherwise. Duplicates never wait behind first attempts.
+    """
+
+    def __init__(self, attempt_workers=ATTEMPT_WORKERS, hedge_workers=HEDGE_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=attempt_workers + hedge_workers, thread_name_prefix="hedge")
+        self.attempt_slots = threading.BoundedSemaphore(attempt_workers)
+        self.hedge_slots = threading.BoundedSemaphore(hedge_workers)
+
+    def submit_attempt(self, fn, *args):
+        return self._submit(self.attempt_slots, fn, *args)
+
+    def submit_hedge(self, fn, *args):
+        return self._submit(self.hedge_slots, fn, *args)
+
+    def _submit(self, slots, fn, *args):
+        if not slots.acquire(blocking=False):
+            return None
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+
+hedge_pool = HedgePool()
+
+
+class DeadlineExceeded(TimeoutError):
+    """A turn ran out of its time budget."""
+
+
+class CircuitOpen(RuntimeError):
+    """A stage's upstream has been failing; it is not called for now."""
+
+
+def retryable(error):
+    """Whether an error says the upstream is slow or failing, rather than that the request is wrong."""
+    if isinstance(error, (DeadlineExceeded, CircuitOpen)):
+        return False
+    return isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError,
+                              TimeoutError, ConnectionError))
+
+
+class Deadline:
+    """A time budget shared by the stages of one turn."""
+
+    def __init__(self, seconds, clock=time.monotonic):
+        self.clock = clock
+        self.expires = clock() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires - self.clock())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+class CircuitBreaker:
+    """Fails fast once a stage has failed `failures` times in a row, for reset_after seconds.
+
+    After that one trial request is let through: if it succeeds the
+    circuit closes, if it fails the circuit opens again.
+    """
+
+    def __init__(self, name, failures=5, reset_after=30.0, clock=time.monotonic):
+        self.name = name
+        self.failures = failures
+        self.reset_after = reset_after
+        self.clock = clock
+        self.state = 'closed'
+        self.errors = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def before(self):
+        with self.lock:
+            if self.state == 'closed':
+                return
+            if self.state == 'open' and self.clock() - self.opened_at >= self.reset_after:
+                self.state = 'trial'
+                return
+            raise CircuitOpen(f"{self.name} is failing; not calling it for now")
+
+    def success(self):
+        with self.lock:
+            self.state = 'closed'
+            self.errors = 0
+
+    def failure(self):
+        with self.lock:
+            self.errors += 1
+            if self.state == 'trial' or (self.state == 'closed' and self.errors >= self.failures):
+                if self.state == 'closed':
+                    print(f"Circuit for {self.name} opened after {self.errors} failures")
+                self.state = 'open'
+                self.opened_at = self.clock()
+
+    def is_open(self):
+        return self.state != 'closed'
+
+
+class LatencyWindow:
+    """The last `size` successful durations of a stage."""
+
+    def __init__(self, size=200, min_samples=20):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def quantile(self, q):
+        """None until there are enough samples to trust."""
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[int(q * (len(ordered) - 1))]
+
+
+class StagePolicy:
+    """How one upstream stage is called: a timeout, jittered retries, a circuit breaker and hedging.
+
+    request(timeout) makes one attempt. Only slow or failing upstreams are
+    retried, with full-jitter exponential backoff, and never past the
+    turn's deadline. With hedging, a duplicate starts once the first attempt
+    outlasts the stage's p95 so far; the first good answer wins and
+    discard(result) gets the other one if it arrives. When the pool has no
+    slot free the attempt runs on the calling thread, unhedged.
+    """
+
+    def __init__(self, name, timeout, attempts=1, backoff=0.2, max_backoff=2.0, breaker=None, hedge=False,
+                 hedge_quantile=0.95, min_hedge_delay=0.1, deadline_bound=True, clock=time.monotonic,
+                 sleep=time.sleep, pool=None):
+        self.name = name
+        self.timeout = timeout
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker(name)
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.min_hedge_delay = min_hedge_delay
+        self.deadline_bound = deadline_bound  # False for stages that outlive a turn, like speech
+        self.latency = LatencyWindow()
+        self.pool = pool or hedge_pool
+        self.clock = clock
+        self.sleep = sleep
+
+    def call(self, request, deadline=None, discard=None, on_retry=None, on_hedge=None):
+        deadline = deadline if self.deadline_bound else None
+        for attempt in range(self.attempts):
+            timeout = self.timeout if deadline is None else min(self.timeout, deadline.remaining())
+            if timeout <= 0:
+                raise DeadlineExceeded(f"No time left for {self.name}")
+            self.breaker.before()
+            started = self.clock()
+            try:
+                if self.hedge:
+                    result = self._hedged(request, timeout, discard, on_hedge)
+                else:
+                    result = request(timeout)
+            except Exception as e:
+                if not retryable(e):
+                    # The upstream answered; the request itself was at fault
+                    self.breaker.success()
+                    raise
+                self.breaker.failure()
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                if attempt + 1 == self.attempts or (deadline is not None and delay >= deadline.remaining()):
+                    raise
+                if on_retry is not None:
+                    on_retry(e)
+                self.sleep(delay)
+                continue
+            self.breaker.success()
+            self.latency.observe(self.clock() - started)
+            return result
+
+    def hedge_delay(self):
+        p = self.latency.quantile(self.hedge_quantile)
+        return None if p is None else max(p, self.min_hedge_delay)
+
+    def _hedged(self, request, timeout, discard, on_hedge):
+        delay = self.hedge_delay()
+        first = None if delay is None or delay >= timeout else self.pool.submit_attempt(request, timeout)
+        if first is None:
+            return request(timeout)
+        if wait([first], timeout=delay).done:
+            return first.result()
+        duplicate = self.pool.submit_hedge(request, timeout - delay)
+        if duplicate is None:
+            return first.result()
+
+        if on_hedge is not None:
+            on_hedge()
+        pending = {first, duplicate}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            good = [future for future in done if future.exception() is None]
+            if good:
+                for future in good[1:]:
+                    if discard is not None:
+                        discard(future.result())
+                for future in pending:
+                    future.add_done_callback(lambda f: discard is not None and f.exception() is None
+                                             and discard(f.result()))
+                return good[0].result()
+            error = next(iter(done)).exception()
+        raise error
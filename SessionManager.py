@@ -0,0 +1,194 @@
+import asyncio
+import threading
+import time
+
+
+class CallSession:
+    """A single active call: its dispatcher and the thread running it."""
+
+    def __init__(self, session_id, dispatcher):
+        self.session_id = session_id
+        self.dispatcher = dispatcher
+        self.thread = None
+        self.future = None  # Set instead of thread when the call runs on an event loop
+        self.started_at = time.time()
+
+
+class SessionManager:
+    """Registry of concurrent calls keyed by Socket.IO session id."""
+
+    def __init__(self, factory, max_sessions=32, join_timeout=2.0):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.join_timeout = join_timeout
+        self.sessions = {}
+        self.reserved = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def active_count(self):
+        """Number of live calls plus slots reserved by calls still starting."""
+        with self.lock:
+            return len(self.sessions) + self.reserved
+
+    def get(self, session_id):
+        with self.lock:
+            session = self.sessions.get(session_id)
+        return session.dispatcher if session else None
+
+    def start(self, session_id):
+        """Start a call for session_id; returns None when every slot is taken."""
+        # A client that starts again without ending first replaces its old call
+        self.end(session_id)
+
+        with self.lock:
+            if len(self.sessions) + self.reserved >= self.max_sessions:
+                self.rejected += 1
+                return None
+            self.reserved += 1
+
+        # Build the dispatcher outside the lock; it talks to the network
+        try:
+            dispatcher = self.factory(session_id)
+        except Exception:
+            with self.lock:
+                self.reserved -= 1
+            raise
+
+        session = CallSession(session_id, dispatcher)
+        session.thread = threading.Thread(
+            target=self._run_session,
+            args=(session,),
+            name=f"call-{session_id}",
+            daemon=True
+        )
+        with self.lock:
+            self.reserved -= 1
+            self.sessions[session_id] = session
+        session.thread.start()
+        return dispatcher
+
+    def _run_session(self, session):
+        try:
+            session.dispatcher.run()
+        except Exception as e:
+            print(f"Call {session.session_id} ended with error: {e}")
+        finally:
+            # Calls that finish on their own free their slot as well
+            with self.lock:
+                if self.sessions.get(session.session_id) is session:
+                    del self.sessions[session.session_id]
+
+    def end(self, session_id):
+        """Tear down the call for session_id if one is running."""
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+
+        try:
+            session.dispatcher.cleanup()
+        except Exception as e:
+            print(f"Error ending call {session_id}: {e}")
+        if session.thread and session.thread is not threading.current_thread():
+            session.thread.join(self.join_timeout)
+        return True
+
+    def shutdown(self):
+        """End every active call."""
+        with self.lock:
+            session_ids = list(self.sessions)
+        for session_id in session_ids:
+            self.end(session_id)
+
+
+class AsyncSessionManager:
+    """SessionManager for asyncio dispatchers: every call is a task on one event loop.
+
+    The loop runs on a single background thread, so the number of calls is
+    bounded by max_sessions rather than by how many OS threads the process
+    can afford. Dispatchers provide run() as a coroutine and cancel().
+    """
+
+    def __init__(self, factory, max_sessions=256, join_timeout=2.0):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.join_timeout = join_timeout
+        self.sessions = {}
+        self.reserved = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+        self.loop = None
+        self.loop_thread = None
+
+    def _ensure_loop(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.loop_thread = threading.Thread(target=self.loop.run_forever, name="calls", daemon=True)
+                self.loop_thread.start()
+            return self.loop
+
+    def active_count(self):
+        with self.lock:
+            return len(self.sessions) + self.reserved
+
+    def get(self, session_id):
+        with self.lock:
+            session = self.sessions.get(session_id)
+        return session.dispatcher if session else None
+
+    def start(self, session_id):
+        """Start a call for session_id; returns None when every slot is taken."""
+        self.end(session_id)
+        loop = self._ensure_loop()
+
+        with self.lock:
+            if len(self.sessions) + self.reserved >= self.max_sessions:
+                self.rejected += 1
+                return None
+            self.reserved += 1
+
+        try:
+            dispatcher = self.factory(session_id)
+        except Exception:
+            with self.lock:
+                self.reserved -= 1
+            raise
+
+        session = CallSession(session_id, dispatcher)
+        with self.lock:
+            self.reserved -= 1
+            self.sessions[session_id] = session
+        session.future = asyncio.run_coroutine_threadsafe(self._run_session(session), loop)
+        return dispatcher
+
+    async def _run_session(self, session):
+        try:
+            await session.dispatcher.run()
+        except Exception as e:
+            print(f"Call {session.session_id} ended with error: {e}")
+        finally:
+            with self.lock:
+                if self.sessions.get(session.session_id) is session:
+                    del self.sessions[session.session_id]
+
+    def end(self, session_id):
+        """Cancel the call for session_id and wait briefly for it to clean up."""
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+
+        self.loop.call_soon_threadsafe(session.dispatcher.cancel)
+        try:
+            session.future.result(self.join_timeout)
+        except Exception as e:
+            print(f"Error ending call {session_id}: {e!r}")
+        return True
+
+    def shutdown(self):
+        with self.lock:
+            session_ids = list(self.sessions)
+        for session_id in session_ids:
+            self.end(session_id)
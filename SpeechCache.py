@@ -0,0 +1,108 @@
+import hashlib
+import os
+import threading
+import tempfile
+from collections import OrderedDict
+
+
+class SpeechCache:
+    """Content-addressed cache of synthesized speech.
+
+    Entries are keyed by a hash of (text, model, voice, format). Recently
+    used audio stays in an in-memory LRU bounded by max_bytes. Only entries
+    put with persist=True (the fixed, pre-warmed prompts) are also written to
+    directory so they survive restarts; replies to callers, which can hold
+    names and addresses, never reach the disk.
+    """
+
+    def __init__(self, directory=None, max_bytes=32 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text, model, voice, response_format="pcm"):
+        raw = "\x00".join((text.strip(), model, voice, response_format))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".audio")
+
+    def get(self, key):
+        """Return cached audio bytes, or None."""
+        data = self.recall(key)
+        return data if data is not None else self.load(key)
+
+    def recall(self, key):
+        """Audio held in memory, or None; never touches the disk."""
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            return data
+
+    def load(self, key):
+        """Audio read from directory into memory, or None."""
+        data = None
+        if self.directory:
+            try:
+                with open(self._path(key), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                pass
+
+        with self.lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._remember(key, data)
+        return data
+
+    def put(self, key, data, persist=False):
+        if not data:
+            return
+        self._remember(key, data)
+        if persist and self.directory:
+            self._write(key, data)
+
+    def _remember(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def _write(self, key, data):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename so readers never see a partial file
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Error writing speech cache: {e}")
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses
+            }
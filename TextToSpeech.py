@@ -0,0 +1,306 @@
+import itertools
+import re
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from AudioSource import sd
+
+# OpenAI returns raw "pcm" speech as 24 kHz, 16-bit, mono, little-endian
+TTS_SAMPLE_RATE = 24000
+
+# Sentences synthesized at the same time across all calls
+SYNTHESIS_WORKERS = 16
+synthesis_pool = ThreadPoolExecutor(max_workers=SYNTHESIS_WORKERS, thread_name_prefix="tts")
+
+
+class SentenceSplitter:
+    """Accumulate streamed text and release it one complete sentence at a time."""
+    boundary = re.compile(r'[.!?]+["\')\]]*\s+')
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, text):
+        """Add text and return any sentences it completed."""
+        self.buffer += text
+        sentences = []
+        while True:
+            match = self.boundary.search(self.buffer)
+            if not match:
+                break
+            sentence = self.buffer[:match.end()].strip()
+            self.buffer = self.buffer[match.end():]
+            if sentence:
+                sentences.append(sentence)
+        return sentences
+
+    def flush(self):
+        """Return whatever text is left once the stream has ended."""
+        remainder = self.buffer.strip()
+        self.buffer = ""
+        return remainder
+
+
+def split_sentences(text):
+    splitter = SentenceSplitter()
+    sentences = splitter.feed(text)
+    remainder = splitter.flush()
+    if remainder:
+        sentences.append(remainder)
+    return sentences
+
+
+class SoundDeviceSink:
+    """Plays int16 PCM through an in-process sounddevice output stream."""
+
+    def __init__(self, sample_rate=TTS_SAMPLE_RATE, channels=1):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.stream = None
+
+    def write(self, samples):
+        if self.stream is None:
+            self.stream = sd.OutputStream(samplerate=self.sample_rate, channels=self.channels, dtype=np.int16)
+            self.stream.start()
+        self.stream.write(samples.reshape(-1, self.channels))
+
+    def abort(self):
+        """Drop whatever is buffered in the device right away."""
+        stream, self.stream = self.stream, None
+        if stream is not None:
+            stream.abort()
+            stream.close()
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+class NullSink:
+    """Discards audio; used on servers without an output device and in replays."""
+
+    def __init__(self, sample_rate=TTS_SAMPLE_RATE, channels=1):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.samples_written = 0
+
+    def write(self, samples):
+        self.samples_written += len(samples)
+
+    def abort(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def default_sink():
+    return SoundDeviceSink() if sd is not None else NullSink()
+
+
+class SynthesisJob:
+    """One sentence being synthesized; yields PCM chunks as they arrive."""
+
+    def __init__(self):
+        self.chunks = queue.Queue()
+        self.cancelled = False
+
+    def cancel(self):
+        """Stop fetching; audio nobody will play is not worth paying for."""
+        self.cancelled = True
+
+    def __iter__(self):
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+
+class SpeechStream:
+    """Ordered playback of sentences that are synthesized concurrently.
+
+    say() starts synthesis immediately; a player thread plays each sentence's
+    audio in the order the sentences were added, beginning with the first
+    chunk of the first sentence while later ones are still being fetched.
+    A stream only starts playing once the speaker's previous stream is done.
+    StreamingSpeaker.interrupt() silences the stream and cancels the rest.
+    """
+
+    def __init__(self, speaker, after=None):
+        self.speaker = speaker
+        self.generation = speaker.generation
+        self.after = after
+        self.jobs = queue.Queue()
+        self.player = threading.Thread(target=self._play, daemon=True)
+        self.player.start()
+
+    @property
+    def interrupted(self):
+        return self.generation != self.speaker.generation
+
+    def say(self, sentence):
+        if not self.interrupted:
+            self.jobs.put(self.speaker.synthesize(sentence))
+
+    def end(self):
+        """No more sentences; playback carries on without anyone waiting for it."""
+        self.jobs.put(None)
+
+    def close(self):
+        """Wait until everything added so far has been played."""
+        self.end()
+        self.player.join()
+
+    def _play(self):
+        if self.after is not None:
+            self.after.player.join()
+            self.after = None
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            if self.interrupted:
+                job.cancel()
+                continue
+            leftover = b""
+            try:
+                for chunk in job:
+                    if self.interrupted:
+                        job.cancel()
+                        break
+                    # Chunks can split a sample in half; carry the odd byte over
+                    data = leftover + chunk
+                    usable = len(data) - len(data) % 2
+                    leftover = data[usable:]
+                    if usable:
+                        self.speaker.sink.write(np.frombuffer(data[:usable], dtype='<i2'))
+            except Exception as e:
+                if not self.interrupted:
+                    print(f"Text-to-speech error: {e}")
+
+
+class StreamingSpeaker:
+    """Sentence-level pipelined TTS: synthesize in parallel, play in order."""
+
+    def __init__(self, client, sink=None, model="tts-1", voice="shimmer", chunk_size=4800,
+                 executor=None, cache=None, call=None, timeout=30):
+        self.client = client
+        self.sink = sink or default_sink()
+        self.model = model
+        self.voice = voice
+        self.chunk_size = chunk_size  # 100 ms of 24 kHz audio
+        self.executor = executor or synthesis_pool
+        self.cache = cache
+        # call(stage, request, discard) makes one request, request(timeout), e.g. with retries and hedging
+        self.call = call or (lambda stage, request, discard=None: request(timeout))
+        self.generation = 0  # Bumped by interrupt(); streams from older generations go quiet
+        self.last_stream = None
+        self.lock = threading.Lock()
+
+    def synthesize(self, text, persist=False):
+        job = SynthesisJob()
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(text, self.model, self.voice)
+            data = self.cache.get(key)
+            if data is not None:
+                # Cached audio plays with no network round trip at all
+                job.chunks.put(data)
+                job.chunks.put(None)
+                return job
+        self.executor.submit(self._fetch, text, job, key, persist)
+        return job
+
+    def _open(self, text, timeout):
+        """Start one synthesis request and wait for its first chunk."""
+        response = self.client.audio.speech.with_streaming_response.create(
+            model=self.model,
+            voice=self.voice,
+            input=text,
+            response_format="pcm",
+            timeout=timeout
+        )
+        chunks = response.__enter__().iter_bytes(self.chunk_size)
+        try:
+            first = next(chunks, b"")
+        except BaseException:
+            response.__exit__(None, None, None)
+            raise
+        return response, chunks, first
+
+    def _fetch(self, text, job, key=None, persist=False):
+        parts = [] if key else None
+        response = None
+        try:
+            response, chunks, first = self.call(
+                'speech', lambda timeout: self._open(text, timeout),
+                discard=lambda opened: opened[0].__exit__(None, None, None)
+            )
+            for chunk in itertools.chain([first], chunks):
+                if job.cancelled:
+                    # Closing the response early stops the download
+                    parts = None
+                    break
+                if not chunk:
+                    continue
+                job.chunks.put(chunk)
+                if parts is not None:
+                    parts.append(chunk)
+            response.__exit__(None, None, None)
+            response = None
+            if parts:
+                self.cache.put(key, b"".join(parts), persist=persist)
+        except Exception as e:
+            job.chunks.put(e)
+        finally:
+            if response is not None:
+                response.__exit__(None, None, None)
+            job.chunks.put(None)
+
+    def prewarm(self, texts):
+        """Synthesize fixed prompts into the cache ahead of time, and onto disk."""
+        jobs = [self.synthesize(sentence, persist=True) for text in texts for sentence in split_sentences(text)]
+        for job in jobs:
+            try:
+                for _ in job:
+                    pass
+            except Exception as e:
+                print(f"Error pre-warming speech cache: {e}")
+
+    def open(self):
+        with self.lock:
+            self.last_stream = SpeechStream(self, after=self.last_stream)
+            return self.last_stream
+
+    def interrupt(self):
+        """Stop all playback now, e.g. because the caller started talking."""
+        self.generation += 1
+        abort = getattr(self.sink, 'abort', None)
+        if abort is not None:
+            abort()
+
+    def speak(self, text):
+        """Speak text, starting playback as soon as the first sentence has audio."""
+        stream = self.open()
+        try:
+            for sentence in split_sentences(text):
+                stream.say(sentence)
+        finally:
+            stream.close()
+
+    def start(self, text):
+        """Queue text to be spoken and return at once; streams opened later play after it."""
+        stream = self.open()
+        for sentence in split_sentences(text):
+            stream.say(sentence)
+        stream.end()
+        return stream
+
+    def close(self):
+        self.sink.close()
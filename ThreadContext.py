@@ -0,0 +1,104 @@
+import threading
+
+# Rough size of English text in model tokens
+CHARS_PER_TOKEN = 4
+
+ROLE_NAMES = {'user': 'Caller', 'assistant': 'Dispatcher'}
+
+
+def clip(text, limit):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+
+class ThreadContext:
+    """Local mirror of one call's assistant thread, and what each run gets to see.
+
+    Every message sent or received is recorded here with its id, so the
+    thread never has to be listed from the start: replies are fetched with
+    the last seen id as the cursor. Once the call grows past max_tokens,
+    runs only show the model the last keep_messages messages; the older
+    turns are rolled into a short summary passed as extra instructions,
+    so the prompt, and each turn's latency, stops growing with the call.
+    """
+
+    def __init__(self, keep_messages=8, max_tokens=1500, summary_chars=1200, line_chars=160):
+        self.keep_messages = keep_messages
+        self.max_tokens = max_tokens
+        self.summary_chars = summary_chars
+        self.line_chars = line_chars
+        self.messages = []  # (message id, role, text), oldest first
+        self.message_ids = set()
+        self.last_message_id = None
+        self.lock = threading.Lock()
+
+    def add(self, role, text, message_id=None):
+        if not text:
+            return
+        with self.lock:
+            self.messages.append((message_id, role, text))
+            if message_id:
+                self.message_ids.add(message_id)
+                self.last_message_id = message_id
+
+    def add_listed(self, messages):
+        """Record messages from a thread listing (oldest first); returns the newest assistant text.
+
+        Messages already mirrored, such as a streamed reply, are skipped.
+        """
+        reply = None
+        for message in messages:
+            if message.id in self.message_ids:
+                continue
+            text = "".join(part.text.value for part in message.content if getattr(part, 'text', None))
+            self.add(message.role, text, message.id)
+            if message.role == 'assistant' and text:
+                reply = text
+        return reply
+
+    def __len__(self):
+        return len(self.messages)
+
+    def tokens(self):
+        with self.lock:
+            return sum(len(text) for _, _, text in self.messages) // CHARS_PER_TOKEN
+
+    def truncated(self):
+        return len(self.messages) > self.keep_messages and self.tokens() > self.max_tokens
+
+    def summary(self, facts=None):
+        """Compact account of the call for the turns the model no longer sees."""
+        with self.lock:
+            older = self.messages[:-self.keep_messages]
+        lines = [f"{ROLE_NAMES.get(role, role)}: {clip(text, self.line_chars)}" for _, role, text in older]
+        # The opening report and the latest older turns matter most; drop from the middle
+        budget = self.summary_chars
+        kept_head = lines[:2]
+        budget -= sum(len(line) + 1 for line in kept_head)
+        kept_tail = []
+        for line in reversed(lines[2:]):
+            if budget - len(line) - 1 < 0:
+                break
+            kept_tail.insert(0, line)
+            budget -= len(line) + 1
+        skipped = len(lines) - len(kept_head) - len(kept_tail)
+
+        parts = ["Earlier in this call (these messages are no longer shown to you):"]
+        known = [f"{field.replace('_', ' ')}: {', '.join(value) if isinstance(value, list) else value}"
+                 for field, value in (facts or {}).items() if value]
+        if known:
+            parts.append("Known so far - " + "; ".join(known) + ".")
+        parts.extend(kept_head)
+        if skipped:
+            parts.append(f"[{skipped} earlier messages omitted]")
+        parts.extend(kept_tail)
+        return "\n".join(parts)
+
+    def run_options(self, facts=None):
+        """Extra arguments for a run: none until the call is long, then truncation plus a summary."""
+        if not self.truncated():
+            return {}
+        return {
+            'truncation_strategy': {'type': 'last_messages', 'last_messages': self.keep_messages},
+            'additional_instructions': self.summary(facts)
+        }
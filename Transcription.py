@@ -0,0 +1,312 @@
+import itertools
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from AudioBuffer import encode_wav
+
+try:
+    from faster_whisper import WhisperModel
+except ImportError:
+    # The local backend is optional; without it only the OpenAI endpoint is available
+    WhisperModel = None
+
+# Pieces of utterances transcribed while callers are still talking, across all calls
+TRANSCRIPTION_WORKERS = 8
+transcription_pool = ThreadPoolExecutor(max_workers=TRANSCRIPTION_WORKERS, thread_name_prefix="stt")
+
+
+class SpeculativeUtterance:
+    """An utterance whose leading pieces were sent for transcription while it was spoken.
+
+    pieces are futures in speaking order; tail is the audio after the last
+    piece, which is all that is left to transcribe once the caller stops.
+    """
+
+    def __init__(self, utterance_id):
+        self.utterance_id = utterance_id
+        self.pieces = []
+        self.tail = None
+        self.tail_has_speech = False
+        self.audio = None  # The whole utterance, kept only when it is archived
+        self.published = 0  # Pieces already shown and folded into the incident
+        self.lock = threading.Lock()
+
+    def piece_texts(self, timeout=None):
+        texts = []
+        for piece in self.pieces:
+            try:
+                texts.append(piece.result(timeout).strip())
+            except Exception as e:
+                print(f"Error transcribing partial speech: {e}")
+                texts.append("")
+        return texts
+
+
+class SpeculativeTranscriber:
+    """Cuts a growing utterance at the caller's pauses and transcribes each piece in the background.
+
+    The capture callback calls start() when speech begins, commit() at each
+    short pause and finish() at the end of the utterance. Pieces never
+    overlap, so the final pass only has the tail left to transcribe.
+    """
+
+    def __init__(self, transcribe, sample_rate=16000, min_piece=1.0, executor=None, on_piece=None,
+                 prefix="utterance"):
+        self.transcribe = transcribe
+        self.min_piece_samples = int(min_piece * sample_rate)
+        self.executor = executor or transcription_pool
+        self.on_piece = on_piece
+        self.prefix = prefix
+        self.ids = itertools.count(1)
+        self.current = None
+        self.committed = 0
+
+    def start(self):
+        self.current = SpeculativeUtterance(f"{self.prefix}-{next(self.ids)}")
+        self.committed = 0
+
+    def note_speech(self):
+        if self.current is not None:
+            self.current.tail_has_speech = True
+
+    def commit(self, audio):
+        """Send everything after the previous piece, if there is enough of it."""
+        utterance = self.current
+        if utterance is None or not utterance.tail_has_speech \
+                or len(audio) - self.committed < self.min_piece_samples:
+            return None
+        # The capture buffer is reused, so the worker gets its own copy
+        piece = self.executor.submit(self.transcribe, audio[self.committed:].copy())
+        utterance.pieces.append(piece)
+        utterance.tail_has_speech = False
+        self.committed = len(audio)
+        if self.on_piece is not None:
+            piece.add_done_callback(lambda _: self.on_piece(utterance))
+        return piece
+
+    def finish(self, audio, keep_audio=False):
+        """Close the utterance; returns it with the untranscribed tail attached."""
+        utterance = self.current or SpeculativeUtterance(f"{self.prefix}-{next(self.ids)}")
+        utterance.tail = audio[self.committed:].copy()
+        if not self.current:
+            utterance.tail_has_speech = True
+        if keep_audio:
+            utterance.audio = audio.copy()
+        self.current = None
+        self.committed = 0
+        return utterance
+
+
+class OpenAITranscriber:
+    """The hosted whisper-1 endpoint: each utterance is uploaded as an in-memory WAV."""
+
+    name = "openai"
+    streaming = False
+
+    def __init__(self, client, model="whisper-1", sample_rate=16000, channels=1, call=None, timeout=30):
+        self.client = client
+        self.model = model
+        self.sample_rate = sample_rate
+        self.channels = channels
+        # call(stage, request, discard) makes one request, request(timeout), e.g. with retries and hedging
+        self.call = call or (lambda stage, request, discard=None: request(timeout))
+
+    def transcribe(self, audio):
+        return self.transcribe_wav(encode_wav(audio, self.sample_rate, self.channels))
+
+    def transcribe_wav(self, wav_bytes):
+        transcript = self.call('transcription', lambda timeout: self.client.audio.transcriptions.create(
+            model=self.model,
+            file=("speech.wav", wav_bytes, "audio/wav"),
+            response_format="text",
+            timeout=timeout
+        ))
+        return transcript.strip() if transcript else ""
+
+
+class LocalWhisperTranscriber:
+    """faster-whisper on CPU threads with int8 weights; no upload, and word timings for streaming.
+
+    One model is meant to be shared by all calls: `workers` utterances are
+    decoded at once, each on `cpu_threads` threads.
+    """
+
+    name = "local"
+    streaming = True
+
+    def __init__(self, model="base.en", compute_type="int8", cpu_threads=4, workers=2, beam_size=1,
+                 language="en", sample_rate=16000):
+        if WhisperModel is None:
+            raise RuntimeError("faster-whisper is not installed (pip install faster-whisper)")
+        if sample_rate != 16000:
+            raise ValueError("Whisper models expect 16 kHz audio")
+        self.model = WhisperModel(model, device="cpu", compute_type=compute_type,
+                                  cpu_threads=cpu_threads, num_workers=workers)
+        self.beam_size = beam_size
+        self.language = language
+
+    def words(self, audio):
+        """(word, start, end) for int16 audio, times in seconds from its first sample."""
+        samples = np.asarray(audio, dtype=np.float32)
+        if samples.ndim > 1:
+            samples = samples.mean(axis=1)
+        segments, _ = self.model.transcribe(
+            samples / 32768.0, beam_size=self.beam_size, language=self.language,
+            word_timestamps=True, condition_on_previous_text=False
+        )
+        return [(word.word.strip(), word.start, word.end)
+                for segment in segments for word in (segment.words or []) if word.word.strip()]
+
+    def transcribe(self, audio):
+        return " ".join(word for word, _, _ in self.words(audio))
+
+
+class FallbackTranscriber:
+    """Tries each backend in order; one that fails is skipped for retry_after seconds.
+
+    Streaming goes through the first backend; an utterance whose stream
+    fails is transcribed again here as a whole.
+    """
+
+    def __init__(self, backends, retry_after=30.0, clock=time.monotonic):
+        self.backends = list(backends)
+        self.retry_after = retry_after
+        self.clock = clock
+        self.failed_at = {}  # Backend index -> time of its last failure
+        self.name = "+".join(backend.name for backend in self.backends)
+        self.lock = threading.Lock()
+
+    @property
+    def streaming(self):
+        return getattr(self.backends[0], 'streaming', False)
+
+    def words(self, audio):
+        return self.backends[0].words(audio)
+
+    def transcribe(self, audio):
+        now = self.clock()
+        with self.lock:
+            order = [i for i in range(len(self.backends))
+                     if now - self.failed_at.get(i, float('-inf')) >= self.retry_after]
+        # Everything failed recently: try them all again rather than give up
+        order = order or list(range(len(self.backends)))
+        error = None
+        for i in order:
+            backend = self.backends[i]
+            try:
+                transcript = backend.transcribe(audio)
+            except Exception as e:
+                print(f"Transcription with {backend.name} failed: {e}")
+                with self.lock:
+                    self.failed_at[i] = self.clock()
+                error = e
+                continue
+            with self.lock:
+                self.failed_at.pop(i, None)
+            return transcript
+        raise error
+
+
+TRANSCRIBER_TYPES = {
+    'openai': OpenAITranscriber,
+    'local': LocalWhisperTranscriber,
+}
+
+
+def create_transcriber(kind, **kwargs):
+    """Build a backend by name: openai (takes the client) or local."""
+    if kind not in TRANSCRIBER_TYPES:
+        raise ValueError(f"Unknown transcription backend: {kind}")
+    return TRANSCRIBER_TYPES[kind](**kwargs)
+
+
+def _same_word(a, b):
+    return re.sub(r"[^\w']", "", a.lower()) == re.sub(r"[^\w']", "", b.lower())
+
+
+class ChunkedStream:
+    """Transcribes one utterance with a local backend while it is still being spoken.
+
+    Every chunk seconds of new audio, the unconfirmed end of the utterance
+    is transcribed again. Words that two passes in a row agree on are
+    confirmed and their audio dropped, so each pass stays short and finish()
+    only has the last second or two left to transcribe.
+    """
+
+    def __init__(self, backend, sample_rate=16000, chunk=1.0, executor=None, on_confirmed=None,
+                 utterance_id=None):
+        self.backend = backend
+        self.sample_rate = sample_rate
+        self.chunk_samples = int(chunk * sample_rate)
+        self.executor = executor or transcription_pool
+        self.on_confirmed = on_confirmed
+        self.utterance_id = utterance_id
+        self.blocks = []
+        self.offset = 0  # Samples already confirmed and dropped from the front
+        self.unsent = 0  # Samples added since the last pass started
+        self.confirmed = []
+        self.hypothesis = []  # The last pass's unconfirmed (word, start, end)
+        self.passes = 0
+        self.decoding = None
+        self.lock = threading.Lock()
+
+    def feed(self, audio):
+        with self.lock:
+            # The capture buffer is reused, so keep a copy
+            self.blocks.append(np.array(audio, copy=True))
+            self.unsent += len(audio)
+            if self.unsent < self.chunk_samples:
+                return
+        # Fed from the capture thread only; one pass at a time while the audio keeps collecting
+        if self.decoding is not None and not self.decoding.done():
+            return
+        self.unsent = 0
+        self.decoding = self.executor.submit(self._pass)
+
+    def _audio(self):
+        if len(self.blocks) > 1:
+            self.blocks = [np.concatenate(self.blocks)]
+        return self.blocks[0] if self.blocks else np.zeros(0, dtype=np.int16)
+
+    def _pass(self, final=False):
+        with self.lock:
+            audio, offset = self._audio(), self.offset
+            self.passes += 1
+        start = offset / self.sample_rate
+        words = [(word, start + s, start + e) for word, s, e in self.backend.words(audio)] if len(audio) else []
+
+        with self.lock:
+            agreed = words if final else []
+            if not final:
+                for new, old in zip(words, self.hypothesis):
+                    if not _same_word(new[0], old[0]):
+                        break
+                    agreed.append(new)
+            self.hypothesis = words[len(agreed):]
+            if agreed:
+                self.confirmed.extend(word for word, _, _ in agreed)
+                # Audio fed since the pass began is kept; only confirmed speech is dropped
+                audio = self._audio()
+                cut = min(max(int(agreed[-1][2] * self.sample_rate) - self.offset, 0), len(audio))
+                self.blocks = [audio[cut:]]
+                self.offset += cut
+        if agreed and not final and self.on_confirmed is not None:
+            self.on_confirmed(self, " ".join(word for word, _, _ in agreed))
+        return agreed
+
+    def text(self):
+        with self.lock:
+            return " ".join(self.confirmed)
+
+    def finish(self, timeout=None):
+        """Wait for the pass in flight, transcribe what is left and return the whole utterance."""
+        with self.lock:
+            decoding = self.decoding
+        if decoding is not None:
+            decoding.result(timeout)
+        self._pass(final=True)
+        return self.text()
@@ -1,11 +1,42 @@
 import pytest
 import numpy as np
-from Main import EmergencyDispatcher
+from Main import EmergencyDispatcher, SentenceSplitter
+from SessionManager import SessionManager, AsyncSessionManager
+from AsyncDispatcher import AsyncEmergencyDispatcher
+from AudioBuffer import SpeechRingBuffer
+from UtterancePipeline import UtterancePipeline
+from Transcription import SpeculativeTranscriber, ChunkedStream, FallbackTranscriber, OpenAITranscriber
+from VoiceActivity import create_vad, frame_signal, AdaptiveEndpointer
+from AudioSource import ArraySource, WavFileSource, PcmStreamSource
+from TextToSpeech import StreamingSpeaker, NullSink, split_sentences
+from SpeechCache import SpeechCache
+from AssistantThreads import AssistantThreadPool
+from IncidentExtraction import extract_incident, extract_address
+from IncidentState import IncidentState
+from EventFanout import EventFanout, call_room, SUPERVISOR_ROOM
+from Gazetteer import StreetIndex, normalize_numbers, normalize_street
+from Geocoding import Geocoder, GeocodeCache, GazetteerBackend, TokenBucket, Unlimited, normalize_address
+from FakeOpenAIServer import FakeOpenAIServer, LatencyModel, DEFAULT_REPLIES, DEFAULT_TRANSCRIPTS
+import openai
+import json
+import Main
+from Benchmark import run_benchmark, synthetic_call, compare, Turn, STAGES
+from Metrics import MetricsRegistry, Tracer
+from ThreadContext import ThreadContext
+from FastPath import FastPath, PROTOCOLS, protocol_instructions
+from Resilience import StagePolicy, CircuitBreaker, Deadline, DeadlineExceeded, CircuitOpen, HedgePool
 import re
-import sounddevice as sd
+import random
 import tempfile
 import os
-from unittest.mock import Mock, patch
+import io
+import wave
+import threading
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, Future
+from types import SimpleNamespace
+import time
+from unittest.mock import Mock, MagicMock, patch, ANY
 
 @pytest.fixture(autouse=True)
 def mock_flask_app():
@@ -122,12 +153,1980 @@ class TestEmergencyDispatcher:
         test_audio = np.random.rand(samples).astype(np.int16)
         
         with patch.object(dispatcher, 'handle_input') as mock_handle_input:
-            dispatcher.speech_frames = [test_audio]
+            dispatcher.speech_frames.append(test_audio)
             dispatcher.process_recorded_speech()
             
             # Check if handle_input was called based on expected_process
             assert mock_handle_input.called == expected_process, \
                 f"Audio processing for length {audio_length}s should {'not ' if not expected_process else ''}trigger handling"
 
+    def test_wav_encoded_in_memory(self, dispatcher):
+        """Test utterances are encoded and uploaded without temp files"""
+        test_audio = (np.arange(1600, dtype=np.int16) % 500).reshape(-1, 1)
+        wav_bytes = dispatcher.encode_wav(test_audio)
+
+        with wave.open(io.BytesIO(wav_bytes), 'rb') as wf:
+            assert wf.getframerate() == dispatcher.sample_rate
+            assert wf.getnchannels() == dispatcher.channels
+            frames = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+        assert np.array_equal(frames, test_audio.ravel())
+
+        with patch.object(dispatcher, 'handle_input'):
+            dispatcher.speech_frames.append(test_audio)
+            dispatcher.process_recorded_speech()
+        assert os.listdir(dispatcher.temp_dir) == []
+        upload = dispatcher.client.audio.transcriptions.create.call_args.kwargs['file']
+        assert upload[1] == wav_bytes
+
+    def test_persist_audio_for_audit(self, dispatcher, tmp_path):
+        """Test audit recordings are written when persistence is enabled"""
+        dispatcher.persist_audio = True
+        dispatcher.audio_archive_dir = str(tmp_path)
+        with patch.object(dispatcher, 'handle_input'):
+            dispatcher.speech_frames.append(np.ones(1600, dtype=np.int16))
+            dispatcher.process_recorded_speech()
+
+        dispatcher.cleanup()
+        assert len(os.listdir(tmp_path)) == 1
+
+    def test_utterance_is_enqueued_not_processed_inline(self, dispatcher):
+        """Test finished utterances go to the worker pool with their own copy"""
+        dispatcher.pipeline = Mock()
+        dispatcher.speech_frames.append(np.ones(1600, dtype=np.int16))
+
+        with patch.object(dispatcher, 'process_recorded_speech') as mock_process:
+            dispatcher.enqueue_utterance()
+            mock_process.assert_not_called()
+
+            call_id, handler, audio = dispatcher.pipeline.submit.call_args.args
+            assert handler is mock_process
+        assert not np.shares_memory(audio, dispatcher.speech_frames.buffer)
+        assert len(audio) == 1600
+
+    def test_replayed_call_is_segmented(self, dispatcher):
+        """Test a recorded call drives the same callback and segmentation as the mic"""
+        rng = np.random.default_rng(0)
+        t = np.arange(16000) / 16000
+        speech = (3000 * np.sin(2 * np.pi * 440 * t)).astype(np.int16)
+        audio = np.concatenate([rng.normal(0, 100, 16000), speech, rng.normal(0, 100, 8000)]).astype(np.int16)
+        dispatcher.pipeline = Mock()
+
+        dispatcher.record_and_process(ArraySource(audio, speed=None))
+
+        assert dispatcher.pipeline.submit.call_count == 1
+        utterance = dispatcher.pipeline.submit.call_args.args[2]
+        # Speech plus pre-roll plus the trailing silence window
+        assert 1.3 * 16000 < len(utterance) < 3.0 * 16000
+
+    def test_pooled_thread_and_shared_client(self):
+        """Test a dispatcher built from a shared client and thread pool"""
+        client = MagicMock()
+        threads = Mock()
+        dispatcher = EmergencyDispatcher(client=client, threads=threads)
+
+        assert dispatcher.client is client
+        assert dispatcher.thread is threads.checkout.return_value
+        client.beta.threads.create.assert_not_called()
+
+        dispatcher.cleanup()
+        dispatcher.cleanup()
+        threads.release.assert_called_once_with(threads.checkout.return_value)
+
+    def test_sentence_splitter(self):
+        """Test streamed text is released one sentence at a time"""
+        splitter = SentenceSplitter()
+        assert splitter.feed("Stay calm. Is he") == ["Stay calm."]
+        assert splitter.feed(" breathing? Ok") == ["Is he breathing?"]
+        assert splitter.flush() == "Ok"
+        assert splitter.flush() == ""
+
+    def test_streaming_response_speaks_each_sentence(self, dispatcher):
+        """Test streamed tokens are spoken sentence by sentence"""
+        stream = dispatcher.client.beta.threads.runs.stream.return_value.__enter__.return_value
+        stream.text_deltas = ["Stay ", "calm. Help is", " on the way."]
+
+        with patch.object(dispatcher.speaker, 'open') as mock_open:
+            dispatcher.handle_input("My husband collapsed")
+
+        speech = mock_open.return_value
+        assert [c.args[0] for c in speech.say.call_args_list] == ["Stay calm.", "Help is on the way."]
+        speech.close.assert_called_once()
+        dispatcher.client.beta.threads.runs.retrieve.assert_not_called()
+
+    def test_polling_fallback_backs_off(self, dispatcher):
+        """Test polling is used when streaming fails and its interval grows"""
+        runs = dispatcher.client.beta.threads.runs
+        runs.stream.side_effect = RuntimeError("streaming unavailable")
+        runs.retrieve.side_effect = [Mock(status=s) for s in ("queued", "in_progress", "in_progress", "completed")]
+        reply = Mock(role="assistant", content=[Mock()])
+        reply.content[0].text.value = "Is the person breathing?"
+        dispatcher.client.beta.threads.messages.list.return_value = Mock(data=[reply])
+
+        with patch.object(dispatcher, 'text_to_speech') as mock_tts, \
+             patch('Main.time.sleep') as mock_sleep:
+            dispatcher.handle_input("Someone fainted")
+
+        mock_tts.assert_called_once_with("Is the person breathing?")
+        intervals = [c.args[0] for c in mock_sleep.call_args_list]
+        assert intervals == sorted(intervals) and intervals[0] < intervals[-1]
+        assert intervals[-1] <= dispatcher.poll_interval_max
+
+    @staticmethod
+    def breaking_stream(dispatcher, deltas):
+        """A stream whose run was created, that fails after the given deltas"""
+        stream = dispatcher.client.beta.threads.runs.stream.return_value.__enter__.return_value
+        stream.current_run = Mock(id="run-1")
+        def text_deltas():
+            yield from deltas
+            raise ConnectionError("stream dropped")
+        stream.text_deltas = text_deltas()
+        return dispatcher.client.beta.threads.runs
+
+    def test_broken_stream_after_speech_cancels_its_run(self, dispatcher):
+        """Once part of the reply was spoken, the run is cancelled and no new run starts"""
+        runs = self.breaking_stream(dispatcher, ["Stay calm. ", "Help"])
+        runs.cancel.return_value = Mock(status="cancelled")
+
+        with patch.object(dispatcher.speaker, 'open') as mock_open, patch('Main.get_geocoder'):
+            dispatcher.handle_input("My husband collapsed")
+        dispatcher.run_cancellation.join(1)
+
+        assert [c.args[0] for c in mock_open.return_value.say.call_args_list] == ["Stay calm."]
+        runs.create.assert_not_called()
+        runs.cancel.assert_called_once_with(run_id="run-1", thread_id=dispatcher.thread.id, timeout=ANY)
+
+    def test_broken_stream_before_first_token_waits_for_its_run(self, dispatcher):
+        """A stream that fails after creating its run is answered by polling that run"""
+        runs = self.breaking_stream(dispatcher, [])
+        runs.retrieve.return_value = Mock(status="completed")
+        reply = Mock(role="assistant", id="msg-reply", content=[Mock()])
+        reply.content[0].text.value = "Is he breathing?"
+        dispatcher.client.beta.threads.messages.list.return_value = Mock(data=[reply])
+
+        with patch.object(dispatcher, 'text_to_speech') as mock_tts, patch('Main.get_geocoder'):
+            dispatcher.handle_input("My husband collapsed")
+
+        mock_tts.assert_called_once_with("Is he breathing?")
+        runs.create.assert_not_called()
+        runs.retrieve.assert_called_with(thread_id=dispatcher.thread.id, run_id="run-1", timeout=ANY)
+
+    def test_polling_lists_only_new_messages(self, dispatcher):
+        """The reply is fetched with the caller's message id as the cursor"""
+        runs = dispatcher.client.beta.threads.runs
+        runs.stream.side_effect = RuntimeError("streaming unavailable")
+        runs.retrieve.return_value = Mock(status="completed")
+        dispatcher.client.beta.threads.messages.create.return_value = Mock(id="msg-caller")
+        reply = Mock(role="assistant", id="msg-reply", content=[Mock()])
+        reply.content[0].text.value = "Is the person breathing?"
+        dispatcher.client.beta.threads.messages.list.return_value = Mock(data=[reply])
+
+        with patch.object(dispatcher, 'text_to_speech'):
+            dispatcher.handle_input("Someone fainted")
+
+        dispatcher.client.beta.threads.messages.list.assert_called_once_with(
+            thread_id=dispatcher.thread.id, order="asc", after="msg-caller", timeout=ANY)
+        assert dispatcher.context.last_message_id == "msg-reply"
+
+    def test_long_call_runs_on_recent_turns_and_summary(self, dispatcher):
+        """Past the size threshold the run sees the last messages plus a summary"""
+        stream = dispatcher.client.beta.threads.runs.stream.return_value.__enter__.return_value
+        stream.text_deltas = ["Stay on the line."]
+        dispatcher.context = ThreadContext(keep_messages=4, max_tokens=50)
+        dispatcher.events = Mock()
+
+        with patch.object(dispatcher.speaker, 'open'), patch('Main.get_geocoder'):
+            dispatcher.handle_input("There's a fire at 12 Main Street")
+            assert 'truncation_strategy' not in dispatcher.client.beta.threads.runs.stream.call_args.kwargs
+            for _ in range(3):
+                dispatcher.handle_input("The smoke is getting thicker and I can hear people upstairs")
+
+        options = dispatcher.client.beta.threads.runs.stream.call_args.kwargs
+        assert options['truncation_strategy'] == {'type': 'last_messages', 'last_messages': 4}
+        assert "12 Main Street" in options['additional_instructions']
+
+    def test_barge_in_is_off_by_default(self, dispatcher):
+        """Without echo cancellation the reply's own audio must not interrupt it"""
+        dispatcher.responding = True
+        with patch.object(dispatcher.speaker, 'interrupt') as mock_interrupt:
+            dispatcher.interrupt()
+        mock_interrupt.assert_not_called()
+        assert not dispatcher.barge_in.is_set()
+
+    def test_barge_in_cancels_streamed_reply(self, dispatcher):
+        """Caller speech mid-reply stops playback, cancels the run and marks the reply"""
+        stream = dispatcher.client.beta.threads.runs.stream.return_value.__enter__.return_value
+        stream.current_run.id = "run-1"
+        dispatcher.client.beta.threads.runs.cancel.return_value = Mock(status="cancelled")
+        dispatcher.barge_in_enabled = True
+
+        def deltas():
+            yield "Stay calm. "
+            dispatcher.interrupt()
+            yield "Help is on the way."
+        stream.text_deltas = deltas()
+        dispatcher.events = Mock()
+
+        with patch.object(dispatcher.speaker, 'open') as mock_open, \
+             patch.object(dispatcher.speaker, 'interrupt') as mock_interrupt, \
+             patch.object(dispatcher, 'text_to_speech') as mock_tts:
+            dispatcher.handle_input("My husband collapsed")
+            dispatcher.run_cancellation.join(1)
+
+        mock_interrupt.assert_called_once()
+        assert [c.args[0] for c in mock_open.return_value.say.call_args_list] == ["Stay calm."]
+        dispatcher.client.beta.threads.runs.cancel.assert_called_once_with(
+            run_id="run-1", thread_id=dispatcher.thread.id, timeout=ANY)
+        mock_tts.assert_not_called()
+        final = dispatcher.events.publish_call.call_args_list[-1][0][2]
+        assert final['interrupted'] and final['message'] == "Stay calm."
+        assert not dispatcher.responding
+
+    def test_sustained_speech_while_responding_interrupts(self, dispatcher):
+        """The capture callback triggers barge-in only while a reply is in flight"""
+        t = np.arange(8000) / 16000
+        speech = (3000 * np.sin(2 * np.pi * 440 * t)).astype(np.int16)
+        dispatcher.pipeline = Mock()
+
+        with patch.object(dispatcher, 'interrupt') as mock_interrupt:
+            dispatcher.record_and_process(ArraySource(speech, speed=None))
+            mock_interrupt.assert_not_called()
+
+            dispatcher.responding = True
+            dispatcher.record_and_process(ArraySource(speech, speed=None))
+            assert mock_interrupt.called
+
+    def test_speculative_pieces_are_transcribed_during_pauses(self, dispatcher):
+        """Speech is transcribed at each pause, so little is left when the turn ends"""
+        t = np.arange(16000) / 16000
+        tone = (3000 * np.sin(2 * np.pi * 440 * t)).astype(np.int16)
+        quiet = np.zeros(int(0.4 * 16000), dtype=np.int16)
+        audio = np.concatenate([tone, tone, quiet, tone, np.zeros(2 * 16000, dtype=np.int16)])
+        dispatcher.vad = create_vad("amplitude")  # A steady tone would be adapted away
+        dispatcher.pipeline = Mock()
+        dispatcher.speculative_transcription = True
+        dispatcher.speculator.transcribe = Mock(side_effect=["fire at 12 main street", "second floor"])
+        dispatcher.events = Mock()
+
+        with patch.object(dispatcher, 'update_incident') as mock_update, \
+             patch.object(dispatcher, 'transcribe') as mock_transcribe, \
+             patch.object(dispatcher, 'handle_input') as mock_handle:
+            dispatcher.record_and_process(ArraySource(audio, speed=None))
+
+            handler, utterance = dispatcher.pipeline.submit.call_args.args[1:]
+            assert handler == dispatcher.process_speculative_speech
+            # One piece at the short pause, one early in the end-of-turn silence
+            assert len(utterance.pieces) == 2
+            assert not utterance.tail_has_speech
+
+            dispatcher.process_speculative_speech(utterance)
+
+        assert [c.args[0] for c in mock_update.call_args_list] == ["fire at 12 main street", "second floor"]
+        mock_transcribe.assert_not_called()
+        mock_handle.assert_called_once_with("fire at 12 main street second floor",
+                                            message_id=utterance.utterance_id, new_text="")
+
+    def test_speculative_tail_and_partial_extraction(self, dispatcher):
+        """Only the unsent tail is transcribed at the end; pieces are extracted as they finish"""
+        dispatcher.events = Mock()
+        executor = ThreadPoolExecutor(max_workers=1)
+        speculator = SpeculativeTranscriber(Mock(return_value="fire at 12 main street"), min_piece=0.5,
+                                            executor=executor, on_piece=dispatcher.publish_pieces)
+        audio = np.ones(16000 * 3, dtype=np.int16)
+        speculator.start()
+        speculator.note_speech()
+        with patch.object(dispatcher, 'update_incident') as mock_update:
+            speculator.commit(audio[:16000])
+            executor.shutdown(wait=True)  # Also waits for the done callback
+            speculator.note_speech()
+            utterance = speculator.finish(audio)
+            mock_update.assert_called_once_with("fire at 12 main street", 'caller')
+            assert len(utterance.tail) == 32000 and utterance.tail_has_speech
+
+            with patch.object(dispatcher, 'transcribe', return_value="second floor") as mock_transcribe, \
+                 patch.object(dispatcher, 'handle_input') as mock_handle:
+                dispatcher.process_speculative_speech(utterance)
+
+        assert len(mock_transcribe.call_args.args[0]) == 32000
+        mock_handle.assert_called_once_with("fire at 12 main street second floor",
+                                            message_id=utterance.utterance_id, new_text="second floor")
+        partial = dispatcher.events.publish_call.call_args_list[0][0][2]
+        assert partial['partial'] and partial['message_id'] == utterance.utterance_id
+
+    def test_address_split_across_pieces_is_extracted(self, dispatcher):
+        """An address cut by a pause is found in the joined transcript, without counting the rest twice"""
+        dispatcher.events = Mock()
+        executor = ThreadPoolExecutor(max_workers=1)
+        speculator = SpeculativeTranscriber(Mock(side_effect=["There is a fire at", "123 Main Street"]),
+                                            min_piece=0.5, executor=executor, on_piece=dispatcher.publish_pieces)
+        audio = np.ones(16000 * 3, dtype=np.int16)
+        speculator.start()
+        for end in (16000, 32000):
+            speculator.note_speech()
+            speculator.commit(audio[:end])
+        executor.shutdown(wait=True)
+        speculator.note_speech()
+        utterance = speculator.finish(audio)
+
+        with patch.object(dispatcher, 'transcribe', return_value="please hurry"), \
+             patch.object(dispatcher, 'handle_input'), patch('Main.get_geocoder'):
+            dispatcher.process_speculative_speech(utterance)
+
+        assert dispatcher.incident.value('location') == "123 Main Street"
+        assert dispatcher.current_address == "123 Main Street"
+        assert dispatcher.incident.current['type'].confidence == pytest.approx(0.6)
+
+    def test_streaming_backend_turns_off_speculation(self, dispatcher):
+        """With a streaming recognizer each utterance is transcribed once, by the stream"""
+        t = np.arange(16000) / 16000
+        tone = (3000 * np.sin(2 * np.pi * 440 * t)).astype(np.int16)
+        audio = np.concatenate([tone, np.zeros(int(0.4 * 16000), dtype=np.int16), tone,
+                                np.zeros(2 * 16000, dtype=np.int16)])
+        dispatcher.vad = create_vad("amplitude")
+        dispatcher.pipeline = Mock()
+        dispatcher.events = Mock()
+        dispatcher.transcriber = WordBackend()
+        dispatcher.speculative_transcription = True
+
+        with patch('Transcription.transcription_pool', ImmediateExecutor()), \
+             patch.object(dispatcher.speculator, 'commit') as mock_commit:
+            dispatcher.record_and_process(ArraySource(audio, speed=None))
+
+        mock_commit.assert_not_called()
+        assert dispatcher.pipeline.submit.call_args.args[1] == dispatcher.process_streamed_speech
+
+    def test_streaming_backend_gets_audio_while_caller_talks(self, dispatcher):
+        """A streaming backend is fed during the utterance and finishes it at the end of the turn"""
+        t = np.arange(16000 * 3) / 16000
+        audio = np.concatenate([(3000 * np.sin(2 * np.pi * 440 * t)).astype(np.int16),
+                                np.zeros(2 * 16000, dtype=np.int16)])
+        dispatcher.vad = create_vad("amplitude")
+        dispatcher.pipeline = Mock()
+        dispatcher.events = Mock()
+        dispatcher.transcriber = WordBackend()
+
+        with patch('Transcription.transcription_pool', ImmediateExecutor()), \
+             patch.object(dispatcher, 'handle_input') as mock_handle:
+            dispatcher.record_and_process(ArraySource(audio, speed=None))
+            handler, stream, audio_data = dispatcher.pipeline.submit.call_args.args[1:]
+            assert handler == dispatcher.process_streamed_speech
+            assert stream.passes >= 2 and stream.confirmed
+            dispatcher.process_streamed_speech(stream, audio_data)
+
+        transcript = mock_handle.call_args.args[0]
+        assert transcript.startswith(" ".join(stream.confirmed[:2]))
+        assert mock_handle.call_args.kwargs['message_id'] == stream.utterance_id
+        partial = dispatcher.events.publish_call.call_args_list[0][0][2]
+        assert partial['partial'] and partial['message_id'] == stream.utterance_id
+
+    def test_failed_stream_transcribes_whole_utterance(self, dispatcher):
+        """If the stream cannot finish, the kept audio goes through the backend in one piece"""
+        stream = Mock(utterance_id="caller-1", passes=3)
+        stream.finish.side_effect = TimeoutError()
+        dispatcher.transcriber = Mock(transcribe=Mock(return_value="help"))
+        audio = np.ones(8000, dtype=np.int16)
+        with patch.object(dispatcher, 'handle_input') as mock_handle:
+            dispatcher.process_streamed_speech(stream, audio)
+        assert dispatcher.transcriber.transcribe.call_args.args[0] is audio
+        mock_handle.assert_called_once_with("help", message_id="caller-1")
+
+    def test_fast_path_speaks_protocol_before_the_run(self, dispatcher):
+        """A clear emergency gets its cached instruction at once; the run is told not to repeat it"""
+        stream = dispatcher.client.beta.threads.runs.stream.return_value.__enter__.return_value
+        stream.text_deltas = ["Is he on his back?"]
+        dispatcher.events = Mock()
+        with patch.object(dispatcher, 'update_incident'), \
+             patch.object(dispatcher.speaker, 'start') as mock_start, \
+             patch.object(dispatcher.speaker, 'open'):
+            dispatcher.handle_input("My husband collapsed and he isn't breathing")
+            dispatcher.handle_input("He still isn't breathing")
+
+        mock_start.assert_called_once()
+        assert mock_start.call_args.args[0].startswith("Help is on the way. If they are not breathing")
+        options = dispatcher.client.beta.threads.runs.stream.call_args_list[0].kwargs
+        assert mock_start.call_args.args[0] in options['additional_instructions']
+        assert 'additional_instructions' not in dispatcher.client.beta.threads.runs.stream.call_args.kwargs
+        published = [c[0][2] for c in dispatcher.events.publish_call.call_args_list]
+        assert published[1]['role'] == 'dispatcher' and published[1]['message'] == mock_start.call_args.args[0]
+
+    def test_stuck_run_is_cancelled_at_the_turn_deadline(self, dispatcher):
+        """A run that never finishes ends the turn at its budget, not after the full loop"""
+        runs = dispatcher.client.beta.threads.runs
+        runs.stream.side_effect = RuntimeError("streaming unavailable")
+        runs.create.return_value = Mock(id="run-stuck")
+        runs.retrieve.return_value = Mock(status="in_progress")
+        runs.cancel.return_value = Mock(status="cancelled")
+        dispatcher.turn_budget = 0.3
+        dispatcher.poll_interval_max = 0.05
+
+        started = time.perf_counter()
+        with patch.object(dispatcher, 'text_to_speech') as mock_tts:
+            dispatcher.handle_input("Someone fainted")
+        dispatcher.run_cancellation.join(1)
+
+        assert time.perf_counter() - started < 1.5
+        mock_tts.assert_called_once_with(Main.TECHNICAL_DIFFICULTIES)
+        assert runs.cancel.call_args.kwargs['run_id'] == "run-stuck"
+
+    def test_failed_transcription_asks_caller_to_repeat(self, dispatcher):
+        """A transcription that fails for good gets a prompt to say it again"""
+        dispatcher.transcriber = Mock(transcribe=Mock(side_effect=RuntimeError("upstream down")))
+        with patch.object(dispatcher, 'text_to_speech') as mock_tts, \
+             patch.object(dispatcher, 'handle_input') as mock_handle:
+            dispatcher.process_recorded_speech(np.ones(8000, dtype=np.int16))
+        mock_tts.assert_called_once_with(Main.SAY_AGAIN)
+        mock_handle.assert_not_called()
+
+    def test_adaptive_silence_ends_quick_turns_sooner(self, dispatcher):
+        """After short pauses the end-of-turn window shrinks below silence_duration"""
+        for _ in range(5):
+            dispatcher.endpointer.observe_pause(0.3)
+        assert dispatcher.endpointer.window() == pytest.approx(0.55)
+
+        t = np.arange(16000) / 16000
+        tone = (3000 * np.sin(2 * np.pi * 440 * t)).astype(np.int16)
+        quiet = np.zeros(int(0.8 * 16000), dtype=np.int16)
+        dispatcher.vad = create_vad("amplitude")
+        dispatcher.pipeline = Mock()
+        dispatcher.silence_window = dispatcher.endpointer.window()
+        dispatcher.record_and_process(ArraySource(np.concatenate([tone, quiet, tone, quiet]), speed=None))
+        # A fixed 1.5 s window would have kept both halves in one utterance
+        assert dispatcher.pipeline.submit.call_count == 2
+
+class TestSpeechRingBuffer:
+    def test_preroll_is_kept_in_order(self):
+        """Audio from before speech starts is prepended oldest first"""
+        buffer = SpeechRingBuffer(capacity=100, preroll=5)
+        for value in range(1, 9):
+            buffer.push_preroll(np.array([value], dtype=np.int16))
+
+        buffer.start()
+        buffer.append(np.array([100, 101], dtype=np.int16))
+        assert buffer.view().ravel().tolist() == [4, 5, 6, 7, 8, 100, 101]
+
+    def test_capacity_is_a_hard_cap(self):
+        """Appends past capacity are cut and reported"""
+        buffer = SpeechRingBuffer(capacity=10)
+        assert buffer.append(np.ones(8, dtype=np.int16))
+        assert not buffer.append(np.ones(8, dtype=np.int16))
+        assert len(buffer) == 10 and buffer.full
+        assert buffer.nbytes == 10 * 2
+
+    def test_view_is_zero_copy(self):
+        """Extraction returns a view into the preallocated storage"""
+        buffer = SpeechRingBuffer(capacity=50, preroll=10)
+        buffer.append(np.arange(20, dtype=np.int16))
+        view = buffer.view()
+        assert np.shares_memory(view, buffer.buffer)
+        buffer.clear()
+        assert len(buffer) == 0
+
+class TestVoiceActivity:
+    sample_rate = 16000
+    frame = 800
+
+    def tone(self, seconds, amplitude=3000, freq=440):
+        t = np.arange(int(seconds * self.sample_rate)) / self.sample_rate
+        return (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.int16)
+
+    def noise(self, seconds, level, seed=0):
+        rng = np.random.default_rng(seed)
+        return rng.normal(0, level, int(seconds * self.sample_rate)).astype(np.int16)
+
+    @pytest.mark.parametrize("kind", ["amplitude", "energy", "zcr", "flux"])
+    def test_detects_speech_between_silence(self, kind):
+        """Every detector finds a tone burst in quiet background noise"""
+        audio = np.concatenate([self.noise(1, 100), self.tone(1) + self.noise(1, 100, 1), self.noise(1, 100, 2)])
+        decisions = create_vad(kind).detect_array(audio, self.frame)
+
+        assert not decisions[:20].any()
+        assert decisions[21:39].all()
+        assert not decisions[-10:].any()
+
+    def test_batch_matches_streaming(self):
+        """Scoring a whole array gives the same answer as chunk by chunk"""
+        audio = np.concatenate([self.noise(1, 200), self.tone(0.5), self.noise(1, 200, 1)])
+        batch = create_vad("energy").detect_array(audio, self.frame)
+        streaming_vad = create_vad("energy")
+        streaming = [streaming_vad.is_speech(chunk) for chunk in frame_signal(audio, self.frame)]
+        assert batch.tolist() == streaming
+
+    def test_hangover_bridges_short_gaps(self):
+        """Speech stays active for a few frames after the level drops"""
+        vad = create_vad("energy", hangover_frames=3)
+        audio = np.concatenate([self.noise(0.5, 100), self.tone(0.5), self.noise(0.5, 100, 1)])
+        decisions = vad.detect_array(audio, self.frame)
+        assert decisions[10:23].all() and not decisions[24:].any()
+
+    def test_adaptive_floor_ignores_steady_noise(self):
+        """Loud constant noise stops triggering once the floor adapts"""
+        decisions = create_vad("energy").detect_array(self.noise(10, 1500), self.frame)
+        legacy = create_vad("amplitude").detect_array(self.noise(10, 1500), self.frame)
+        assert legacy.all()
+        assert not decisions[5:].any()
+
+    @pytest.mark.parametrize("kind", ["amplitude", "energy", "zcr"])
+    def test_noise_below_threshold_never_triggers(self, kind):
+        """Speech-like (Laplacian) noise just under the threshold is not speech for any level detector"""
+        noise = np.random.default_rng(0).laplace(0, 548, 10 * self.sample_rate).astype(np.int16)
+        assert np.abs(noise).mean() < 700
+        assert not create_vad(kind).detect_array(noise, self.frame).any()
+
+    def test_zero_crossing_rejects_hiss(self):
+        """Broadband hiss has a high zero-crossing rate and is not speech"""
+        assert not create_vad("zcr").detect_array(self.noise(2, 1500), self.frame).any()
+
+    def test_spectral_flux_rejects_hum(self):
+        """Mains hum below the speech band never triggers spectral flux"""
+        hum = self.tone(3, amplitude=2000, freq=60) + self.noise(3, 100)
+        assert not create_vad("flux").detect_array(hum, self.frame).any()
+
+    def test_unknown_detector(self):
+        with pytest.raises(ValueError):
+            create_vad("psychic")
+
+    def test_endpointer_learns_pauses(self):
+        endpointer = AdaptiveEndpointer(min_silence=0.5, max_silence=1.5, margin=0.25)
+        assert endpointer.window() == 1.5
+        endpointer.observe_pause(0.05)  # Between words: ignored
+        assert endpointer.window() == 1.5
+        for pause in (0.4, 0.6, 0.5):
+            endpointer.observe_pause(pause)
+        assert 0.8 < endpointer.window() < 0.9
+        for _ in range(20):
+            endpointer.observe_pause(3.0)
+        assert endpointer.window() == 1.5
+
+    def test_endpointer_lengthens_after_early_cut(self):
+        endpointer = AdaptiveEndpointer(min_silence=0.5, max_silence=1.5, margin=0.25)
+        endpointer.observe_pause(0.3)
+        endpointer.observe_resumed(0.55, 2.0)  # A new turn, not a cut
+        assert endpointer.window() == pytest.approx(0.55)
+        endpointer.observe_resumed(0.55, 0.2)  # The caller was still talking
+        assert endpointer.window() > 0.9
+
+class TestAudioSource:
+    def collect(self, source, blocksize=800):
+        blocks = []
+        source.run(lambda indata, frames, time_info, status: blocks.append(indata.copy()), blocksize, lambda: True)
+        return blocks
+
+    def test_array_source_pads_with_silence(self):
+        """Blocks cover the audio followed by the silence padding"""
+        blocks = self.collect(ArraySource(np.ones(8000, dtype=np.int16), speed=None, pad_silence=0.5))
+        assert len(blocks) == 20
+        assert all(b.shape == (800, 1) for b in blocks)
+        assert blocks[9].all() and not blocks[10].any()
+
+    def test_array_source_paces_in_real_time(self):
+        """speed=10 replays one second of audio in about a tenth of a second"""
+        source = ArraySource(np.zeros(16000, dtype=np.int16), speed=10, pad_silence=0)
+        started = time.perf_counter()
+        self.collect(source)
+        assert time.perf_counter() - started >= 0.09
+
+    def test_wav_file_source(self, tmp_path):
+        """WAV files are read and checked against the expected format"""
+        path = str(tmp_path / "call.wav")
+        with wave.open(path, 'wb') as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(16000)
+            wf.writeframes(np.arange(1600, dtype=np.int16).tobytes())
+
+        blocks = self.collect(WavFileSource(path, speed=None, pad_silence=0))
+        assert np.concatenate(blocks).ravel().tolist() == list(range(1600))
+        with pytest.raises(ValueError):
+            WavFileSource(path, sample_rate=8000)
+
+    def test_pcm_stream_source(self):
+        """Raw PCM streams are cut into whole blocks"""
+        stream = io.BytesIO(np.arange(2000, dtype=np.int16).tobytes())
+        blocks = self.collect(PcmStreamSource(stream))
+        assert len(blocks) == 2
+        assert blocks[1][0, 0] == 800
+
+class TestTextToSpeech:
+    class RecordingSink:
+        def __init__(self):
+            self.samples = []
+            self.first_write = None
+
+        def write(self, samples):
+            if self.first_write is None:
+                self.first_write = time.perf_counter()
+            self.samples.extend(samples.tolist())
+
+        def close(self):
+            pass
+
+    class FakeSpeechClient:
+        """Streams each sentence as PCM whose samples are the sentence's index"""
+
+        def __init__(self, delays):
+            self.delays = delays
+            self.started = {}
+            self.audio = Mock()
+            self.audio.speech.with_streaming_response.create.side_effect = self.create
+
+        def create(self, model, voice, input, response_format, timeout=None):
+            assert response_format == "pcm"
+            index = int(input.split()[1].rstrip("."))
+            self.started[index] = time.perf_counter()
+            data = np.full(500, index, dtype='<i2').tobytes()
+            delay = self.delays[index]
+
+            def iter_bytes(chunk_size):
+                for start in range(0, len(data), 333):  # odd sizes split samples
+                    time.sleep(delay / 4)
+                    yield data[start:start + 333]
+
+            response = MagicMock()
+            response.__enter__.return_value.iter_bytes = iter_bytes
+            return response
+
+    def test_split_sentences(self):
+        assert split_sentences("Stay calm. Help is coming! Ok") == ["Stay calm.", "Help is coming!", "Ok"]
+
+    def test_sentences_play_in_order_but_synthesize_concurrently(self):
+        """Later sentences are fetched while earlier ones play, output stays ordered"""
+        client = self.FakeSpeechClient(delays={1: 0.2, 2: 0.02, 3: 0.02})
+        sink = self.RecordingSink()
+        speaker = StreamingSpeaker(client, sink)
+
+        started = time.perf_counter()
+        speaker.speak("Sentence 1. Sentence 2. Sentence 3.")
+        elapsed = time.perf_counter() - started
+
+        assert sink.samples == [1] * 500 + [2] * 500 + [3] * 500
+        assert max(client.started.values()) - min(client.started.values()) < 0.1
+        assert elapsed < 0.35
+
+    def test_audio_starts_with_first_chunk(self):
+        """Playback begins before the first sentence has fully downloaded"""
+        client = self.FakeSpeechClient(delays={1: 0.4})
+        sink = self.RecordingSink()
+        started = time.perf_counter()
+        StreamingSpeaker(client, sink).speak("Sentence 1.")
+        assert sink.first_write - started < 0.25
+
+    def test_cached_sentences_skip_synthesis(self):
+        """Repeated sentences are served from the cache without an API call"""
+        client = self.FakeSpeechClient(delays={1: 0.01, 2: 0.01})
+        sink = self.RecordingSink()
+        speaker = StreamingSpeaker(client, sink, cache=SpeechCache())
+
+        speaker.prewarm(["Sentence 1."])
+        speaker.speak("Sentence 1. Sentence 2.")
+        speaker.speak("Sentence 2.")
+
+        assert client.audio.speech.with_streaming_response.create.call_count == 2
+        assert sink.samples == [1] * 500 + [2] * 500 + [2] * 500
+
+    def test_started_speech_plays_before_later_streams(self):
+        """start() returns at once, and what is spoken next waits for it"""
+        client = self.FakeSpeechClient(delays={1: 0.2, 2: 0.01})
+        sink = self.RecordingSink()
+        speaker = StreamingSpeaker(client, sink)
+        started = time.perf_counter()
+        speaker.start("Sentence 1.")
+        assert time.perf_counter() - started < 0.1
+        speaker.speak("Sentence 2.")
+        assert sink.samples == [1] * 500 + [2] * 500
+
+    def test_interrupt_stops_playback(self):
+        """Barge-in silences the stream at once and later sentences are not played"""
+        client = self.FakeSpeechClient(delays={1: 0.2, 2: 0.2, 3: 0.2})
+        sink = self.RecordingSink()
+        speaker = StreamingSpeaker(client, sink)
+        stream = speaker.open()
+        for i in (1, 2, 3):
+            stream.say(f"Sentence {i}.")
+        time.sleep(0.08)
+
+        speaker.interrupt()
+        stream.say("Sentence 4.")
+        started = time.perf_counter()
+        stream.close()
+
+        assert time.perf_counter() - started < 0.15
+        assert 0 < len(sink.samples) < 500 and set(sink.samples) == {1}
+        # A stream opened after the interruption plays normally
+        speaker.speak("Sentence 2.")
+        assert sink.samples[-500:] == [2] * 500
+
+
+class TestSpeechCache:
+    def test_key_depends_on_text_model_and_voice(self):
+        key = SpeechCache.key("Help is on the way.", "tts-1", "shimmer")
+        assert key == SpeechCache.key(" Help is on the way. ", "tts-1", "shimmer")
+        assert key != SpeechCache.key("Help is on the way.", "tts-1", "alloy")
+        assert key != SpeechCache.key("Help is on the way.", "tts-1-hd", "shimmer")
+
+    def test_lru_evicts_least_recently_used(self):
+        cache = SpeechCache(max_bytes=10)
+        cache.put("a", b"aaaa")
+        cache.put("b", b"bbbb")
+        cache.get("a")
+        cache.put("c", b"cccc")
+
+        assert cache.get("b") is None
+        assert cache.get("a") == b"aaaa"
+        assert cache.stats()["bytes"] <= 10
+
+    def test_disk_store_survives_restart(self, tmp_path):
+        SpeechCache(str(tmp_path)).put("abcd", b"audio", persist=True)
+        cache = SpeechCache(str(tmp_path))
+
+        assert cache.get("abcd") == b"audio"
+        assert cache.get("abcd") == b"audio"
+        assert cache.stats()["disk_hits"] == 1 and cache.stats()["hits"] == 1
+
+    def test_only_prewarmed_speech_is_written_to_disk(self, tmp_path):
+        """Replies to callers stay in memory; fixed prompts are persisted"""
+        client = TestTextToSpeech.FakeSpeechClient(delays={1: 0.01, 2: 0.01})
+        speaker = StreamingSpeaker(client, TestTextToSpeech.RecordingSink(), cache=SpeechCache(str(tmp_path)))
+        speaker.prewarm(["Sentence 1."])
+        speaker.speak("Sentence 2.")
+
+        assert len(list(tmp_path.rglob("*.audio"))) == 1
+        restarted = SpeechCache(str(tmp_path))
+        assert restarted.get(restarted.key("Sentence 1.", "tts-1", "shimmer")) is not None
+        assert restarted.get(restarted.key("Sentence 2.", "tts-1", "shimmer")) is None
+
+class TestAssistantThreadPool:
+    def make_client(self):
+        client = Mock()
+        counter = iter(range(1000))
+        client.beta.threads.create.side_effect = lambda: Mock(id=f"thread_{next(counter)}")
+        return client
+
+    def wait_for_idle(self, pool, count):
+        for _ in range(100):
+            if pool.stats()["idle"] >= count:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_checkout_uses_precreated_threads(self):
+        """Threads are created ahead of time and handed out without waiting"""
+        client = self.make_client()
+        pool = AssistantThreadPool(lambda: client, size=2)
+        pool.start()
+        assert self.wait_for_idle(pool, 2)
+
+        first = pool.checkout()
+        second = pool.checkout()
+        assert first.id != second.id
+        assert pool.stats()["hits"] == 2
+        assert self.wait_for_idle(pool, 2)
+
+    def test_checkout_when_empty_creates_directly(self):
+        client = self.make_client()
+        pool = AssistantThreadPool(lambda: client, size=0)
+        assert pool.checkout().id == "thread_0"
+        assert pool.stats()["misses"] == 1
+
+    def test_released_threads_are_deleted_not_reused(self):
+        client = self.make_client()
+        pool = AssistantThreadPool(lambda: client, size=0)
+        thread = pool.checkout()
+        pool.release(thread)
+        for _ in range(100):
+            if client.beta.threads.delete.called:
+                break
+            time.sleep(0.01)
+        client.beta.threads.delete.assert_called_once_with(thread.id)
+
+class TestUtterancePipeline:
+    def test_every_allowed_call_gets_a_worker(self):
+        """A call speaking its reply never holds up another call's next utterance"""
+        assert len(Main.utterance_pipeline.workers) >= Main.MAX_CONCURRENT_CALLS
+
+    def test_per_call_order_is_preserved(self):
+        """Utterances of one call are handled in order even with many workers"""
+        pipeline = UtterancePipeline(workers=4, max_pending=100)
+        handled = {"a": [], "b": []}
+        done = threading.Event()
+
+        def handler(call_id, seq):
+            time.sleep(0.001 * (seq % 3))
+            handled[call_id].append(seq)
+            if len(handled["a"]) == 20 and len(handled["b"]) == 20:
+                done.set()
+
+        for seq in range(20):
+            pipeline.submit("a", handler, "a", seq)
+            pipeline.submit("b", handler, "b", seq)
+
+        assert done.wait(5)
+        assert handled["a"] == list(range(20))
+        assert handled["b"] == list(range(20))
+        pipeline.shutdown()
+
+    def test_backpressure_drops_when_full(self):
+        """submit never blocks and counts dropped utterances"""
+        pipeline = UtterancePipeline(workers=1, max_pending=2)
+        release = threading.Event()
+        pipeline.submit("a", release.wait)
+        time.sleep(0.05)  # let the worker pick up the blocking item
+
+        assert pipeline.submit("a", lambda: None)
+        assert pipeline.submit("a", lambda: None)
+        assert not pipeline.submit("a", lambda: None)
+
+        metrics = pipeline.metrics()
+        assert metrics["dropped"] == 1
+        assert metrics["queue_depth"] == 2
+        release.set()
+        pipeline.shutdown()
+
+    def test_wait_for_drains_one_call(self):
+        """wait_for returns once a call's queued utterances are handled"""
+        pipeline = UtterancePipeline(workers=2)
+        handled = []
+        for seq in range(3):
+            pipeline.submit("a", lambda seq=seq: (time.sleep(0.01), handled.append(seq)))
+
+        assert pipeline.wait_for("a", timeout=2)
+        assert handled == [0, 1, 2]
+        pipeline.shutdown()
+
+class TestSessionManager:
+    class FakeDispatcher:
+        def __init__(self, session_id):
+            self.session_id = session_id
+            self.stopped = threading.Event()
+
+        def run(self):
+            self.stopped.wait(5)
+
+        def cleanup(self):
+            self.stopped.set()
+
+    def test_sessions_are_isolated(self):
+        """Each session id gets its own dispatcher"""
+        manager = SessionManager(self.FakeDispatcher, max_sessions=4)
+        first = manager.start("sid-1")
+        second = manager.start("sid-2")
+
+        assert first is not second
+        assert manager.get("sid-1") is first
+        assert manager.active_count() == 2
+        manager.shutdown()
+
+    def test_admission_control(self):
+        """Calls beyond the limit are rejected until a slot frees up"""
+        manager = SessionManager(self.FakeDispatcher, max_sessions=2)
+        manager.start("sid-1")
+        manager.start("sid-2")
+
+        assert manager.start("sid-3") is None
+        assert manager.rejected == 1
+
+        manager.end("sid-1")
+        assert manager.start("sid-3") is not None
+        manager.shutdown()
+
+    def test_end_tears_down_session(self):
+        """Ending a call cleans up its dispatcher and frees the slot"""
+        manager = SessionManager(self.FakeDispatcher, max_sessions=2)
+        dispatcher = manager.start("sid-1")
+
+        assert manager.end("sid-1")
+        assert dispatcher.stopped.is_set()
+        assert manager.get("sid-1") is None
+        assert manager.active_count() == 0
+        assert not manager.end("sid-1")
+
+class TestIncidentExtraction:
+    @pytest.mark.parametrize("text,expected_type,expected_problem", [
+        ("There's a fire in the building!", "FIRE", "STRUCTURE FIRE"),
+        ("Someone is having a heart attack!", "MEDICAL", "HEART ATTACK"),
+        ("There's a break-in in progress!", "POLICE", "BREAK IN"),
+        ("My cat is stuck in a tree", None, None),
+    ])
+    def test_classification(self, text, expected_type, expected_problem):
+        """Emergency type and problem come from one pass over the text"""
+        record = extract_incident(text)
+        assert record['type'] == expected_type
+        assert record['problem'] == expected_problem
+
+    def test_word_boundaries(self):
+        """Keywords only match whole words"""
+        assert extract_incident("Please remain in the painting studio")['type'] is None
+        assert extract_incident("He is in a lot of pain")['type'] == "MEDICAL"
+
+    def test_longest_phrase_wins(self):
+        """'not breathing' is reported as status and still counts as breathing"""
+        record = extract_incident("My father is not breathing")
+        assert record['type'] == "MEDICAL"
+        assert record['problem'] == "BREATHING"
+        assert record['victim_status'] == "not breathing"
+        assert record['units'] == ['🚑 Ambulance', '🚁 Medical Helicopter']
+
+    def test_units_and_details(self):
+        """Escalation words add units; key details are collected"""
+        record = extract_incident("Heavy smoke, the fire is spreading quickly through the house")
+        assert record['type'] == "FIRE"
+        assert record['key_details'] == ['Heavy smoke', 'spreading quickly']
+        assert '🚒 Additional Fire Units' in record['units']
+
+        calm = extract_incident("There is a small fire in my kitchen")
+        assert calm['units'] == ['🚒 Fire Engine', '🚑 Ambulance (Standby)']
+
+    @pytest.mark.parametrize("text,expected", [
+        ("I'm at 123 Main Street", "123 Main Street"),
+        ("The location is 456 Oak Avenue, Springfield, IL", "456 Oak Avenue, Springfield, IL"),
+        ("Send help to 789 Pine Rd please", None),
+        ("We are near 12 Elm St. and it is getting worse", "12 Elm St"),
+        # Spoken numbers only count as a house number right before a street name
+        ("I am at one of the houses on Main Street", None),
+        ("wait a second, I am on First Avenue", None),
+        ("I'm at twelve fifth avenue", "12 5th avenue"),
+        ("12 Main Street, Apt 4", None),
+        ("I'm at 12 Main Street, Apt 4", "12 Main Street, Apt 4"),
+        ("We're at 12 Main Street apartment four, Springfield", "12 Main Street apartment 4, Springfield"),
+    ])
+    def test_address(self, text, expected):
+        """One address pattern covers every way a location is introduced"""
+        assert extract_address(text) == expected
+
+    def test_dispatcher_updates_incident(self):
+        """The dispatcher keeps the caller's address and publishes only the changes"""
+        events = Mock()
+        with patch('Main.OpenAI'):
+            dispatcher = EmergencyDispatcher("sid-1", events=events)
+        with patch('Main.get_geocoder') as mock_geocoder:
+            changes = dispatcher.update_incident("There's a fire at 123 Main Street", 'caller')
+            dispatcher.update_incident("Is everyone out?", 'dispatcher')
+
+        assert dispatcher.current_address == "123 Main Street"
+        mock_geocoder.return_value.prefetch.assert_called_once_with("123 Main Street")
+        assert changes['type']['value'] == "FIRE"
+        assert events.publish_call.call_count == 1
+        call_id, event, payload = events.publish_call.call_args[0]
+        assert (call_id, event) == ("sid-1", 'incident_diff')
+        assert set(payload['changes']) == {'type', 'location', 'units'}
+        dispatcher.cleanup()
+
+class TestIncidentState:
+    @pytest.fixture
+    def state(self):
+        clock = iter(range(100))
+        return IncidentState(call_id="call-1", clock=lambda: float(next(clock)))
+
+    def test_only_changed_fields_are_reported(self, state):
+        """A new utterance produces a diff of just the fields it touched"""
+        first = state.apply("There's a fire at 123 Main Street")
+        assert set(first) == {'type', 'location', 'units'}
+        assert first['type'] == {'value': 'FIRE', 'confidence': 0.6, 'first_seen': 0.0}
+
+        assert state.apply("Please hurry") == {}
+        second = state.apply("There are multiple victims")
+        assert set(second) == {'key_details'}
+        assert state.version == 2
+
+    def test_confirmation_raises_confidence(self, state):
+        """A repeated value keeps its first-seen time and only sends its confidence"""
+        state.apply("There's a fire at 123 Main Street")
+        changes = state.apply("A fire at 123 Main Street, help is on the way", 'dispatcher')
+
+        assert changes['type'] == {'confidence': 0.76}
+        assert changes['location'] == {'confidence': 0.76}
+        assert state.snapshot()['fields']['type']['first_seen'] == 0.0
+
+    def test_fields_are_merged_not_overwritten(self, state):
+        """A weaker later mention does not replace the type, but a corrected address does"""
+        state.apply("There's a fire at 123 Main Street")
+        state.apply("The fire is spreading, the smoke is everywhere")
+        state.apply("Someone was robbed here too")
+
+        changes = state.apply("Sorry, I'm at 125 Main Street")
+        assert changes['location']['value'] == "125 Main Street"
+        assert state.value('type') == "FIRE"
+        assert state.value('location') == "125 Main Street"
+
+    def test_snapshot(self, state):
+        """The snapshot holds every field for dashboards joining mid-call"""
+        state.apply("He is unconscious, there are multiple victims")
+        snapshot = state.snapshot()
+
+        assert snapshot['call_id'] == "call-1"
+        assert snapshot['fields']['victim_status']['value'] == "unconscious"
+        assert 'multiple victims' in snapshot['fields']['key_details']
+        assert snapshot['fields']['location'] is None
+
+class TestGeocoding:
+    class SlowBackend:
+        def __init__(self, results):
+            self.results = results
+            self.queries = []
+            self.release = threading.Event()
+
+        def lookup(self, query):
+            self.queries.append(query)
+            self.release.wait(2)
+            return self.results.get(query)
+
+    class FakeClock:
+        def __init__(self):
+            self.now = 0.0
+
+        def __call__(self):
+            return self.now
+
+        def sleep(self, seconds):
+            self.now += seconds
+
+    def test_normalize_address(self):
+        """Case, punctuation and spacing don't create separate cache entries"""
+        assert normalize_address("123  Main St.,New York , NY") == "123 main st, new york, ny"
+
+    def test_cache_persists(self):
+        """Lookups survive a restart and misses are remembered"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "geocode.sqlite3")
+            cache = GeocodeCache(path)
+            cache.put("123 main st", {'lat': 1.0, 'lon': 2.0, 'display_name': "123 Main St"})
+            cache.put("nowhere", None)
+            cache.close()
+
+            reopened = GeocodeCache(path)
+            assert reopened.get("123 main st") == (True, {'lat': 1.0, 'lon': 2.0, 'display_name': "123 Main St"})
+            assert reopened.get("nowhere") == (True, None)
+            assert reopened.get("elsewhere") == (False, None)
+            reopened.close()
+
+    def test_gazetteer_backend_and_region_fallback(self):
+        """Bare street addresses get the default region; unknown cities fall back to it"""
+        backend = GazetteerBackend({"123 Main Street, New York, NY": [40.7, -74.0]})
+        geocoder = Geocoder(backend, limiter=TokenBucket(rate=1000, capacity=10))
+
+        assert geocoder.geocode("123 Main Street")['lat'] == 40.7
+        assert geocoder.geocode("123 Main Street, Gotham")['lon'] == -74.0
+        assert geocoder.geocode("123 MAIN STREET")['lat'] == 40.7
+        assert geocoder.stats()['cache_hits'] == 1
+
+    def test_identical_lookups_are_coalesced(self):
+        """Concurrent requests for one address make a single backend call"""
+        backend = self.SlowBackend({"9 Elm St, New York, NY": {'lat': 1.0, 'lon': 2.0, 'display_name': "9 Elm St"}})
+        geocoder = Geocoder(backend, limiter=TokenBucket(rate=1000, capacity=10))
+        results = []
+        workers = [threading.Thread(target=lambda: results.append(geocoder.geocode("9 Elm St")))
+                   for _ in range(5)]
+        for worker in workers:
+            worker.start()
+        time.sleep(0.1)
+        backend.release.set()
+        for worker in workers:
+            worker.join()
+
+        assert backend.queries == ["9 Elm St, New York, NY"]
+        assert len(results) == 5 and all(r['lat'] == 1.0 for r in results)
+        assert geocoder.stats()['coalesced'] == 4
+
+    def test_prefetch_is_bounded(self):
+        """Background lookups share a fixed pool, and a full queue skips new ones"""
+        backend = self.SlowBackend({})
+        executor = ThreadPoolExecutor(max_workers=1)
+        geocoder = Geocoder(backend, limiter=TokenBucket(rate=1000, capacity=10), executor=executor, max_prefetch=2)
+        started = threading.active_count()
+
+        assert [geocoder.prefetch(f"{i} Elm St") for i in range(5)] == [True, True, False, False, False]
+        assert threading.active_count() <= started + 1
+        backend.release.set()
+        executor.shutdown(wait=True)
+        assert sorted(backend.queries) == ["0 Elm St, New York, NY", "1 Elm St, New York, NY"]
+        assert geocoder.stats()['prefetch_skipped'] == 3
+        assert geocoder.prefetching == 0
+
+    def test_gazetteer_is_not_rate_limited(self, tmp_path):
+        """Only the remote backend is held to Nominatim's one request per second"""
+        path = tmp_path / "gazetteer.json"
+        path.write_text(json.dumps({f"{i} Elm St, New York, NY": [40.7, -74.0] for i in range(5)}))
+        with patch.object(Main, '_geocoder', None), patch.object(Main, 'GAZETTEER_PATH', str(path)), \
+             patch.object(Main, 'GEOCODE_CACHE_PATH', ":memory:"):
+            geocoder = Main.get_geocoder()
+            started = time.perf_counter()
+            assert all(geocoder.geocode(f"{i} Elm St") for i in range(5))
+            assert time.perf_counter() - started < 0.5
+            assert isinstance(geocoder.limiter, Unlimited)
+        with patch.object(Main, '_geocoder', None), patch.object(Main, 'GAZETTEER_PATH', None), \
+             patch.object(Main, 'GEOCODE_CACHE_PATH', ":memory:"):
+            assert isinstance(Main.get_geocoder().limiter, TokenBucket)
+
+    def test_token_bucket(self):
+        """Bursts are capped and waiting earns new tokens at the configured rate"""
+        clock = self.FakeClock()
+        bucket = TokenBucket(rate=1.0, capacity=2, clock=clock, sleep=clock.sleep)
+
+        assert bucket.acquire() and bucket.acquire()
+        assert not bucket.acquire(timeout=0.5)
+        assert bucket.acquire()
+        assert clock.now == pytest.approx(1.0)
+
+class TestGazetteer:
+    @pytest.fixture
+    def streets(self):
+        return StreetIndex(["Main Street", "West End Avenue", "East 72nd Street", "Broadway", "Maine Road"])
+
+    @pytest.mark.parametrize("spoken,expected", [
+        ("one twenty three Main Street", "123 Main Street"),
+        ("twelve thirty four fifth avenue", "1234 5th avenue"),
+        ("three hundred and five West End", "305 West End"),
+        ("one oh five Broadway", "105 Broadway"),
+        ("twenty-first street", "21st street"),
+        ("oh no, there's no one here", "oh no, there's no 1 here"),
+    ])
+    def test_normalize_numbers(self, spoken, expected):
+        """Spoken house numbers and ordinals become digits"""
+        assert normalize_numbers(spoken) == expected
+
+    def test_normalize_street(self):
+        """Suffix, direction and ordinal spellings share one key"""
+        assert normalize_street("East Seventy Second Street") == normalize_street("E 72nd St.") == "e 72nd st"
+
+    def test_fuzzy_match(self, streets):
+        """Misheard street names resolve to the closest known street"""
+        assert streets.match("west and avenue")[0] == "West End Avenue"
+        assert streets.match("east seventy second st")[0] == "East 72nd Street"
+        assert streets.match("completely unrelated")[0] is None
+
+    def test_address_resolution(self, streets):
+        """Extraction snaps to known streets, even without a lead-in word"""
+        assert extract_address("I'm at one twenty three mane street") == "123 mane street"
+        assert extract_address("I'm at one twenty three mane street", streets) == "123 Main Street"
+        assert extract_address("the fire is at 305 west and avenue, Manhattan", streets) == "305 West End Avenue, Manhattan"
+        assert extract_address("my house 12 main st is burning", streets) == "12 Main Street"
+        assert extract_address("we live off some street", streets) is None
+
+    def test_load(self):
+        """Street lists load from a file, one name per line"""
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            f.write("# Manhattan\nMain Street\n\nBroadway\nMain St\n")
+        try:
+            index = StreetIndex.load(f.name)
+        finally:
+            os.remove(f.name)
+        assert len(index) == 2
+
+class TestEventFanout:
+    @pytest.fixture
+    def sent(self):
+        return []
+
+    @pytest.fixture
+    def fanout(self, sent):
+        # Clients acknowledge at once; a long interval keeps the flusher out of the way
+        def emit(event, frame, to=None, callback=None):
+            sent.append((to, frame))
+            callback()
+        fanout = EventFanout(emit, flush_interval=60)
+        fanout.join("room-client", "room")
+        yield fanout
+        fanout.shutdown()
+
+    def test_call_and_supervisor_rooms(self, fanout, sent):
+        """Call events reach only the clients in that call's room and the supervisors"""
+        fanout.join("caller-a", call_room("a"))
+        fanout.join("caller-b", call_room("b"))
+        fanout.join("supervisor", SUPERVISOR_ROOM)
+        fanout.publish_call("a", 'transcript_update', {'role': 'caller', 'message': "help"})
+        fanout.publish_call("b", 'transcript_update', {'role': 'caller', 'message': "fire"})
+        fanout.flush()
+
+        frames = dict(sent)
+        assert [e['data']['message'] for e in frames["caller-a"]['events']] == ["help"]
+        assert [e['data']['call_id'] for e in frames["supervisor"]['events']] == ["a", "b"]
+
+    def test_streamed_tokens_are_coalesced(self, fanout, sent):
+        """Tokens of one reply merge into one event, and the final text replaces them"""
+        for token in ["Help ", "is ", "coming."]:
+            fanout.publish("room", 'transcript_update', {'message': token, 'message_id': "m1", 'partial': True})
+        fanout.flush()
+        fanout.publish("room", 'transcript_update', {'message': "x", 'message_id': "m2", 'partial': True})
+        fanout.publish("room", 'transcript_update', {'message': "Stay calm.", 'message_id': "m2"})
+        fanout.flush()
+
+        first, second = [frame['events'] for _, frame in sent]
+        assert [e['data']['message'] for e in first] == ["Help is coming."]
+        assert second[0]['data'] == {'message': "Stay calm.", 'message_id': "m2"}
+        assert fanout.stats()['coalesced'] == 3
+
+    def test_incident_diffs_are_merged(self, fanout, sent):
+        """Queued diffs of one call collapse into a single diff"""
+        fanout.publish("room", 'incident_diff', {'call_id': "a", 'version': 1, 'changes': {
+            'type': {'value': 'FIRE', 'confidence': 0.6, 'first_seen': 1.0},
+            'units': {'🚒 Fire Engine': {'confidence': 0.6, 'first_seen': 1.0}}}})
+        fanout.publish("room", 'incident_diff', {'call_id': "a", 'version': 2, 'changes': {
+            'type': {'confidence': 0.76},
+            'units': {'🚑 Ambulance': {'confidence': 0.6, 'first_seen': 2.0}}}})
+        fanout.flush()
+
+        events = sent[0][1]['events']
+        assert len(events) == 1
+        diff = events[0]['data']
+        assert diff['version'] == 2
+        assert diff['changes']['type'] == {'value': 'FIRE', 'confidence': 0.76, 'first_seen': 1.0}
+        assert set(diff['changes']['units']) == {'🚒 Fire Engine', '🚑 Ambulance'}
+
+    def test_backlog_is_bounded(self, sent):
+        """A client that falls behind sheds streamed tokens first"""
+        fanout = EventFanout(lambda event, frame, to=None, callback=None: sent.append(frame), flush_interval=60,
+                             max_queued=3)
+        fanout.join("client", "room")
+        fanout.publish("room", 'transcript_update', {'message': "caller", 'role': 'caller'})
+        fanout.publish("room", 'transcript_update', {'message': "tok", 'message_id': "m1", 'partial': True})
+        fanout.publish("room", 'transcript_update', {'message': "next caller", 'role': 'caller'})
+        fanout.publish("room", 'transcript_update', {'message': "third caller", 'role': 'caller'})
+        fanout.shutdown()
+
+        assert [e['data']['message'] for e in sent[0]['events']] == ["caller", "next caller", "third caller"]
+        assert fanout.stats()['dropped'] == 1
+
+    def test_client_that_stops_reading_gets_merged_updates(self):
+        """A client that stops acknowledging is sent nothing while behind, then one merged frame"""
+        sent = {"fast": [], "slow": []}
+        acks = {"fast": [], "slow": []}
+
+        def emit(event, frame, to=None, callback=None):
+            sent[to].append(frame)
+            acks[to].append(callback)
+            if to == "fast":
+                callback()
+
+        fanout = EventFanout(emit, flush_interval=60, max_unacked=2)
+        fanout.join("fast", "room")
+        fanout.join("slow", "room")
+        for i in range(50):
+            fanout.publish("room", 'transcript_update', {'message': f"{i} ", 'message_id': "m1", 'partial': True})
+            fanout.publish("room", 'incident_diff', {'call_id': "a", 'version': i, 'changes': {
+                'type': {'value': 'FIRE', 'confidence': i / 50}}})
+            fanout.flush()
+
+        assert len(sent["fast"]) == 50
+        assert len(sent["slow"]) == 2
+        assert fanout.stats()['queued'] == 2  # one transcript and one diff, merged while waiting
+        assert fanout.stats()['clients_behind'] == 1
+
+        acks["slow"][0]()
+        fanout.flush()
+        caught_up = sent["slow"][-1]['events']
+        assert len(sent["slow"]) == 3 and len(caught_up) == 2
+        assert caught_up[0]['data']['message'] == "".join(f"{i} " for i in range(2, 50))
+        assert caught_up[1]['data']['version'] == 49
+        fanout.shutdown()
+
+    def test_frames_unacknowledged_for_too_long_are_written_off(self):
+        """A lost acknowledgement does not stall a client for good"""
+        now = [0.0]
+        sent = []
+        fanout = EventFanout(lambda event, frame, to=None, callback=None: sent.append(frame), flush_interval=60,
+                             max_unacked=1, ack_timeout=5.0, clock=lambda: now[0])
+        fanout.join("client", "room")
+        fanout.publish("room", 'transcript_update', {'message': "one"})
+        fanout.flush()
+        fanout.publish("room", 'transcript_update', {'message': "two"})
+        fanout.flush()
+        assert len(sent) == 1
+        now[0] = 6.0
+        fanout.flush()
+        assert len(sent) == 2
+        fanout.shutdown()
+
+    def test_leaving_drops_queued_events(self, fanout, sent):
+        fanout.join("watcher", "other")
+        fanout.publish("other", 'transcript_update', {'message': "hi"})
+        fanout.leave("watcher", "other")
+        fanout.publish("other", 'transcript_update', {'message': "again"})
+        fanout.flush()
+        assert sent == []
+
+    def test_publish_does_not_wait_for_slow_clients(self):
+        """A blocked emit stalls the flusher, never the publisher"""
+        release = threading.Event()
+        fanout = EventFanout(lambda event, frame, to=None, callback=None: release.wait(2), flush_interval=0.01)
+        fanout.join("client", "room")
+        started = time.time()
+        for i in range(1000):
+            fanout.publish("room", 'transcript_update', {'message': str(i), 'message_id': "m", 'partial': True})
+        assert time.time() - started < 1.0
+        release.set()
+        fanout.shutdown()
+
+class TestAsyncDispatcher:
+    class FakeAsyncClient:
+        """Async OpenAI stand-in: numbered transcripts, a two-sentence reply, short PCM"""
+
+        def __init__(self, latency=0.01, thinking=0.0):
+            self.latency = latency
+            self.thinking = thinking  # Delay between the run starting and its first token
+            self.transcribed = 0
+            self.in_flight = 0
+            self.max_in_flight = 0  # Most requests waiting at once, across all calls
+            self.deleted = []
+            self.spoken = []
+            self.beta = SimpleNamespace(threads=SimpleNamespace(
+                create=self.create_thread, delete=self.delete_thread,
+                messages=SimpleNamespace(create=self.create_message),
+                runs=SimpleNamespace(stream=self.stream)))
+            self.audio = SimpleNamespace(
+                transcriptions=SimpleNamespace(create=self.transcribe),
+                speech=SimpleNamespace(with_streaming_response=SimpleNamespace(create=self.speech)))
+
+        async def wait(self):
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                await asyncio.sleep(self.latency)
+            finally:
+                self.in_flight -= 1
+
+        async def create_thread(self):
+            await self.wait()
+            return SimpleNamespace(id="thread-1")
+
+        async def delete_thread(self, thread_id):
+            self.deleted.append(thread_id)
+
+        async def create_message(self, thread_id, role, content):
+            await asyncio.sleep(self.latency)
+            return SimpleNamespace(id=f"msg-{time.perf_counter_ns()}")
+
+        async def transcribe(self, model, file, response_format):
+            assert file[1][:4] == b"RIFF"
+            await self.wait()
+            self.transcribed += 1
+            return f"There is a fire at {self.transcribed}00 Main Street"
+
+        def stream(self, thread_id, assistant_id, timeout, **options):
+            latency = self.latency
+            thinking = self.thinking
+
+            class Stream:
+                current_run = None
+
+                async def __aenter__(self):
+                    return self
+
+                async def __aexit__(self, *exc):
+                    return False
+
+                @property
+                async def text_deltas(self):
+                    # The run-created event comes first, then the model thinks
+                    self.current_run = SimpleNamespace(id="run-1")
+                    await asyncio.sleep(thinking)
+                    for token in ["Help is ", "on the way. ", "Stay ", "on the line."]:
+                        await asyncio.sleep(latency / 4)
+                        yield token
+            return Stream()
+
+        def speech(self, model, voice, input, response_format):
+            self.spoken.append(input)
+
+            class Response:
+                async def __aenter__(self):
+                    return self
+
+                async def __aexit__(self, *exc):
+                    return False
+
+                async def iter_bytes(self, chunk_size):
+                    yield b"\x01\x00\x02"
+                    yield b"\x00"
+            return Response()
+
+    def call_audio(self, utterances=2):
+        t = np.arange(16000) / 16000
+        speech = (3000 * np.sin(2 * np.pi * 440 * t)).astype(np.int16)
+        quiet = np.random.default_rng(0).normal(0, 100, 32000).astype(np.int16)
+        return np.concatenate([quiet] + [np.concatenate([speech, quiet]) for _ in range(utterances)])
+
+    def dispatcher(self, client, session_id="call-1", events=None):
+        return AsyncEmergencyDispatcher(
+            session_id, client, "asst", source=ArraySource(self.call_audio(), speed=None),
+            sink=NullSink(), events=events, greeting="911, what's your emergency?")
+
+    def test_call_runs_through_every_stage(self):
+        """A replayed call is transcribed, answered and spoken entirely on the event loop"""
+        client = self.FakeAsyncClient()
+        events = Mock()
+        dispatcher = self.dispatcher(client, events=events)
+        # The replay runs faster than playback; barge-in would race the replies
+        dispatcher.barge_in_enabled = False
+        threads_before = threading.active_count()
+
+        asyncio.run(dispatcher.run())
+
+        assert threading.active_count() == threads_before
+        assert client.transcribed == 2
+        assert client.spoken == ["911, what's your emergency?"] + ["Help is on the way.", "Stay on the line."] * 2
+        assert dispatcher.sink.samples_written == 2 * 5
+        assert dispatcher.current_address == "200 Main Street"
+        assert client.deleted == ["thread-1"]
+        published = [c[0][1] for c in events.publish_call.call_args_list]
+        assert published.count('incident_diff') >= 2
+
+    def test_many_calls_share_one_loop(self):
+        """A hundred concurrent calls run as tasks, not threads"""
+        client = self.FakeAsyncClient(latency=0.05)
+        dispatchers = [self.dispatcher(client, f"call-{i}") for i in range(100)]
+
+        async def run_all():
+            await asyncio.gather(*(d.run() for d in dispatchers))
+
+        asyncio.run(run_all())
+
+        assert client.transcribed == 200
+        assert all(d.current_address for d in dispatchers)
+        # Requests of different calls wait on the network together, not one after another
+        assert client.max_in_flight > 10
+
+    def test_speech_cache_disk_reads_leave_the_loop(self, tmp_path):
+        """Cached speech is looked up in memory on the loop and read from disk on a thread"""
+        client = self.FakeAsyncClient()
+        cache = SpeechCache(str(tmp_path))
+        cache.put(cache.key("Help is on the way.", "tts-1", "shimmer"), b"\x05\x00", persist=True)
+        dispatcher = AsyncEmergencyDispatcher("call-1", client, "asst", sink=NullSink(),
+                                              cache=SpeechCache(str(tmp_path)))
+        loaded_on = []
+        load = dispatcher.cache.load
+        dispatcher.cache.load = lambda key: loaded_on.append(threading.current_thread()) or load(key)
+
+        async def speak_twice():
+            chunks = []
+            for _ in range(2):
+                queue = asyncio.Queue()
+                await dispatcher.synthesize("Help is on the way.", queue)
+                while (chunk := await queue.get()) is not None:
+                    chunks.append(chunk)
+            return chunks
+
+        assert asyncio.run(speak_twice()) == [b"\x05\x00"] * 2
+        assert client.spoken == []
+        assert len(loaded_on) == 1 and loaded_on[0] is not threading.main_thread()
+        assert dispatcher.cache.stats()['hits'] == 1
+
+    def test_barge_in_cancels_turn(self):
+        """Interrupting a turn before its first token still cancels its run"""
+        client = self.FakeAsyncClient(latency=0.2, thinking=1.0)
+        cancelled = []
+
+        async def cancel(run_id, thread_id):
+            cancelled.append(run_id)
+            return SimpleNamespace(status="cancelled")
+        client.beta.threads.runs.cancel = cancel
+        dispatcher = AsyncEmergencyDispatcher("call-1", client, "asst", sink=NullSink())
+        dispatcher.barge_in_enabled = True
+
+        async def scenario():
+            transcripts = asyncio.Queue()
+            sentences = asyncio.Queue()
+            dispatcher.thread_task = asyncio.create_task(client.create_thread())
+            responder = asyncio.create_task(dispatcher.respond(transcripts, sentences))
+            await transcripts.put("Someone collapsed")
+            await asyncio.sleep(0.5)  # Thread and message created, run still thinking
+            assert dispatcher.active_run_id is None
+            dispatcher.interrupt()
+            await transcripts.put(None)
+            await responder
+            queued = []
+            while not sentences.empty():
+                queued.append(sentences.get_nowait())
+            return queued
+
+        queued = asyncio.run(scenario())
+        assert cancelled == ["run-1"]
+        assert dispatcher.interruptions == 1
+        # Sentences already queued belong to the old generation, so speak() skips them
+        assert all(item is None or item[0] < dispatcher.generation for item in queued)
+
+    def test_session_manager_cancels_calls(self):
+        """Calls started by the async session manager end when asked"""
+        client = self.FakeAsyncClient()
+
+        def factory(session_id):
+            # Real-time pacing keeps the call running until it is ended
+            return AsyncEmergencyDispatcher(session_id, client, "asst",
+                                            source=ArraySource(self.call_audio(), speed=1.0), sink=NullSink())
+
+        manager = AsyncSessionManager(factory, max_sessions=1)
+        dispatcher = manager.start("sid-1")
+        assert manager.start("sid-2") is None
+        time.sleep(0.2)
+
+        assert manager.end("sid-1")
+        assert not dispatcher.call_in_progress
+        assert manager.active_count() == 0
+        assert client.deleted == ["thread-1"]
+
 if __name__ == "__main__":
-    pytest.main([__file__, "-v"])
\ No newline at end of file
+    pytest.main([__file__, "-v"])
+class TestFakeOpenAIServer:
+    @pytest.fixture
+    def fake(self):
+        server = FakeOpenAIServer(latency_scale=0.0, seed=1).start()
+        yield server
+        server.stop()
+
+    @pytest.fixture
+    def client(self, fake):
+        return openai.OpenAI(base_url=fake.url, api_key="test", max_retries=0)
+
+    def test_streamed_and_polled_runs(self, client):
+        thread = client.beta.threads.create()
+        client.beta.threads.messages.create(thread_id=thread.id, role="user", content="Fire!")
+        with client.beta.threads.runs.stream(thread_id=thread.id, assistant_id="asst") as stream:
+            streamed = "".join(stream.text_deltas)
+        assert streamed == DEFAULT_REPLIES[0]
+
+        run = client.beta.threads.runs.create(thread_id=thread.id, assistant_id="asst")
+        assert client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id).status == "completed"
+        newest = client.beta.threads.messages.list(thread_id=thread.id).data[0]
+        assert newest.role == "assistant" and newest.content[0].text.value == DEFAULT_REPLIES[1]
+
+    def test_polled_run_takes_its_sampled_duration(self, fake, client):
+        fake.latency = {endpoint: LatencyModel(0.0) for endpoint in fake.latency}
+        fake.latency['run_duration'] = LatencyModel(0.5)
+        fake.latency_scale = 1.0
+        thread = client.beta.threads.create()
+        run = client.beta.threads.runs.create(thread_id=thread.id, assistant_id="asst")
+        assert client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id).status == "in_progress"
+        assert client.beta.threads.runs.cancel(thread_id=thread.id, run_id=run.id).status == "cancelled"
+
+    def test_audio_endpoints(self, client):
+        text = client.audio.transcriptions.create(
+            model="whisper-1", file=("speech.wav", b"RIFF", "audio/wav"), response_format="text"
+        )
+        assert text == DEFAULT_TRANSCRIPTS[0]
+        with client.audio.speech.with_streaming_response.create(
+                model="tts-1", voice="shimmer", input="Help is on the way.", response_format="pcm") as response:
+            audio = b"".join(response.iter_bytes(4800))
+        assert len(audio) == 2 * int(len("Help is on the way.") * 0.06 * 24000)
+
+    def test_injected_errors(self, fake, client):
+        fake.error_rate = {'transcription': 1.0}
+        with pytest.raises(openai.InternalServerError):
+            client.audio.transcriptions.create(model="whisper-1", file=("speech.wav", b"RIFF", "audio/wav"))
+        client.beta.threads.create()
+        assert fake.stats()['errors'] == {'transcription': 1}
+
+    def test_latency_models(self):
+        assert LatencyModel(0.5).sample() == 0.5
+        assert LatencyModel.parse((0.5, 0.0)).sample(scale=2) == 1.0
+        model = LatencyModel(0.5, 0.5, random.Random(0))
+        samples = [model.sample() for _ in range(200)]
+        assert min(samples) < 0.5 < max(samples)
+
+    def test_dispatcher_turn_end_to_end(self, fake, client):
+        """A recorded utterance goes through transcription, a streamed reply and speech"""
+        sink = NullSink()
+        events = Mock()
+        dispatcher = EmergencyDispatcher(client=client, audio_sink=sink, events=events)
+        dispatcher.speaker.cache = None
+        t = np.arange(16000) / 16000
+        speech = (3000 * np.sin(2 * np.pi * 440 * t)).astype(np.int16)
+        try:
+            with patch('Main.get_geocoder'):
+                dispatcher.process_recorded_speech(speech)
+        finally:
+            dispatcher.cleanup()
+
+        messages = [c.args[2] for c in events.publish_call.call_args_list if c.args[1] == 'transcript_update']
+        assert messages[0]['message'] == DEFAULT_TRANSCRIPTS[0]
+        assert messages[-1]['role'] == 'dispatcher' and messages[-1]['message'] == DEFAULT_REPLIES[0]
+        assert sink.samples_written > 0
+        assert dispatcher.incident.value('location') == "123 Main Street"
+
+    def test_listing_after_a_message(self, client):
+        thread = client.beta.threads.create()
+        ids = [client.beta.threads.messages.create(thread_id=thread.id, role="user", content=str(i)).id
+               for i in range(3)]
+        listed = client.beta.threads.messages.list(thread_id=thread.id, order="asc", after=ids[0])
+        assert [m.id for m in listed.data] == ids[1:]
+
+    def test_context_holds_each_message_once(self, client):
+        """Streamed and polled turns mirror every thread message exactly once"""
+        dispatcher = EmergencyDispatcher(client=client, audio_sink=NullSink(), events=Mock())
+        dispatcher.speaker.cache = None
+        dispatcher.fast_path_enabled = False
+        try:
+            for i, streamed in enumerate([True, False, False, True, False]):
+                dispatcher.stream_responses = streamed
+                with patch('Main.get_geocoder'):
+                    dispatcher.respond(f"Turn {i}")
+            listed = client.beta.threads.messages.list(thread_id=dispatcher.thread.id, order="asc", limit=100)
+            ids = [message_id for message_id, _, _ in dispatcher.context.messages]
+            assert len(ids) == len(set(ids)) == 10
+            assert ids == [message.id for message in listed.data]
+        finally:
+            dispatcher.cleanup()
+
+class TestBenchmark:
+    def test_report_covers_every_stage(self):
+        audio = synthetic_call(turns=1, speech=1.0)
+        with patch.object(Main, '_geocoder'):
+            report = run_benchmark(calls=2, concurrency=2, audio=audio, speed=None, latency_scale=0.0)
+
+        assert report['turns'] == 2 and report['failed_calls'] == 0
+        assert report['turns_without_audio'] == 0
+        for stage in STAGES:
+            assert report['latency'][stage]['count'] == 2
+        end_to_end = report['latency']['end_to_end']
+        assert end_to_end['p50_ms'] <= end_to_end['p95_ms'] <= end_to_end['p99_ms']
+        assert report['calls_per_second'] > 0 and report['resources']['max_rss_mb'] > 0
+        json.dumps(report)
+
+    def test_turn_stages(self):
+        turn = Turn(speech_end=1.0, enqueued=2.5)
+        turn.started, turn.transcribed, turn.first_token = 2.5, 3.0, 3.5
+        assert turn.durations() == {'endpoint': 1.5, 'queue': 0.0, 'transcription': 0.5, 'first_token': 0.5}
+        turn.first_audio = 4.0
+        assert turn.durations()['end_to_end'] == 3.0
+
+    def test_compare_flags_regressions(self):
+        baseline = {'latency': {'end_to_end': {'p95_ms': 1000.0}, 'queue': None}, 'calls_per_second': 2.0}
+        report = {'latency': {'end_to_end': {'p95_ms': 1050.0}, 'queue': {'p95_ms': 5.0}}, 'calls_per_second': 2.0}
+        assert compare(baseline, report) == []
+        report['latency']['end_to_end']['p95_ms'] = 1200.0
+        report['calls_per_second'] = 1.5
+        assert len(compare(baseline, report)) == 2
+
+class TestMetrics:
+    def test_prometheus_text_format(self):
+        registry = MetricsRegistry()
+        calls = registry.counter('api_calls_total', 'API calls', ('endpoint',))
+        calls.inc(endpoint='transcription')
+        calls.inc(2, endpoint='transcription')
+        registry.gauge('queue_depth', 'Queued').set_function(lambda: 3)
+        latency = registry.histogram('stage_seconds', 'Stage time', ('stage',), buckets=(0.1, 1.0))
+        latency.observe(0.05, stage='vad')
+        latency.observe(0.5, stage='vad')
+
+        text = registry.render()
+        assert '# TYPE api_calls_total counter\n' in text
+        assert 'api_calls_total{endpoint="transcription"} 3\n' in text
+        assert 'queue_depth 3\n' in text
+        assert 'stage_seconds_bucket{stage="vad",le="0.1"} 1\n' in text
+        assert 'stage_seconds_bucket{stage="vad",le="+Inf"} 2\n' in text
+        assert 'stage_seconds_count{stage="vad"} 2\n' in text
+        assert registry.counter('api_calls_total', 'API calls', ('endpoint',)) is calls
+        with pytest.raises(ValueError):
+            calls.inc(stage='vad')
+
+    def test_nested_spans_and_errors(self, tmp_path):
+        registry = MetricsRegistry()
+        tracer = Tracer(registry)
+        with tracer.span('call-1', 'turn'):
+            with tracer.span('call-1', 'transcription'):
+                pass
+            with pytest.raises(RuntimeError):
+                with tracer.span('call-1', 'run_stream'):
+                    raise RuntimeError("boom")
+        tracer.record('call-1', 'vad_wait', 0.6)
+
+        spans = {span['name']: span for span in tracer.export('call-1')['spans']}
+        assert spans['transcription']['parent'] == spans['turn']['id']
+        assert 'boom' in spans['run_stream']['attrs']['error']
+        assert spans['vad_wait']['duration'] == 0.6 and spans['vad_wait']['parent'] is None
+        assert tracer.stage_errors.value(stage='run_stream') == 1
+        assert tracer.stage_seconds.snapshot(stage='turn')['count'] == 1
+        assert tracer.export('call-2') is None
+
+        path = tracer.write('call-1', str(tmp_path))
+        with open(path) as f:
+            assert json.load(f)['trace_id'] == 'call-1'
+
+    def test_dispatcher_stages_are_traced(self):
+        client = MagicMock()
+        client.audio.transcriptions.create.return_value = "Help"
+        stream = client.beta.threads.runs.stream.return_value.__enter__.return_value
+        stream.text_deltas = ["Stay calm."]
+        dispatcher = EmergencyDispatcher(session_id="traced-call", client=client, events=Mock())
+        before = Main.api_calls_total.value(endpoint='transcription', outcome='ok')
+        try:
+            with patch.object(dispatcher.speaker, 'open'):
+                dispatcher.process_recorded_speech(np.ones(8000, dtype=np.int16))
+        finally:
+            dispatcher.cleanup()
+
+        names = [span['name'] for span in Main.tracer.export("traced-call")['spans']]
+        for stage in ('utterance', 'asr', 'transcription', 'turn', 'message_create', 'run_stream',
+                      'first_token', 'incident_update'):
+            assert stage in names
+        assert Main.api_calls_total.value(endpoint='transcription', outcome='ok') == before + 1
+
+        response = Main.app.test_client().get('/metrics')
+        assert response.status_code == 200
+        assert 'dispatch_stage_seconds_bucket{stage="transcription"' in response.get_data(as_text=True)
+        assert Main.app.test_client().get('/trace/traced-call').get_json()['trace_id'] == "traced-call"
+        assert Main.app.test_client().get('/trace/nobody').status_code == 404
+
+class TestThreadContext:
+    def test_short_calls_are_sent_whole(self):
+        context = ThreadContext(keep_messages=4, max_tokens=100)
+        context.add('user', "Fire!", "msg-1")
+        context.add('assistant', "Where are you?", "msg-2")
+        assert context.run_options() == {}
+        assert context.last_message_id == "msg-2"
+
+    def test_older_turns_roll_into_a_summary(self):
+        context = ThreadContext(keep_messages=4, max_tokens=100, summary_chars=650)
+        context.add('user', "There's a fire in my kitchen", "msg-0")
+        for i in range(1, 20):
+            context.add('user' if i % 2 == 0 else 'assistant', f"Message number {i} " + "words " * 20, f"msg-{i}")
+
+        options = context.run_options({'type': 'FIRE', 'location': '12 Main St', 'units': ['Engine'],
+                                       'victim_status': None})
+        summary = options['additional_instructions']
+        assert options['truncation_strategy']['last_messages'] == 4
+        assert "Caller: There's a fire in my kitchen" in summary
+        assert "type: FIRE; location: 12 Main St; units: Engine" in summary
+        assert "earlier messages omitted" in summary
+        assert "Message number 15" in summary and "Message number 16" not in summary
+        assert len(summary) < 800
+
+    def test_listed_messages_are_mirrored(self):
+        def message(id, role, text):
+            return SimpleNamespace(id=id, role=role, content=[SimpleNamespace(text=SimpleNamespace(value=text))])
+        context = ThreadContext()
+        reply = context.add_listed([message("msg-1", "user", "Help"), message("msg-2", "assistant", "On the way")])
+        assert reply == "On the way" and len(context) == 2 and context.last_message_id == "msg-2"
+        # Listing the same messages again, or a streamed reply already recorded, adds nothing
+        context.add('assistant', "Stay calm", "msg-3")
+        assert context.add_listed([message("msg-2", "assistant", "On the way"),
+                                   message("msg-3", "assistant", "Stay calm")]) is None
+        assert len(context) == 3
+
+class ImmediateExecutor:
+    """Runs submitted work on the calling thread."""
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+class WordBackend:
+    """Fake local recognizer: every half second of audio is one word named after its sample value.
+
+    A word still being spoken (under half a second) comes out garbled, as
+    Whisper's guess at a cut-off word would.
+    """
+
+    name = "words"
+    streaming = True
+
+    def words(self, audio):
+        audio = np.asarray(audio).reshape(len(audio), -1)[:, 0]
+        words = []
+        for start in range(0, len(audio), 8000):
+            word = audio[start:start + 8000]
+            text = f"w{int(word[0])}" if len(word) == 8000 else "uh"
+            words.append((text, start / 16000, (start + len(word)) / 16000))
+        return words
+
+    def transcribe(self, audio):
+        return " ".join(word for word, _, _ in self.words(audio))
+
+class TestTranscription:
+    @staticmethod
+    def spoken(*values):
+        return np.concatenate([np.full(8000, value, dtype=np.int16) for value in values])
+
+    def test_words_two_passes_agree_on_are_confirmed(self):
+        confirmed = []
+        stream = ChunkedStream(WordBackend(), chunk=1.0, executor=ImmediateExecutor(),
+                               on_confirmed=lambda s, text: confirmed.append(text))
+        stream.feed(self.spoken(1, 2))
+        assert stream.confirmed == [] and stream.passes == 1
+        stream.feed(self.spoken(3, 4))
+        assert confirmed == ["w1 w2"]
+        # Confirmed speech is dropped, so later passes only see the rest
+        assert stream.offset == 16000 and len(stream._audio()) == 16000
+        stream.feed(self.spoken(5))
+        assert stream.passes == 2
+        assert stream.finish(timeout=1) == "w1 w2 w3 w4 w5"
+        assert confirmed == ["w1 w2"]
+
+    def test_disagreeing_passes_confirm_nothing(self):
+        stream = ChunkedStream(WordBackend(), chunk=0.75, executor=ImmediateExecutor())
+        stream.feed(np.concatenate([self.spoken(1), np.full(4000, 2, dtype=np.int16)]))
+        stream.feed(np.concatenate([np.full(4000, 2, dtype=np.int16), self.spoken(3)]))
+        # "uh" from the first pass became "w2" in the second
+        assert stream.confirmed == ["w1"]
+        assert stream.finish() == "w1 w2 w3"
+
+    def test_fallback_skips_a_failing_backend_for_a_while(self):
+        now = [0.0]
+        primary = Mock(transcribe=Mock(side_effect=RuntimeError("503")))
+        primary.name = "openai"
+        secondary = Mock(transcribe=Mock(return_value="help"))
+        secondary.name = "local"
+        transcriber = FallbackTranscriber([primary, secondary], retry_after=30, clock=lambda: now[0])
+
+        assert transcriber.transcribe(np.ones(10)) == "help"
+        assert transcriber.transcribe(np.ones(10)) == "help"
+        assert primary.transcribe.call_count == 1
+        now[0] = 31
+        primary.transcribe.side_effect = None
+        primary.transcribe.return_value = "fire"
+        assert transcriber.transcribe(np.ones(10)) == "fire"
+        assert transcriber.name == "openai+local"
+
+    def test_all_backends_failing_raises(self):
+        backend = Mock(transcribe=Mock(side_effect=RuntimeError("down")))
+        backend.name = "openai"
+        with pytest.raises(RuntimeError):
+            FallbackTranscriber([backend]).transcribe(np.ones(10))
+
+    def test_openai_backend_uploads_wav(self):
+        client = MagicMock()
+        client.audio.transcriptions.create.return_value = " Help \n"
+        transcriber = OpenAITranscriber(client)
+        assert transcriber.transcribe(np.ones(1600, dtype=np.int16)) == "Help"
+        upload = client.audio.transcriptions.create.call_args.kwargs['file']
+        assert upload[0] == "speech.wav" and upload[1][:4] == b"RIFF"
+
+class TestFastPath:
+    @pytest.mark.parametrize("text,intent", [
+        ("My husband collapsed and he isn't breathing", 'NOT_BREATHING'),
+        ("my daughter is choking on a grape", 'CHOKING'),
+        ("I just heard gunshots next door", 'SHOOTING'),
+        ("There's a fire in the kitchen at 123 Main Street", 'STRUCTURE_FIRE'),
+        ("the house is on fire", 'STRUCTURE_FIRE'),
+        ("I smell gas in the basement", 'GAS_LEAK'),
+        ("he's bleeding badly from his leg", 'SEVERE_BLEEDING'),
+        ("Someone just broke into the house next door", None),
+        ("There's no fire in the kitchen, just smoke from the oven", None),
+        ("I don't smell gas anymore", None),
+        ("I need to report a fender bender", None),
+        # A negation only reaches to the end of its clause, and "not breathing" is never negated
+        ("He is not breathing", 'NOT_BREATHING'),
+        ("No, he is not breathing", 'NOT_BREATHING'),
+        ("No he's not breathing!", 'NOT_BREATHING'),
+        ("No, my house is on fire", 'STRUCTURE_FIRE'),
+        ("Not sure, I smell gas", 'GAS_LEAK'),
+        ("I'm not sure but there's a gas leak", 'GAS_LEAK'),
+        ("He's not choking", None),
+    ])
+    def test_intents(self, text, intent):
+        assert FastPath().match(text) == intent
+
+    def test_most_urgent_intent_wins(self):
+        assert FastPath().match("The house is on fire and my dad is not breathing") == 'NOT_BREATHING'
+
+    def test_each_instruction_given_once_per_call(self):
+        fast_path = FastPath()
+        intent, instruction = fast_path.instruction_for("There's a gas leak")
+        assert intent == 'GAS_LEAK' and instruction in protocol_instructions()
+        assert fast_path.instruction_for("The gas leak is getting worse") is None
+        assert FastPath().instruction_for("There's a gas leak") is not None
+
+    def test_instructions_are_prewarmed(self):
+        assert all(instruction in Main.PREWARM_PHRASES for _, _, instruction in PROTOCOLS)
+
+class TestResilience:
+    def test_upstream_failures_are_retried_with_jitter(self):
+        sleep = Mock()
+        policy = StagePolicy('transcription', timeout=5, attempts=3, backoff=0.2, sleep=sleep)
+        request = Mock(side_effect=[ConnectionError("reset"), TimeoutError("slow"), "Help"])
+        retried = []
+        assert policy.call(request, on_retry=retried.append) == "Help"
+        assert [c.args[0] for c in request.call_args_list] == [5, 5, 5]
+        assert len(retried) == 2
+        assert 0 <= sleep.call_args_list[0].args[0] <= 0.2 and 0 <= sleep.call_args_list[1].args[0] <= 0.4
+
+    def test_bad_requests_are_not_retried(self):
+        policy = StagePolicy('message_create', timeout=5, attempts=3, sleep=Mock())
+        request = Mock(side_effect=ValueError("bad request"))
+        with pytest.raises(ValueError):
+            policy.call(request)
+        assert request.call_count == 1 and not policy.breaker.is_open()
+
+    def test_timeouts_shrink_to_the_deadline(self):
+        now = [0.0]
+        deadline = Deadline(4, clock=lambda: now[0])
+        policy = StagePolicy('run_retrieve', timeout=5)
+        request = Mock(return_value="ok")
+        policy.call(request, deadline)
+        assert request.call_args.args[0] == 4
+        now[0] = 4
+        with pytest.raises(DeadlineExceeded):
+            policy.call(request, deadline)
+        assert StagePolicy('speech', timeout=5, deadline_bound=False).call(request, deadline) == "ok"
+
+    def test_circuit_opens_then_lets_one_trial_through(self):
+        now = [0.0]
+        breaker = CircuitBreaker('speech', failures=2, reset_after=10, clock=lambda: now[0])
+        policy = StagePolicy('speech', timeout=5, breaker=breaker)
+        failing = Mock(side_effect=ConnectionError("down"))
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                policy.call(failing)
+        with pytest.raises(CircuitOpen):
+            policy.call(failing)
+        assert failing.call_count == 2
+
+        now[0] = 10
+        breaker.before()  # The trial request
+        with pytest.raises(CircuitOpen):
+            breaker.before()
+        breaker.success()
+        assert policy.call(Mock(return_value="ok")) == "ok"
+
+    def test_slow_attempt_is_hedged(self):
+        policy = StagePolicy('transcription', timeout=5, hedge=True, min_hedge_delay=0.05)
+        for _ in range(20):
+            policy.latency.observe(0.01)
+        calls = []
+
+        def request(timeout):
+            calls.append(timeout)
+            if len(calls) == 1:
+                time.sleep(0.5)
+                return "slow"
+            return "fast"
+        discarded = threading.Event()
+        hedged = []
+
+        started = time.perf_counter()
+        result = policy.call(request, discard=lambda result: discarded.set(), on_hedge=lambda: hedged.append(1))
+        assert result == "fast" and time.perf_counter() - started < 0.3
+        assert hedged == [1] and calls[1] < 5
+        assert discarded.wait(1)
+
+    def test_hedge_fires_while_first_attempts_fill_the_pool(self):
+        """Duplicates have slots of their own, and a first attempt never waits for a slot"""
+        pool = HedgePool(attempt_workers=2, hedge_workers=1)
+        release = threading.Event()
+        other_call = pool.submit_attempt(release.wait, 2)  # Another call's attempt, stuck upstream
+        policy = StagePolicy('speech', timeout=5, hedge=True, min_hedge_delay=0.05, pool=pool)
+        for _ in range(20):
+            policy.latency.observe(0.01)
+        calls = []
+
+        def request(timeout):
+            calls.append(timeout)
+            if len(calls) == 1:
+                release.wait(2)
+                return "slow"
+            return "fast"
+        hedged = []
+        started = time.perf_counter()
+        assert policy.call(request, on_hedge=lambda: hedged.append(1)) == "fast"
+        assert hedged == [1] and time.perf_counter() - started < 0.5
+
+        # Every slot is now taken; the next call runs on this thread instead of queueing
+        assert pool.submit_attempt(release.wait, 2) is None
+        assert policy.call(lambda timeout: threading.current_thread()) is threading.current_thread()
+        release.set()
+        other_call.result()
+
+    def test_no_hedging_before_latencies_are_known(self):
+        policy = StagePolicy('speech', timeout=5, hedge=True)
+        request = Mock(return_value="ok")
+        assert policy.call(request) == "ok" and request.call_count == 1
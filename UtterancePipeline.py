@@ -0,0 +1,127 @@
+import threading
+import queue
+import time
+from collections import deque
+
+
+class UtterancePipeline:
+    """Bounded worker pool that processes finished utterances off the audio thread.
+
+    Work for different calls runs in parallel, while utterances from the same
+    call are handled one at a time in the order they were spoken. submit()
+    never blocks: when the pool is saturated the utterance is dropped and
+    counted, so the audio callback can't stall.
+    """
+
+    def __init__(self, workers=4, max_pending=64, on_wait=None):
+        self.max_pending = max_pending
+        self.on_wait = on_wait  # Called with (call_id, seconds queued) as work starts
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.pending = {}  # call id -> deque of queued utterances
+        self.busy = set()  # call ids queued for, or held by, a worker
+        self.ready = queue.Queue()
+        self.depth = 0
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.dequeued = 0
+        self.total_wait = 0.0
+
+        self.workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._work, name=f"utterance-worker-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, call_id, handler, *args):
+        """Queue handler(*args) for call_id; returns False if it was dropped."""
+        with self.lock:
+            if self.depth >= self.max_pending:
+                self.dropped += 1
+                return False
+            self.pending.setdefault(call_id, deque()).append((time.time(), handler, args))
+            self.depth += 1
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, self.depth)
+            if call_id not in self.busy:
+                self.busy.add(call_id)
+                self.ready.put(call_id)
+        return True
+
+    def discard(self, call_id):
+        """Drop utterances still waiting for a call that has ended."""
+        with self.lock:
+            items = self.pending.get(call_id)
+            if items:
+                self.depth -= len(items)
+                items.clear()
+
+    def wait_for(self, call_id, timeout=None):
+        """Block until every utterance queued for call_id has been handled."""
+        with self.idle:
+            return self.idle.wait_for(lambda: call_id not in self.busy, timeout)
+
+    def _work(self):
+        while True:
+            call_id = self.ready.get()
+            if call_id is None:
+                return
+
+            with self.lock:
+                items = self.pending.get(call_id)
+                item = items.popleft() if items else None
+                if item:
+                    self.depth -= 1
+                    self.dequeued += 1
+                    self.total_wait += time.time() - item[0]
+
+            if item:
+                enqueued_at, handler, args = item
+                if self.on_wait is not None:
+                    self.on_wait(call_id, time.time() - enqueued_at)
+                try:
+                    handler(*args)
+                    ok = True
+                except Exception as e:
+                    print(f"Error processing utterance for {call_id}: {e}")
+                    ok = False
+
+            with self.lock:
+                if item:
+                    if ok:
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+                # Keep the call with one worker until its queue drains
+                if self.pending.get(call_id):
+                    self.ready.put(call_id)
+                else:
+                    self.pending.pop(call_id, None)
+                    self.busy.discard(call_id)
+                    self.idle.notify_all()
+
+    def metrics(self):
+        """Snapshot of queue depth and throughput counters."""
+        with self.lock:
+            return {
+                'workers': len(self.workers),
+                'queue_depth': self.depth,
+                'max_queue_depth': self.max_depth,
+                'max_pending': self.max_pending,
+                'active_calls': len(self.busy),
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'avg_wait': self.total_wait / self.dequeued if self.dequeued else 0.0
+            }
+
+    def shutdown(self):
+        for _ in self.workers:
+            self.ready.put(None)
+        for worker in self.workers:
+            worker.join(1.0)
@@ -0,0 +1,248 @@
+import numpy as np
+from collections import deque
+
+# RMS over mean absolute amplitude for Gaussian noise; puts RMS scores on the scale of the
+# original mean-amplitude threshold (speech and Laplacian noise run higher, never lower)
+RMS_PER_MEAN_ABS = np.sqrt(np.pi / 2)
+
+
+def frame_signal(audio, frame_samples):
+    """Split a 1-D signal into a (frames, frame_samples) view, dropping any partial tail."""
+    audio = np.asarray(audio).reshape(-1)
+    count = len(audio) // frame_samples
+    return audio[:count * frame_samples].reshape(count, frame_samples)
+
+
+class VoiceActivityDetector:
+    """Base class for voice activity detectors.
+
+    Subclasses implement score(), which maps a batch of frames to one score
+    per frame in a single vectorized pass. This class turns scores into
+    speech decisions with separate on/off thresholds (hysteresis) and a
+    hangover that keeps speech active for a few frames after the score drops.
+    """
+
+    def __init__(self, threshold=700, hangover_frames=3):
+        self.threshold = threshold
+        self.hangover_frames = hangover_frames
+        self.active = False
+        self.hangover = 0
+
+    def score(self, frames):
+        raise NotImplementedError
+
+    def thresholds(self):
+        """Return the (on, off) score thresholds for the next frame."""
+        return self.threshold, self.threshold
+
+    def track_noise(self, score):
+        """Hook for adaptive detectors to follow the background level, frame by frame."""
+
+    def observe_noise(self, frames):
+        """Hook for adaptive detectors to learn from frames judged as non-speech."""
+
+    def reset(self):
+        self.active = False
+        self.hangover = 0
+
+    def detect_batch(self, frames):
+        """Return one speech decision per row of a (frames, samples) array."""
+        frames = np.atleast_2d(np.asarray(frames, dtype=np.float32))
+        scores = self.score(frames)
+        decisions = np.zeros(len(scores), dtype=bool)
+        for i, score in enumerate(scores):
+            on, off = self.thresholds()
+            if score > (off if self.active else on):
+                self.active = True
+                self.hangover = self.hangover_frames
+            elif self.hangover > 0:
+                self.hangover -= 1
+            else:
+                self.active = False
+            decisions[i] = self.active
+            self.track_noise(score)
+
+        if len(scores) and not decisions.all():
+            self.observe_noise(frames[~decisions])
+        return decisions
+
+    def detect_array(self, audio, frame_samples):
+        """Score a whole recording at once, frame by frame."""
+        return self.detect_batch(frame_signal(audio, frame_samples))
+
+    def is_speech(self, chunk):
+        """Decide whether a single chunk of audio is speech."""
+        return bool(self.detect_batch(np.asarray(chunk).reshape(1, -1))[0])
+
+
+class AmplitudeVAD(VoiceActivityDetector):
+    """Mean absolute amplitude against a fixed threshold (the original detector)."""
+
+    def __init__(self, threshold=700, hangover_frames=0, **kwargs):
+        super().__init__(threshold, hangover_frames)
+
+    def score(self, frames):
+        return np.abs(frames).mean(axis=1)
+
+
+class EnergyVAD(VoiceActivityDetector):
+    """RMS energy against a noise floor that adapts to the room.
+
+    threshold is on the mean-amplitude scale of AmplitudeVAD and is compared
+    with RMS as threshold * sqrt(pi/2). Both the on and the off threshold
+    stay at or above that level, so for Gaussian noise the detector is no
+    more sensitive than the fixed threshold it replaces, and for noise with
+    heavier tails it is less sensitive. In noise the on/off thresholds rise
+    to a multiple of the measured floor. The floor is
+    the quietest frame of the last floor_window frames, which follows steady
+    noise quickly but is not pulled up by speech, since speech always has
+    pauses.
+    """
+
+    def __init__(self, threshold=700, on_ratio=3.0, off_ratio=2.0, floor_window=100,
+                 hangover_frames=3, **kwargs):
+        super().__init__(threshold, hangover_frames)
+        self.level = threshold * RMS_PER_MEAN_ABS
+        self.on_ratio = on_ratio
+        self.off_ratio = off_ratio
+        self.recent_scores = deque(maxlen=floor_window)
+
+    @property
+    def noise_floor(self):
+        return min(self.recent_scores) if self.recent_scores else 0.0
+
+    def score(self, frames):
+        return np.sqrt(np.mean(np.square(frames), axis=1))
+
+    def thresholds(self):
+        floor = self.noise_floor
+        on = max(self.level, floor * self.on_ratio)
+        off = max(self.level, floor * self.off_ratio)
+        return on, off
+
+    def track_noise(self, score):
+        self.recent_scores.append(float(score))
+
+    def reset(self):
+        super().reset()
+        self.recent_scores.clear()
+
+
+class ZeroCrossingVAD(EnergyVAD):
+    """Energy gated by zero-crossing rate.
+
+    Broadband hiss and fan noise cross zero far more often than voiced
+    speech, so frames whose crossing rate is above max_zcr score zero.
+    """
+
+    def __init__(self, threshold=700, max_zcr=0.35, **kwargs):
+        super().__init__(threshold, **kwargs)
+        self.max_zcr = max_zcr
+
+    def zero_crossing_rate(self, frames):
+        signs = np.signbit(frames)
+        return np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+
+    def score(self, frames):
+        energy = super().score(frames)
+        return np.where(self.zero_crossing_rate(frames) <= self.max_zcr, energy, 0.0)
+
+
+class SpectralFluxVAD(EnergyVAD):
+    """Positive spectral change against a learned noise spectrum.
+
+    Each frame's magnitude spectrum in the speech band is compared with a
+    running average of the background spectrum; only energy that rises
+    above the background counts, which ignores steady hum and traffic.
+    """
+
+    def __init__(self, threshold=700, sample_rate=16000, band=(300, 3400),
+                 threshold_scale=0.5, spectrum_alpha=0.1, **kwargs):
+        super().__init__(threshold * threshold_scale, **kwargs)
+        self.sample_rate = sample_rate
+        self.spectrum_alpha = spectrum_alpha
+        self.band = band
+        self.noise_spectrum = None
+        self.frame_length = None
+        self.window = None
+        self.in_band = None
+
+    def spectrum(self, frames):
+        n = frames.shape[1]
+        if self.frame_length != n:
+            # Window and band mask only depend on the frame length
+            self.frame_length = n
+            self.window = np.hanning(n).astype(np.float32)
+            freqs = np.fft.rfftfreq(n, 1.0 / self.sample_rate)
+            self.in_band = (freqs >= self.band[0]) & (freqs <= self.band[1])
+        magnitude = np.abs(np.fft.rfft(frames * self.window, axis=1)) / (n / 2)
+        return magnitude[:, self.in_band]
+
+    def score(self, frames):
+        spectra = self.spectrum(frames)
+        if self.noise_spectrum is None or self.noise_spectrum.shape[0] != spectra.shape[1]:
+            self.noise_spectrum = np.zeros(spectra.shape[1], dtype=np.float32)
+        flux = np.maximum(spectra - self.noise_spectrum, 0.0)
+        # Scale back to amplitude units so thresholds are comparable with EnergyVAD
+        return np.sqrt(np.sum(np.square(flux), axis=1) / 2)
+
+    def observe_noise(self, frames):
+        spectra = self.spectrum(frames).mean(axis=0)
+        self.noise_spectrum += self.spectrum_alpha * (spectra - self.noise_spectrum)
+
+    def reset(self):
+        super().reset()
+        self.noise_spectrum = None
+
+
+VAD_TYPES = {
+    'amplitude': AmplitudeVAD,
+    'energy': EnergyVAD,
+    'zcr': ZeroCrossingVAD,
+    'flux': SpectralFluxVAD,
+}
+
+
+def create_vad(kind, threshold=700, sample_rate=16000, **kwargs):
+    """Build a detector by name: amplitude, energy, zcr or flux."""
+    if kind not in VAD_TYPES:
+        raise ValueError(f"Unknown voice activity detector: {kind}")
+    return VAD_TYPES[kind](threshold=threshold, sample_rate=sample_rate, **kwargs)
+
+
+class AdaptiveEndpointer:
+    """Learns how much silence ends this caller's turn.
+
+    Pauses inside an utterance (after which the caller kept talking) are
+    remembered, along with turns that were cut too early (the caller spoke
+    again right after the cut). The end-of-utterance window is a little
+    longer than the caller's usual long pause, kept between min_silence and
+    max_silence. Until any pauses have been seen it is max_silence.
+    """
+
+    def __init__(self, min_silence=0.5, max_silence=1.5, margin=0.25, history=20, quantile=0.9, min_pause=0.2):
+        self.min_silence = min_silence
+        self.min_pause = min_pause
+        self.max_silence = max_silence
+        self.margin = margin
+        self.quantile = quantile
+        self.pauses = deque(maxlen=history)
+
+    def window(self):
+        """Seconds of silence that end the current utterance."""
+        if not self.pauses:
+            return self.max_silence
+        typical = float(np.quantile(np.asarray(self.pauses), self.quantile))
+        return min(self.max_silence, max(self.min_silence, typical + self.margin))
+
+    def observe_pause(self, seconds):
+        """A pause of this length did not end the caller's turn."""
+        # Gaps between words say nothing about where turns end
+        if seconds >= self.min_pause:
+            self.pauses.append(seconds)
+
+    def observe_resumed(self, window, gap):
+        """The caller spoke again `gap` seconds after a turn was ended by `window` of silence."""
+        # Coming back this quickly means the turn was cut mid-thought
+        if gap < self.min_silence:
+            self.observe_pause(window + gap)